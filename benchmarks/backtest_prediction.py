@@ -0,0 +1,124 @@
+"""
+offline backtest of utils.prediction.SpaceForecaster: fit on the history
+before the last day, replay the last day through observe / predict and report
+the MAE against the actual space (next to the "no change" baseline) and the
+batch prediction throughput
+
+run from the repo root:
+    python -m benchmarks.backtest_prediction --lots 50 --days 15 --step 5
+
+DB_URL points it to an existing database, otherwise a SQLite file is filled
+with synthetic history
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.join(os.path.dirname(__file__), os.path.pardir))
+
+if not os.getenv("DB_URL"):
+    db_path = os.path.join(tempfile.mkdtemp(), "backtest.db")
+    os.environ["DB_URL"] = f"sqlite:///{db_path}"
+    os.environ["DB_ASYNC_URL"] = f"sqlite+aiosqlite:///{db_path}"
+    SYNTHETIC = True
+else:
+    SYNTHETIC = False
+
+import numpy as np
+from sqlalchemy import func
+
+from benchmarks.datagen import populate_db
+from db import model
+from utils.db_connect import SessionLocal, engine
+from utils.prediction import SpaceForecaster
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lots", type=int, default=50)
+    parser.add_argument("--days", type=int, default=15)
+    parser.add_argument(
+        "--step", type=int, default=5, help="minutes between records"
+    )
+    parser.add_argument("--minutes", default="15,30,60", help="horizons to test")
+    args = parser.parse_args()
+    horizons = [int(m) for m in args.minutes.split(",")]
+
+    if SYNTHETIC:
+        populate_db(
+            engine, args.lots, args.days * 1440 // args.step, step_minutes=args.step
+        )
+
+    forecaster = SpaceForecaster()
+    with SessionLocal() as db:
+        test_day = db.query(func.max(model.ParkinglotSpace.updateDate)).scalar()
+        forecaster.fit(db, until=test_day)
+        test_rows = (
+            db.query(model.ParkinglotSpace)
+            .filter(model.ParkinglotSpace.updateDate == test_day)
+            .order_by(model.ParkinglotSpace.updateTime)
+            .all()
+        )
+
+    # (lot, time) -> row and time -> rows of the test day
+    by_key, by_time = {}, defaultdict(list)
+    for r in test_rows:
+        t = datetime.combine(r.updateDate, r.updateTime)
+        by_key[(r.parkinglot_id, t)] = r
+        by_time[t].append(r)
+
+    errors = {m: {"model": [], "baseline": []} for m in horizons}
+    for t in sorted(by_time):
+        rows = by_time[t]
+        forecaster.observe(rows)
+        for m in horizons:
+            pred = forecaster.predict(
+                [r.parkinglot_id for r in rows],
+                [(r.carAvail, r.motoAvail) for r in rows],
+                [(r.carTotal, r.motoTotal) for r in rows],
+                [r.updateDay for r in rows],
+                [r.updateTime.hour * 60 + r.updateTime.minute for r in rows],
+                m,
+            )
+            for r, (car_pred, moto_pred) in zip(rows, pred.tolist()):
+                truth = by_key.get((r.parkinglot_id, t + timedelta(minutes=m)))
+                if truth is None:
+                    continue
+                errors[m]["model"].append(abs(car_pred - truth.carAvail))
+                errors[m]["baseline"].append(abs(r.carAvail - truth.carAvail))
+
+    # throughput of one big batch
+    n = 100000
+    lot_ids = list(forecaster.lot_index) or [0]
+    ids = [lot_ids[i % len(lot_ids)] for i in range(n)]
+    avail, total = np.full((n, 2), 50), np.full((n, 2), 100)
+    day, minute_of_day = np.zeros(n, dtype=int), np.full(n, 720)
+    start = time.perf_counter()
+    forecaster.predict(ids, avail, total, day, minute_of_day, 30)
+    per_sec = n / (time.perf_counter() - start)
+
+    results = {
+        "test_day": str(test_day),
+        "lots": len(forecaster.lot_index),
+        "predictions_per_sec": per_sec,
+        "car_mae": {
+            m: {k: float(np.mean(v)) if v else None for k, v in e.items()}
+            for m, e in errors.items()
+        },
+    }
+    for m, e in results["car_mae"].items():
+        print(
+            f"{m:3d} min ahead  car MAE model {e['model']:.2f}  "
+            f"no-change {e['baseline']:.2f}"
+        )
+    print(f"{per_sec:,.0f} predictions/sec")
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
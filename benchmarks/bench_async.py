@@ -0,0 +1,153 @@
+"""
+compare the sync (threadpool + blocking Session) and the async (AsyncSession)
+request path of the database backed endpoints under concurrent load:
+/parking/space/{id}/typical queries the aggregates through a session per
+request on both sides. /parking is kept for reference, the async app serves it
+from the pre-rendered payload, so that row compares a query per request with
+no database access at all
+
+run from the repo root:
+    python -m benchmarks.bench_async --lots 200 --rows 300 --concurrency 64
+
+DB_URL / DB_ASYNC_URL point it to an empty local postgres, otherwise a SQLite
+file is used as stand-in (aiosqlite runs each connection in a thread, so the
+numbers there mostly show the request path overhead, not the driver)
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+from typing import Callable, List, Optional
+
+sys.path.append(os.path.join(os.path.dirname(__file__), os.path.pardir))
+
+if not os.getenv("DB_URL"):
+    db_path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    os.environ["DB_URL"] = f"sqlite:///{db_path}"
+    os.environ["DB_ASYNC_URL"] = f"sqlite+aiosqlite:///{db_path}"
+
+import httpx
+from fastapi import Depends, FastAPI
+from sqlalchemy.orm import Session
+
+from benchmarks.datagen import populate_db
+from benchmarks.stats import percentile
+from db import model, schema
+from utils.aggregate import rebuild_space_aggregates, typical_curve_query
+from utils.db_connect import engine, get_db
+
+
+def build_sync_app() -> FastAPI:
+    """
+    the blocking versions of the handlers, as they were before the async path
+    """
+    sync_app = FastAPI()
+
+    @sync_app.get("/parking")
+    def get_parkinglot(db: Session = Depends(get_db)):
+        return [
+            {c.name: getattr(x, c.name) for c in x.__table__.columns}
+            for x in db.query(model.ParkinglotInfo).all()
+        ]
+
+    @sync_app.get("/parking/space/{parking_id}/typical")
+    def get_typical_parkingspace(
+        parking_id: int,
+        day: Optional[int] = None,
+        resolution: schema.AggResolution = schema.AggResolution.min15,
+        db: Session = Depends(get_db),
+    ):
+        return [
+            x._asdict()
+            for x in db.execute(typical_curve_query(parking_id, resolution, day))
+        ]
+
+    return sync_app
+
+
+async def run_load(
+    app: FastAPI, make_url: Callable[[], str], n_requests: int, concurrency: int
+) -> dict:
+    latencies: List[float] = []
+    semaphore = asyncio.Semaphore(concurrency)
+    transport = httpx.ASGITransport(app=app)
+
+    async with httpx.AsyncClient(
+        transport=transport, base_url="http://bench"
+    ) as client:
+
+        async def one():
+            async with semaphore:
+                start = time.perf_counter()
+                response = await client.get(make_url())
+                latencies.append(time.perf_counter() - start)
+                response.raise_for_status()
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(n_requests)))
+        wall = time.perf_counter() - start
+
+    return {
+        "requests": n_requests,
+        "concurrency": concurrency,
+        "throughput": n_requests / wall,
+        "p50_ms": percentile(latencies, 0.5) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lots", type=int, default=200)
+    parser.add_argument("--rows", type=int, default=300, help="records per lot")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    args = parser.parse_args()
+
+    populate_db(engine, args.lots, args.rows)
+    with engine.begin() as conn:
+        rebuild_space_aggregates(None, conn)
+
+    # imported after the tables are filled, so no upstream fetch is triggered
+    import main as api
+
+    # what the startup warmup loads (without its scheduler, which would fetch
+    # the upstream), /parking answers 503 until the payload is rendered
+    api.load_caches()
+
+    scenarios = {
+        "/parking": lambda: "/parking",
+        "/parking/space/{id}/typical": lambda: (
+            f"/parking/space/{random.randint(1, args.lots)}/typical"
+            f"?day={random.randint(0, 6)}"
+        ),
+    }
+
+    async def run_all() -> List[dict]:
+        # one event loop for every scenario, the async engine pool is bound to it
+        results = []
+        for mode, app in (("sync", build_sync_app()), ("async", api.app)):
+            for name, make_url in scenarios.items():
+                result = await run_load(app, make_url, args.requests, args.concurrency)
+                result.update(mode=mode, endpoint=name)
+                results.append(result)
+                print(
+                    f"{mode:5s} {name:30s} {result['throughput']:8.1f} req/s  "
+                    f"p50 {result['p50_ms']:7.2f} ms  p99 {result['p99_ms']:7.2f} ms"
+                )
+
+        await api.async_engine.dispose()
+
+        return results
+
+    results = asyncio.run(run_all())
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+per-cycle CPU cost of turning the raw official feed into insertable rows:
+pydantic path (parse_feed + process_parking_data) vs the fast path
+(parse_parking_rows)
+
+run from the repo root:
+    python -m benchmarks.bench_parse --lots 10000 --cycles 5
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.join(os.path.dirname(__file__), os.path.pardir))
+
+from benchmarks.datagen import load_feed
+from utils.fetch_parking import parse_feed
+from utils.process import parse_parking_rows, process_parking_data
+
+
+def scaled_feed(n_lots: int, when: datetime, seed: int = 0) -> bytes:
+    """
+    the sample feed repeated up to `n_lots` lots, with fresh counts and
+    update times like one upstream cycle
+    """
+    rng = random.Random(seed)
+    feed = load_feed()
+    records = []
+    for i in range(n_lots):
+        r = dict(feed[i % len(feed)])
+        r["PARKINGNAME"] = f"{r['PARKINGNAME']}-{i}"
+        r["FREEQUANTITY"] = rng.randint(0, max(r["TOTALQUANTITY"], 0))
+        r["FREEQUANTITYMOT"] = rng.randint(0, max(r["TOTALQUANTITYMOT"], 0))
+        t = when - timedelta(
+            seconds=rng.randint(0, 59), milliseconds=rng.randint(0, 999)
+        )
+        r["UPDATETIME"] = t.isoformat(timespec="milliseconds")[:-1]
+        records.append(r)
+
+    return json.dumps(records, ensure_ascii=False).encode("utf-8")
+
+
+def pydantic_path(raw: bytes) -> list:
+    return [p.model_dump() for p in process_parking_data(parse_feed(raw))]
+
+
+def fast_path(raw: bytes) -> list:
+    return [p._asdict() for p in parse_parking_rows(raw)]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lots", type=int, default=10000)
+    parser.add_argument("--cycles", type=int, default=5)
+    args = parser.parse_args()
+
+    start = datetime.now().replace(second=0, microsecond=0)
+    payloads = [
+        scaled_feed(args.lots, start + timedelta(minutes=i), seed=i)
+        for i in range(args.cycles)
+    ]
+
+    results = {}
+    for name, fn in (("pydantic", pydantic_path), ("fast", fast_path)):
+        cpu = []
+        for raw in payloads:
+            t = time.process_time()
+            fn(raw)
+            cpu.append(time.process_time() - t)
+        results[name] = {
+            "lots": args.lots,
+            "first_cycle_ms": cpu[0] * 1000,
+            "mean_cycle_ms": sum(cpu) / len(cpu) * 1000,
+        }
+        print(
+            f"{name:9s} first cycle {cpu[0] * 1000:8.1f} ms  "
+            f"mean {sum(cpu) / len(cpu) * 1000:8.1f} ms CPU per {args.lots} lots"
+        )
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+"""
+load test of the /parking/stream fan-out: thousands of SSE subscribers on one
+uvicorn worker, spread over subscription groups, and the delay from a publish
+to the delivery of the diff to every subscriber
+
+run from the repo root:
+    python -m benchmarks.bench_stream --clients 5000 --groups 200 --rounds 5
+
+the server (one worker, same hub and stream code as the API) runs in a child
+process, the subscribers are plain asyncio sockets in this one
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import multiprocessing
+from typing import List
+
+sys.path.append(os.path.join(os.path.dirname(__file__), os.path.pardir))
+
+from benchmarks.stats import percentile
+
+
+def run_server(port: int, n_lots: int):
+    import uvicorn
+    from datetime import date, datetime
+    from fastapi import FastAPI, Query
+    from fastapi.responses import StreamingResponse
+
+    from db import schema
+    from utils.stream import space_hub
+
+    spaces = {
+        i: schema.ParkinglotSpace(
+            id=i,
+            carAvail=50,
+            carTotal=100,
+            motoAvail=50,
+            motoTotal=100,
+            updateDate=date.today(),
+            updateDay=date.today().weekday(),
+            updateTime=datetime.now().time(),
+            parkinglot_id=i,
+        )
+        for i in range(1, n_lots + 1)
+    }
+    bench_app = FastAPI()
+
+    @bench_app.on_event("startup")
+    async def startup_event():
+        space_hub.bind(asyncio.get_running_loop())
+
+    @bench_app.get("/stream")
+    async def stream(ids: List[int] = Query(...)):
+        return StreamingResponse(
+            space_hub.stream(ids, lambda: (0, [spaces[i] for i in ids if i in spaces])),
+            media_type="text/event-stream",
+        )
+
+    @bench_app.post("/publish")
+    async def publish(version: int):
+        changed = [
+            s.model_copy(update={"carAvail": (s.carAvail + version) % 100})
+            for s in spaces.values()
+        ]
+        # from another thread, like the ingest job
+        await asyncio.to_thread(space_hub.publish, version, changed)
+        return {}
+
+    @bench_app.get("/info")
+    async def info():
+        return space_hub.info()
+
+    uvicorn.run(
+        bench_app, host="127.0.0.1", port=port, log_level="warning", backlog=4096
+    )
+
+
+async def http_call(port: int, method: str, path: str) -> bytes:
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(
+        f"{method} {path} HTTP/1.1\r\nHost: bench\r\nContent-Length: 0\r\n"
+        "Connection: close\r\n\r\n".encode()
+    )
+    body = await reader.read()
+    writer.close()
+    return body.split(b"\r\n\r\n", 1)[-1]
+
+
+async def subscriber(port: int, ids: List[int], ready: asyncio.Event, state: dict):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    query = "&".join(f"ids={i}" for i in ids)
+    writer.write(
+        f"GET /stream?{query} HTTP/1.1\r\nHost: bench\r\n"
+        "Accept: text/event-stream\r\n\r\n".encode()
+    )
+    await reader.readuntil(b"\r\n\r\n")
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                return
+            if line.startswith(b"event: snapshot"):
+                state["ready"] += 1
+                if state["ready"] == state["clients"]:
+                    ready.set()
+            elif line.startswith(b"event: diff"):
+                state["latency"].append(time.perf_counter() - state["published_at"])
+                if len(state["latency"]) == state["clients"]:
+                    state["done"].set()
+    finally:
+        writer.close()
+
+
+async def run_clients(args, port: int) -> dict:
+    rng = random.Random(0)
+    groups = [
+        rng.sample(range(1, args.lots + 1), args.group_size)
+        for _ in range(args.groups)
+    ]
+
+    ready = asyncio.Event()
+    state = {"clients": args.clients, "ready": 0, "latency": []}
+    tasks = []
+    start = time.perf_counter()
+    for i in range(args.clients):
+        tasks.append(
+            asyncio.create_task(
+                subscriber(port, groups[i % len(groups)], ready, state)
+            )
+        )
+        if i % 500 == 499:
+            await asyncio.sleep(0.05)
+    await asyncio.wait_for(ready.wait(), 120)
+    connect_s = time.perf_counter() - start
+
+    rounds = []
+    for version in range(1, args.rounds + 1):
+        state["latency"] = []
+        state["done"] = asyncio.Event()
+        state["published_at"] = time.perf_counter()
+        await http_call(port, "POST", f"/publish?version={version}")
+        await asyncio.wait_for(state["done"].wait(), 120)
+        latency = state["latency"]
+        rounds.append(
+            {
+                "p50_ms": percentile(latency, 0.5) * 1000,
+                "p99_ms": percentile(latency, 0.99) * 1000,
+                "max_ms": max(latency) * 1000,
+            }
+        )
+        print(
+            f"round {version}: delivered to {len(latency)} subscribers  "
+            f"p50 {rounds[-1]['p50_ms']:.1f} ms  p99 {rounds[-1]['p99_ms']:.1f} ms  "
+            f"max {rounds[-1]['max_ms']:.1f} ms"
+        )
+        await asyncio.sleep(0.2)
+
+    hub_info = json.loads(await http_call(port, "GET", "/info"))
+    for t in tasks:
+        t.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+    return {
+        "clients": args.clients,
+        "groups": args.groups,
+        "connect_s": connect_s,
+        "hub": hub_info,
+        "rounds": rounds,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=5000)
+    parser.add_argument("--groups", type=int, default=200)
+    parser.add_argument("--group-size", type=int, default=10, help="lots per group")
+    parser.add_argument("--lots", type=int, default=500)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--port", type=int, default=8766)
+    args = parser.parse_args()
+
+    server = multiprocessing.Process(
+        target=run_server, args=(args.port, args.lots), daemon=True
+    )
+    server.start()
+    try:
+        for _ in range(100):
+            try:
+                asyncio.run(http_call(args.port, "GET", "/info"))
+                break
+            except OSError:
+                time.sleep(0.1)
+
+        results = asyncio.run(run_clients(args, args.port))
+    finally:
+        server.terminate()
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
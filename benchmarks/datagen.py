@@ -0,0 +1,107 @@
+import os
+import json
+import math
+import random
+from datetime import datetime, timedelta
+from typing import List
+
+from sqlalchemy import insert
+from sqlalchemy.engine import Engine
+
+from db import model
+
+FEED_PATH = os.path.join(
+    os.path.dirname(__file__), os.path.pardir, "data", "GetParkInfo.json"
+)
+
+
+def load_feed() -> List[dict]:
+    with open(FEED_PATH, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def occupancy(t: datetime, phase: float) -> float:
+    """
+    share of the lot that is free at `t`: a daily cycle (busy around noon and
+    in the evening), busier on weekdays
+    """
+    minute = t.hour * 60 + t.minute
+    daily = 0.3 * math.cos(2 * math.pi * (minute / 1440 + phase))
+    evening = 0.15 * math.cos(2 * math.pi * (minute - 1110) / 1440 * 2)
+    weekday = -0.1 if t.weekday() < 5 else 0.05
+
+    return min(max(0.55 + daily - evening + weekday, 0.0), 1.0)
+
+
+def noisy(value: float, total: int, rng: random.Random) -> int:
+    return min(max(round(value + rng.gauss(0, 3)), 0), total)
+
+
+def populate_db(
+    bind: Engine,
+    n_lots: int,
+    n_rows: int,
+    seed: int = 0,
+    step_minutes: int = 1,
+    chunk_size: int = 50000,
+):
+    """
+    fill a fresh database with `n_lots` parking lots (copies of the sample feed
+    scattered around Hsinchu) and `n_rows` records per lot, one every
+    `step_minutes` minutes up to now, following a daily occupancy cycle
+    """
+    rng = random.Random(seed)
+    model.Base.metadata.create_all(bind=bind)
+
+    feed = load_feed()
+    infos, totals = [], {}
+    for i in range(1, n_lots + 1):
+        src = feed[(i - 1) % len(feed)]
+        totals[i] = (
+            rng.randint(20, 600),
+            rng.choice([0, 50, 100, 300]),
+            rng.random(),
+        )
+        infos.append(
+            dict(
+                id=i,
+                name=f"{src['PARKINGNAME']}-{i}",
+                address=src["ADDRESS"],
+                startHour=rng.choice([0, 0, 0, 6, 7, 8]),
+                endHour=rng.choice([24, 24, 22, 23]),
+                carChargeFeeWeek=rng.choice([15, 20, 30, 40]),
+                carChargeFeeHoli=rng.choice([20, 30, 40, 50]),
+                motoChargeFeeWeek=rng.choice([0, 10, 20]),
+                motoChargeFeeHoli=rng.choice([0, 10, 20]),
+                latitude=24.78 + rng.random() * 0.06,
+                longitude=120.94 + rng.random() * 0.06,
+            )
+        )
+
+    with bind.begin() as conn:
+        conn.execute(insert(model.ParkinglotInfo), infos)
+
+    end = datetime.now().replace(second=0, microsecond=0)
+    spaces = []
+    for m in range(n_rows):
+        t = end - timedelta(minutes=(n_rows - m) * step_minutes)
+        for i, (car_total, moto_total, phase) in totals.items():
+            free = occupancy(t, phase)
+            spaces.append(
+                dict(
+                    carAvail=noisy(car_total * free, car_total, rng),
+                    carTotal=car_total,
+                    motoAvail=noisy(moto_total * free, moto_total, rng),
+                    motoTotal=moto_total,
+                    updateDate=t.date(),
+                    updateDay=t.weekday(),
+                    updateTime=t.time(),
+                    updateDatetime=t,
+                    parkinglot_id=i,
+                )
+            )
+
+        if len(spaces) >= chunk_size or m == n_rows - 1:
+            with bind.begin() as conn:
+                conn.execute(insert(model.ParkinglotSpace), spaces)
+            spaces = []
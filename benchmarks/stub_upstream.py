@@ -0,0 +1,117 @@
+"""
+local stand-in for the official parking feed, serving data/GetParkInfo.json
+with ETag / Last-Modified support
+
+run from the repo root:
+    python -m benchmarks.stub_upstream --port 8765 [--fail-rate 0.2] [--change]
+
+then point the ingest to it with PARKING_FEED_URLS=http://127.0.0.1:8765/feed
+"""
+import os
+import sys
+import json
+import random
+import hashlib
+import argparse
+import threading
+from datetime import datetime, timezone
+from email.utils import format_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional
+
+sys.path.append(os.path.join(os.path.dirname(__file__), os.path.pardir))
+
+from benchmarks.datagen import load_feed
+
+
+class StubFeed:
+    """
+    the payload served by the stub, `update` bumps UPDATETIME and the counts
+    like a new upstream cycle would
+    """
+
+    def __init__(self, records: Optional[List[dict]] = None):
+        self._lock = threading.Lock()
+        self.records = records if records is not None else load_feed()
+        self.requests = 0
+        self._render()
+
+    def _render(self):
+        self.body = json.dumps(self.records, ensure_ascii=False).encode("utf-8")
+        self.etag = '"' + hashlib.sha256(self.body).hexdigest()[:32] + '"'
+        self.last_modified = format_datetime(datetime.now(timezone.utc), usegmt=True)
+
+    def update(self, when: Optional[datetime] = None):
+        when = when or datetime.now()
+        with self._lock:
+            for r in self.records:
+                r["UPDATETIME"] = when.strftime("%Y-%m-%dT%H:%M:%S")
+                r["FREEQUANTITY"] = random.randint(0, max(r["TOTALQUANTITY"], 0))
+                r["FREEQUANTITYMOT"] = random.randint(
+                    0, max(r["TOTALQUANTITYMOT"], 0)
+                )
+            self._render()
+
+
+def make_handler(feed: StubFeed, fail_rate: float = 0.0, change: bool = False):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            feed.requests += 1
+            if fail_rate and random.random() < fail_rate:
+                self.send_response(503)
+                self.end_headers()
+                return
+
+            if change:
+                feed.update()
+
+            if self.headers.get("If-None-Match") == feed.etag:
+                self.send_response(304)
+                self.send_header("ETag", feed.etag)
+                self.end_headers()
+                return
+
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(feed.body)))
+            self.send_header("ETag", feed.etag)
+            self.send_header("Last-Modified", feed.last_modified)
+            self.end_headers()
+            self.wfile.write(feed.body)
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+def serve(
+    port: int = 0, feed: Optional[StubFeed] = None, **kwargs
+) -> ThreadingHTTPServer:
+    """
+    start the stub in a background thread, the bound port is
+    server.server_address[1]
+    """
+    feed = feed or StubFeed()
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(feed, **kwargs))
+    server.feed = feed
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    parser.add_argument(
+        "--change", action="store_true", help="serve a new payload on every request"
+    )
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(
+        ("127.0.0.1", args.port),
+        make_handler(StubFeed(), fail_rate=args.fail_rate, change=args.change),
+    )
+    print(f"serving on http://127.0.0.1:{args.port}/feed")
+    server.serve_forever()
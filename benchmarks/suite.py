@@ -0,0 +1,309 @@
+"""
+offline benchmark suite of the API and the ingest: fills a database with N
+synthetic lots and M days of history, serves a matching feed from the stub
+upstream, then measures throughput and p50 / p99 latency of every /parking*
+endpoint and the wall time of get_parking_data cycles
+
+run from the repo root:
+    python -m benchmarks.suite --lots 500 --days 7 --output results.json
+    python -m benchmarks.suite --lots 500 --days 7 --compare results.json
+
+DB_URL / DB_ASYNC_URL point it to an empty local postgres, otherwise a SQLite
+file is used as stand-in. With --compare the run exits with status 1 if any
+scenario got slower than the baseline by more than --tolerance.
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import platform
+import argparse
+import tempfile
+import subprocess
+from datetime import datetime, timedelta
+from typing import Callable, List, Optional, Tuple
+
+sys.path.append(os.path.join(os.path.dirname(__file__), os.path.pardir))
+
+if not os.getenv("DB_URL"):
+    db_path = os.path.join(tempfile.mkdtemp(), "suite.db")
+    os.environ["DB_URL"] = f"sqlite:///{db_path}"
+    os.environ["DB_ASYNC_URL"] = f"sqlite+aiosqlite:///{db_path}"
+
+import httpx
+
+from benchmarks.stats import percentile
+from benchmarks.datagen import load_feed, populate_db
+from benchmarks.stub_upstream import StubFeed, serve
+
+# (method, url, json body)
+Request = Tuple[str, str, Optional[dict]]
+
+
+def feed_records(n_lots: int) -> List[dict]:
+    """
+    the sample feed expanded to the lots populate_db created
+    """
+    feed = load_feed()
+    records = []
+    for i in range(1, n_lots + 1):
+        r = dict(feed[(i - 1) % len(feed)])
+        r["PARKINGNAME"] = f"{r['PARKINGNAME']}-{i}"
+        records.append(r)
+
+    return records
+
+
+def random_site(rng: random.Random) -> Tuple[float, float]:
+    # the area populate_db scatters the lots over
+    return 24.78 + rng.random() * 0.06, 120.94 + rng.random() * 0.06
+
+
+def crowd_site(rng: random.Random) -> Tuple[float, float]:
+    # the crowd of an event: one of a few venues, give or take ~50 m
+    venue = random.Random(rng.randrange(3)).random()
+    return (
+        24.78 + venue * 0.06 + rng.uniform(-0.0005, 0.0005),
+        120.94 + venue * 0.06 + rng.uniform(-0.0005, 0.0005),
+    )
+
+
+def build_scenarios(n_lots: int) -> List[Tuple[str, Callable[[random.Random], Request]]]:
+    def lot(rng):
+        return rng.randint(1, n_lots)
+
+    def nearby(path, site=random_site):
+        def make(rng):
+            lat, lng = site(rng)
+            return "GET", f"{path}?lat={lat}&lng={lng}&minutes=30", None
+
+        return make
+
+    def batch(rng):
+        points = []
+        for _ in range(50):
+            lat, lng = random_site(rng)
+            points.append({"lat": lat, "lng": lng, "minutes": rng.randint(0, 60)})
+        return "POST", "/parking/predict/batch", {"points": points}
+
+    return [
+        ("/parking", lambda rng: ("GET", "/parking", None)),
+        ("/parking/version", lambda rng: ("GET", "/parking/version", None)),
+        ("/parking/space", lambda rng: ("GET", "/parking/space", None)),
+        (
+            "/parking/space/{id}",
+            lambda rng: ("GET", f"/parking/space/{lot(rng)}", None),
+        ),
+        (
+            "/parking/space/{id}/latest",
+            lambda rng: ("GET", f"/parking/space/{lot(rng)}/latest", None),
+        ),
+        (
+            "/parking/space/{id}/typical",
+            lambda rng: ("GET", f"/parking/space/{lot(rng)}/typical", None),
+        ),
+        ("/parking/nearby", nearby("/parking/nearby")),
+        ("/parking/predict", nearby("/parking/predict")),
+        ("/parking/predict (crowd)", nearby("/parking/predict", crowd_site)),
+        ("/parking/rank", nearby("/parking/rank")),
+        ("/parking/predict/batch (50 sites)", batch),
+    ]
+
+
+async def run_load(
+    client: httpx.AsyncClient,
+    make_request: Callable[[random.Random], Request],
+    n_requests: int,
+    concurrency: int,
+    seed: int = 0,
+) -> dict:
+    rng = random.Random(seed)
+    requests = [make_request(rng) for _ in range(n_requests)]
+    latencies: List[float] = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(method: str, url: str, body: Optional[dict]):
+        async with semaphore:
+            start = time.perf_counter()
+            response = await client.request(method, url, json=body)
+            latencies.append(time.perf_counter() - start)
+            response.raise_for_status()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(*r) for r in requests))
+    wall = time.perf_counter() - start
+
+    return {
+        "requests": n_requests,
+        "concurrency": concurrency,
+        "throughput": n_requests / wall,
+        "p50_ms": percentile(latencies, 0.5) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+    }
+
+
+def run_ingest(api, feed: StubFeed, cycles: int) -> dict:
+    """
+    wall time of full get_parking_data cycles, each on a new upstream payload
+    """
+    walls = []
+    for i in range(cycles):
+        feed.update(datetime.now() + timedelta(minutes=i + 1))
+        start = time.perf_counter()
+        api.get_parking_data()
+        walls.append(time.perf_counter() - start)
+
+    return {
+        "cycles": cycles,
+        "lots": len(feed.records),
+        "mean_ms": sum(walls) / len(walls) * 1000,
+        "max_ms": max(walls) * 1000,
+    }
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=os.path.dirname(__file__),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> List[str]:
+    """
+    scenarios slower than the baseline by more than `tolerance` (a ratio)
+    """
+    regressions = []
+    old = {x["endpoint"]: x for x in baseline.get("endpoints", [])}
+    for x in results["endpoints"]:
+        base = old.get(x["endpoint"])
+        if base is None:
+            continue
+        p99 = x["p99_ms"] / base["p99_ms"]
+        throughput = x["throughput"] / base["throughput"]
+        print(
+            f"{x['endpoint']:36s} p99 x{p99:5.2f}  throughput x{throughput:5.2f}"
+        )
+        if p99 > 1 + tolerance or throughput < 1 / (1 + tolerance):
+            regressions.append(x["endpoint"])
+
+    if "ingest" in baseline:
+        wall = results["ingest"]["mean_ms"] / baseline["ingest"]["mean_ms"]
+        print(f"{'get_parking_data':36s} wall x{wall:5.2f}")
+        if wall > 1 + tolerance:
+            regressions.append("get_parking_data")
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lots", type=int, default=500)
+    parser.add_argument("--days", type=int, default=7)
+    parser.add_argument(
+        "--step", type=int, default=10, help="minutes between history records"
+    )
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--cycles", type=int, default=5, help="ingest cycles")
+    parser.add_argument("--output", help="write the results to this json file")
+    parser.add_argument("--compare", help="baseline results json to compare to")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    # the upstream and the database are set up before the app is imported
+    feed = StubFeed(feed_records(args.lots))
+    stub = serve(0, feed)
+    os.environ["PARKING_FEED_URLS"] = (
+        f"http://127.0.0.1:{stub.server_address[1]}/feed"
+    )
+
+    from utils.db_connect import engine
+    from utils.aggregate import rebuild_space_aggregates
+
+    start = time.perf_counter()
+    populate_db(engine, args.lots, args.days * 1440 // args.step, step_minutes=args.step)
+    with engine.begin() as conn:
+        rebuild_space_aggregates(None, conn)
+    print(f"populated in {time.perf_counter() - start:.1f} s")
+
+    import main as api
+    from utils.db_connect import SessionLocal
+    from utils.payload import load_info_payload
+    from utils.prediction import fit_forecaster
+
+    # what the startup event does, without starting the scheduler
+    with SessionLocal() as db:
+        api.parkinglot_index.load(db)
+        api.lot_ranker.load(db)
+        api.latest_space.load(db)
+        load_info_payload(db)
+    fit_forecaster()
+
+    async def run_all() -> List[dict]:
+        # one event loop for every scenario, the async engine pool is bound to it
+        results = []
+        transport = httpx.ASGITransport(app=api.app)
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://bench"
+        ) as client:
+            for name, make_request in build_scenarios(args.lots):
+                result = await run_load(
+                    client, make_request, args.requests, args.concurrency
+                )
+                result.update(endpoint=name)
+                results.append(result)
+                print(
+                    f"{name:36s} {result['throughput']:8.1f} req/s  "
+                    f"p50 {result['p50_ms']:7.2f} ms  p99 {result['p99_ms']:7.2f} ms"
+                )
+
+        await api.async_engine.dispose()
+
+        return results
+
+    endpoints = asyncio.run(run_all())
+    ingest = run_ingest(api, feed, args.cycles)
+    print(
+        f"{'get_parking_data':36s} mean {ingest['mean_ms']:8.1f} ms  "
+        f"max {ingest['max_ms']:8.1f} ms per {ingest['lots']} lots"
+    )
+    stub.shutdown()
+
+    results = {
+        "meta": {
+            "revision": git_revision(),
+            "time": datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "database": api.engine.dialect.name,
+            "lots": args.lots,
+            "days": args.days,
+            "step_minutes": args.step,
+        },
+        "endpoints": endpoints,
+        "ingest": ingest,
+    }
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print("regressions: ", ", ".join(regressions))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,9 +4,25 @@ if __name__ == "__main__":
 
     sys.path.append(os.path.join(os.path.dirname(__file__), os.path.pardir))
 
-from sqlalchemy import Column, Integer, String, Date, Time, ForeignKey, Float
+import os
+
+from sqlalchemy import (
+    Column,
+    Integer,
+    BigInteger,
+    String,
+    Date,
+    Time,
+    DateTime,
+    ForeignKey,
+    Float,
+    Index,
+)
 from sqlalchemy.ext.declarative import declarative_base
 
+# range partition parkinglotSpace by month (postgres only, for new tables)
+DB_PARTITION_SPACE = os.getenv("DB_PARTITION_SPACE", "").lower() in ("1", "true")
+
 Base = declarative_base()
 
 
@@ -28,8 +44,13 @@ class ParkinglotInfo(Base):
 
 class ParkinglotSpace(Base):
     __tablename__ = "parkinglotSpace"
+    __table_args__ = (
+        {"postgresql_partition_by": 'RANGE ("updateDate")'}
+        if DB_PARTITION_SPACE
+        else {}
+    )
 
-    id = Column(Integer, primary_key=True, nullable=False)
+    id = Column(Integer, primary_key=True, autoincrement=True, nullable=False)
     carAvail = Column(Integer, nullable=False)
     carTotal = Column(Integer, nullable=False)
     motoAvail = Column(Integer, nullable=False)
@@ -37,4 +58,97 @@ class ParkinglotSpace(Base):
     updateDate = Column(Date, nullable=False)
     updateDay = Column(Integer, nullable=False)
     updateTime = Column(Time, nullable=False)
+    updateDatetime = Column(DateTime)
+    # change-only ingest: last time the same space was reported and how many
+    # reports the record stands for (NULL: only the record itself)
+    lastSeen = Column(DateTime)
+    seenCount = Column(Integer)
     parkinglot_id = Column(Integer, ForeignKey("parkinglotInfo.id", ondelete="cascade"))
+
+    if DB_PARTITION_SPACE:
+        # the partition key has to be part of the primary key
+        updateDate = Column(Date, primary_key=True, nullable=False)
+
+
+# natural key of a record, used to skip duplicates on insert. Ordered like the
+# "latest first" reads and covering the other columns, so getting the latest
+# space of a lot is an index-only lookup
+Index(
+    "ux_parkinglotSpace_lot_date_time",
+    ParkinglotSpace.parkinglot_id,
+    ParkinglotSpace.updateDate.desc(),
+    ParkinglotSpace.updateTime.desc(),
+    unique=True,
+    postgresql_include=[
+        "id",
+        "carAvail",
+        "carTotal",
+        "motoAvail",
+        "motoTotal",
+        "updateDay",
+        "updateDatetime",
+        "lastSeen",
+        "seenCount",
+    ],
+)
+
+# records extended by the change-only ingest, for the followers to pick up
+Index(
+    "ix_parkinglotSpace_lastSeen",
+    ParkinglotSpace.lastSeen,
+    postgresql_where=ParkinglotSpace.lastSeen.is_not(None),
+    sqlite_where=ParkinglotSpace.lastSeen.is_not(None),
+)
+
+
+class ParkinglotSpaceAgg(Base):
+    """
+    running aggregates of parkinglotSpace per lot, weekday and time bucket
+    (bucket is the start minute of the day, bucketMinutes is 5, 15 or 60)
+    """
+
+    __tablename__ = "parkinglotSpaceAgg"
+
+    parkinglot_id = Column(
+        Integer,
+        ForeignKey("parkinglotInfo.id", ondelete="cascade"),
+        primary_key=True,
+    )
+    updateDay = Column(Integer, primary_key=True)
+    bucketMinutes = Column(Integer, primary_key=True)
+    bucket = Column(Integer, primary_key=True)
+    count = Column(Integer, nullable=False)
+    carAvailSum = Column(BigInteger, nullable=False)
+    carAvailMin = Column(Integer, nullable=False)
+    carAvailMax = Column(Integer, nullable=False)
+    motoAvailSum = Column(BigInteger, nullable=False)
+    motoAvailMin = Column(Integer, nullable=False)
+    motoAvailMax = Column(Integer, nullable=False)
+
+
+class ParkinglotSpaceCompact(Base):
+    """
+    parkinglotSpace history collapsed into buckets once it is old enough
+    (bucket is the start minute of the day, bucketMinutes its length)
+    """
+
+    __tablename__ = "parkinglotSpaceCompact"
+
+    parkinglot_id = Column(
+        Integer,
+        ForeignKey("parkinglotInfo.id", ondelete="cascade"),
+        primary_key=True,
+    )
+    updateDate = Column(Date, primary_key=True)
+    bucket = Column(Integer, primary_key=True)
+    bucketMinutes = Column(Integer, nullable=False)
+    updateDay = Column(Integer, nullable=False)
+    count = Column(Integer, nullable=False)
+    carAvailSum = Column(BigInteger, nullable=False)
+    carAvailMin = Column(Integer, nullable=False)
+    carAvailMax = Column(Integer, nullable=False)
+    carTotal = Column(Integer, nullable=False)
+    motoAvailSum = Column(BigInteger, nullable=False)
+    motoAvailMin = Column(Integer, nullable=False)
+    motoAvailMax = Column(Integer, nullable=False)
+    motoTotal = Column(Integer, nullable=False)
@@ -1,8 +1,12 @@
-from datetime import date, time
+from datetime import date, time, datetime
+from enum import Enum, IntEnum
 
-from typing import List
+from typing import List, Optional
 from pydantic import BaseModel, Field
 
+# furthest prediction horizon in minutes, the seasonal profile spans a week
+PREDICT_MAX_MINUTES = 7 * 24 * 60
+
 
 class In_parking_lot_official(BaseModel):
     parkno: str = Field(..., validation_alias="PARKNO")
@@ -62,6 +66,7 @@ class Out_parking_lot(BaseModel):
     updateDate: date
     updateDay: int
     updateTime: time
+    updateDatetime: datetime
 
 
 class ParkinglotInfo(BaseModel):
@@ -87,6 +92,7 @@ class ParkinglotSpace(BaseModel):
     updateDate: date
     updateDay: int = Field(description="0~6 represent Mon. to Sun.")
     updateTime: time
+    updateDatetime: Optional[datetime] = None
     parkinglot_id: int
     
 
@@ -101,4 +107,100 @@ class ParkinglotSpacePredict(BaseModel):
     updateDate: date
     updateDay: int = Field(description="0~6 represent Mon. to Sun.")
     updateTime: time
+    updateDatetime: Optional[datetime] = None
+    parkinglot_id: int
+
+
+class NearbyPoint(BaseModel):
+    lat: float
+    lng: float
+    minutes: int = Field(
+        0, ge=0, le=PREDICT_MAX_MINUTES, description="minutes to reach the spot"
+    )
+
+
+class NearbyBatchRequest(BaseModel):
+    points: List[NearbyPoint] = Field(..., max_length=1000)
+    radius: float = Field(500, gt=0, description="search radius in metres")
+    k: Optional[int] = Field(None, gt=0, description="only return the k nearest")
+
+
+class NearbyBatchResult(BaseModel):
+    lat: float
+    lng: float
+    minutes: int
+    parkinglots: List[ParkinglotSpacePredict]
+
+
+class ParkinglotSpaceTypical(BaseModel):
+    bucket: time = Field(description="start of the time bucket")
+    count: int
+    carAvailMean: float
+    carAvailMin: int
+    carAvailMax: int
+    motoAvailMean: float
+    motoAvailMin: int
+    motoAvailMax: int
+
+
+class ParkinglotSpaceHistory(BaseModel):
+    updateDate: date
+    updateDay: int = Field(description="0~6 represent Mon. to Sun.")
+    updateTime: time = Field(description="time of the record or start of the bucket")
+    bucketMinutes: int = Field(description="1 for raw records")
+    count: int
+    carAvail: float = Field(description="mean over the bucket")
+    carAvailMin: int
+    carAvailMax: int
+    carTotal: int
+    motoAvail: float = Field(description="mean over the bucket")
+    motoAvailMin: int
+    motoAvailMax: int
+    motoTotal: int
     parkinglot_id: int
+
+
+class HistoryResolution(IntEnum):
+    raw = 1
+    min5 = 5
+    min15 = 15
+    hour = 60
+    day = 1440
+
+
+class HistoryFormat(str, Enum):
+    json = "json"
+    ndjson = "ndjson"
+    csv = "csv"
+
+
+class Vehicle(str, Enum):
+    car = "car"
+    moto = "moto"
+
+
+class ParkinglotRank(BaseModel):
+    parkinglot_id: int
+    name: str
+    score: float = Field(description="lower is better")
+    distance: float = Field(description="metres")
+    avail: int = Field(description="latest available space of the vehicle type")
+    availPred: int = Field(description="predicted available space at arrival")
+    total: int
+    fee: int = Field(description="fee of the vehicle type on the arrival day")
+    startHour: int
+    endHour: int
+    latitude: float
+    longitude: float
+
+
+class ExportPartition(BaseModel):
+    updateDate: date
+    file: str
+    size: int = Field(description="bytes")
+
+
+class AggResolution(IntEnum):
+    min5 = 5
+    min15 = 15
+    hour = 60
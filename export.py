@@ -0,0 +1,32 @@
+"""
+columnar export of the parkinglotSpace history joined with parkinglotInfo, one
+Parquet (or Arrow IPC) file per day under <dir>/day=YYYY-MM-DD/:
+    python export.py --dir data/export
+    python export.py --dir data/export --format arrow --since 2024-10-01
+
+only the complete days after the last exported one are written, so it can run
+from cron. Days older than the compaction window are exported as their
+compacted buckets (bucketMinutes > 1, seenCount reports): carAvail / motoAvail
+hold the mean rounded to an integer, the exact mean and the min / max are in
+the *Mean / *Min / *Max columns (the space itself for a raw record).
+EXPORT_DIR / EXPORT_FORMAT are the defaults of --dir / --format
+"""
+import argparse
+from datetime import date
+
+from utils.db_connect import read_engine
+from utils.export import EXPORT_DIR, EXPORT_FORMAT, EXPORT_SUFFIXES, export_space_history
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dir", default=EXPORT_DIR, required=EXPORT_DIR is None)
+    parser.add_argument("--format", default=EXPORT_FORMAT, choices=list(EXPORT_SUFFIXES))
+    parser.add_argument(
+        "--since",
+        type=date.fromisoformat,
+        help="first day of the first export, the start of the history if empty",
+    )
+    args = parser.parse_args()
+
+    export_space_history(read_engine, args.dir, args.format, args.since)
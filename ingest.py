@@ -0,0 +1,50 @@
+"""
+standalone ingester, for running the API workers with INGEST_MODE=off:
+    python ingest.py
+
+several ingesters can run for failover, only the one holding the ingest lease
+fetches the data
+
+METRICS_PORT serves the ingest metrics for Prometheus on that port, with
+EXPORT_DIR set it also runs the daily columnar export (see export.py)
+
+INGEST_SPOOL_DIR makes the fetch append the feeds to a local spool that is
+written to the database every INGEST_SPOOL_DRAIN_SECONDS, so the history has
+no gap when the database is down for a while
+"""
+import os
+
+from apscheduler.events import EVENT_JOB_ERROR, EVENT_JOB_MISSED, EVENT_JOB_SUBMITTED
+from apscheduler.schedulers.blocking import BlockingScheduler
+from prometheus_client import start_http_server
+
+from utils.db_connect import engine, init_database
+from utils.jobs import add_ingest_jobs
+from utils.leader import ingest_lease
+from utils.metrics import observe_scheduler
+from utils.warmup import Warmup
+
+
+scheduler = BlockingScheduler(timezone="Asia/Taipei")
+
+
+if __name__ == "__main__":
+    # retried until the database is up and the lot catalog could be filled
+    Warmup().run([("schema", lambda: init_database(engine))])
+
+    if os.getenv("METRICS_PORT"):
+        start_http_server(int(os.getenv("METRICS_PORT")))
+
+    # the same jobs as the API workers, which skip them with INGEST_MODE=off
+    add_ingest_jobs(scheduler, mode="leader")
+
+    scheduler.add_listener(
+        observe_scheduler, EVENT_JOB_SUBMITTED | EVENT_JOB_ERROR | EVENT_JOB_MISSED
+    )
+
+    try:
+        scheduler.start()
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        ingest_lease.release()
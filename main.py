@@ -1,67 +1,187 @@
-from fastapi import FastAPI, Depends
-from sqlalchemy.orm import Session, aliased
-from sqlalchemy import event, func
+import os
+import asyncio
+
+from fastapi import FastAPI, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import FileResponse, StreamingResponse
+from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select
+from apscheduler.events import EVENT_JOB_ERROR, EVENT_JOB_MISSED, EVENT_JOB_SUBMITTED
 from apscheduler.triggers.interval import IntervalTrigger
 from apscheduler.schedulers.background import BackgroundScheduler
-from typing import List
+from typing import List, Optional
+from datetime import date, datetime, time, timezone
 
 from db import schema, model
-from utils.scheduler import get_parking_data
-from utils.db_connect import engine, get_db, insert_parking_info
-from utils.nearby import cal_dist
-from utils.prediction import pred_spaces_change
+from utils.scheduler import refresh_latest_space
+from utils.db_connect import (
+    engine,
+    async_engine,
+    async_read_engine,
+    get_read_db,
+    get_async_read_db,
+    init_database,
+    replica_guard,
+    SessionLocal,
+)
+from utils.snapshot import latest_space, present_space
+from utils.nearby import parkinglot_index
+from utils.geocache import closest, geo_cache, located
+from utils.ranking import lot_ranker
+from utils.prediction import forecaster, fit_forecaster
+from utils.aggregate import typical_curve_query
+from utils.history import stream_history, stream_spaces
+from utils.export import EXPORT_DIR, exported_days, exported_file
+from utils.leader import ingest_lease
+from utils.payload import info_payload, load_info_payload, render_spaces, space_payload
+from utils.stream import space_hub
+from utils.replica import DB_READ_CHECK_SECONDS
+from utils.warmup import Warmup
+from utils.jobs import add_ingest_jobs
+from utils.metrics import MetricsMiddleware, metrics_response, observe_scheduler
 
 
 scheduler = BackgroundScheduler(timezone="Asia/Taipei")
 app = FastAPI()
+app.add_middleware(MetricsMiddleware)
+warmup = Warmup()
+
 
+def load_caches():
+    # the lot index, the latest space snapshot and the pre-rendered payloads
+    with SessionLocal() as db:
+        parkinglot_index.load(db)
+        lot_ranker.load(db)
+        latest_space.load(db)
+        load_info_payload(db)
 
-# database
-# insert data right after the table creation
-event.listen(model.ParkinglotInfo.__table__, "after_create", insert_parking_info)
 
-model.Base.metadata.create_all(bind=engine)
+def load_catalog():
+    with SessionLocal() as db:
+        parkinglot_index.load(db)
+        lot_ranker.load(db)
+        load_info_payload(db)
+
+
+def start_scheduler():
+    # the first fetch, forecast fit and catalog sync run as soon as it starts
+    now = datetime.now(timezone.utc)
+    for job in scheduler.get_jobs():
+        if job.id in ("data", "spool", "forecast", "catalog"):
+            job.modify(next_run_time=now)
+
+    scheduler.start()
 
 
 # background
-scheduler.add_job(get_parking_data, IntervalTrigger(minutes=1), id="data")
+# only the process holding the ingest lease (see INGEST_MODE) fetches the data,
+# the others refresh their snapshot from the database
+add_ingest_jobs(
+    scheduler,
+    follow=refresh_latest_space,
+    on_catalog=load_catalog,
+    follow_catalog=load_catalog,
+)
+if replica_guard.enabled:
+    # every process routes its own reads, so every process checks the replica
+    scheduler.add_job(
+        replica_guard.check,
+        IntervalTrigger(seconds=DB_READ_CHECK_SECONDS),
+        id="replica",
+    )
+scheduler.add_job(
+    fit_forecaster,
+    IntervalTrigger(hours=1),
+    id="forecast",
+)
+
+scheduler.add_listener(
+    observe_scheduler, EVENT_JOB_SUBMITTED | EVENT_JOB_ERROR | EVENT_JOB_MISSED
+)
 
 
 @app.on_event("startup")
 async def startup_event():
-    scheduler.start()
+    # the ingest thread pushes the space changes to the streams through the loop
+    space_hub.bind(asyncio.get_running_loop())
+
+    # nothing blocks the start of the worker: the schema, the caches and the
+    # scheduler (its first run fetches the data) are set up in the background,
+    # /health tells when it is done
+    warmup.start(
+        [
+            ("schema", lambda: init_database(engine)),
+            ("caches", load_caches),
+            # reads stay on the primary until the replica is known to be fresh
+            ("replica", replica_guard.check),
+            ("scheduler", start_scheduler),
+        ]
+    )
 
 
 @app.on_event("shutdown")
 async def shutdown_event():
-    scheduler.shutdown()
+    if scheduler.running:
+        scheduler.shutdown()
+    ingest_lease.release()
+    await async_engine.dispose()
+    if async_read_engine is not async_engine:
+        await async_read_engine.dispose()
 
 
 @app.get("/")
-async def root(db: Session = Depends(get_db)):
+async def root(db: Session = Depends(get_read_db)):
     return {"message": "Hello World"}
 
 
+@app.get("/health", summary="readiness of the worker")
+def get_health(response: Response):
+    """
+    503 until the startup warmup (schema, caches, scheduler) is done
+    """
+    if not warmup.ready:
+        response.status_code = 503
+
+    return {
+        **warmup.info(),
+        "snapshot": latest_space.info(),
+        "geo_cache": geo_cache.info(),
+    }
+
+
 @app.get("/jobs")
 def get_jobs():
     jobs = scheduler.get_jobs()
     return [{"id": job.id, "next_run_time": job.next_run_time} for job in jobs]
 
 
+@app.get("/metrics", include_in_schema=False)
+def get_metrics():
+    return metrics_response()
+
+
+@app.get("/parking/version", summary="get version of the latest space snapshot")
+def get_snapshot_version():
+    return latest_space.info()
+
+
 # get parking info
 @app.get("/parking", response_model=List[schema.ParkinglotInfo])
-def get_parkinglot(db: Session = Depends(get_db)):
-    return db.query(model.ParkinglotInfo).all()
+async def get_parkinglot(request: Request):
+    """
+    served from the pre-rendered payload, 304 if the client has it already and
+    503 until the startup warmup has loaded it
+    """
+    return info_payload.response(request)
 
 
 # get parking space for specific parking lot
 @app.get("/parking/space/{parking_id}", response_model=List[schema.ParkinglotSpace])
-def get_parkingspace(parking_id: int, db: Session = Depends(get_db)):
-    return (
-        db.query(model.ParkinglotSpace)
-        .filter(model.ParkinglotSpace.parkinglot_id == parking_id)
-        .all()
-    )
+async def get_parkingspace(parking_id: int):
+    """
+    every record of the lot, streamed, see /history for a bounded range
+    """
+    return StreamingResponse(stream_spaces(parking_id), media_type="application/json")
 
 
 # get parking space for specific parking lot
@@ -70,45 +190,190 @@ def get_parkingspace(parking_id: int, db: Session = Depends(get_db)):
     summary="get latest space for one id",
     response_model=schema.ParkinglotSpace,
 )
-def get_each_latest_parkingspace(parking_id: int, db: Session = Depends(get_db)):
-    return (
-        db.query(model.ParkinglotSpace)
+async def get_each_latest_parkingspace(
+    parking_id: int,
+    response: Response,
+    db: AsyncSession = Depends(get_async_read_db),
+):
+    response.headers.update(latest_space.headers())
+
+    space = latest_space.get(parking_id)
+    if space is not None:
+        return space
+
+    result = await db.execute(
+        select(model.ParkinglotSpace)
         .filter(model.ParkinglotSpace.parkinglot_id == parking_id)
         .order_by(
             model.ParkinglotSpace.updateDate.desc(),
             model.ParkinglotSpace.updateTime.desc(),
         )
-        .first()
+        .limit(1)
+    )
+    row = result.scalars().first()
+
+    return present_space(row) if row is not None else None
+
+
+HISTORY_MEDIA_TYPES = {
+    schema.HistoryFormat.json: "application/json",
+    schema.HistoryFormat.ndjson: "application/x-ndjson",
+    schema.HistoryFormat.csv: "text/csv",
+}
+
+
+@app.get(
+    "/parking/space/{parking_id}/history",
+    summary="get the space history of one id between two dates",
+    response_model=List[schema.ParkinglotSpaceHistory],
+)
+async def get_parkingspace_history(
+    parking_id: int,
+    start: date = Query(..., alias="from"),
+    end: Optional[date] = Query(
+        None, alias="to", description="inclusive, today if empty"
+    ),
+    resolution: schema.HistoryResolution = Query(
+        schema.HistoryResolution.raw, description="minutes per bucket, 1 for raw"
+    ),
+    format: schema.HistoryFormat = schema.HistoryFormat.json,
+    after: Optional[datetime] = Query(
+        None, description="date and time of the last item of the previous page"
+    ),
+    limit: Optional[int] = Query(None, gt=0, description="items per page"),
+):
+    """
+    raw records for the recent days and compacted buckets (mean / min / max)
+    for the older ones, oldest first, resampled in the database when
+    `resolution` is above 1 and streamed as json, ndjson or csv
+    """
+    end = end or date.today()
+
+    return StreamingResponse(
+        stream_history(parking_id, start, end, resolution, format, after, limit),
+        media_type=HISTORY_MEDIA_TYPES[format],
     )
 
 
+@app.get(
+    "/parking/export",
+    summary="list the days of the columnar history export",
+    response_model=List[schema.ExportPartition],
+)
+def get_export():
+    if not EXPORT_DIR:
+        return []
+
+    partitions = []
+    for day in exported_days(EXPORT_DIR):
+        path = exported_file(EXPORT_DIR, day)
+        if path is not None:
+            partitions.append(
+                schema.ExportPartition(
+                    updateDate=day,
+                    file=os.path.basename(path),
+                    size=os.path.getsize(path),
+                )
+            )
+
+    return partitions
+
+
+@app.get(
+    "/parking/export/{day}",
+    summary="download the exported history of one day (Parquet or Arrow IPC)",
+)
+def get_export_day(day: date):
+    path = exported_file(EXPORT_DIR, day) if EXPORT_DIR else None
+    if path is None:
+        raise HTTPException(status_code=404, detail="day not exported")
+
+    return FileResponse(
+        path,
+        media_type="application/octet-stream",
+        filename=f"parkinglotSpace-{day.isoformat()}{os.path.splitext(path)[1]}",
+    )
+
+
+@app.get(
+    "/parking/space/{parking_id}/typical",
+    summary="get the typical space of one id over the day",
+    response_model=List[schema.ParkinglotSpaceTypical],
+)
+async def get_typical_parkingspace(
+    parking_id: int,
+    day: Optional[int] = Query(
+        None, ge=0, le=6, description="0~6 represent Mon. to Sun., all days if empty"
+    ),
+    resolution: schema.AggResolution = Query(
+        schema.AggResolution.min15, description="minutes per time bucket"
+    ),
+    db: AsyncSession = Depends(get_async_read_db),
+):
+    """
+    typical (mean / min / max) available space of the parking lot for each time
+    bucket of the day, read from the precomputed aggregates
+    """
+    result = await db.execute(typical_curve_query(parking_id, resolution, day))
+
+    return [
+        schema.ParkinglotSpaceTypical(
+            **{**x._asdict(), "bucket": time(x.bucket // 60, x.bucket % 60)}
+        )
+        for x in result.all()
+    ]
+
+
 # get parking space for specific parking lot
 @app.get(
     "/parking/space",
     summary="get all latest space",
     response_model=List[schema.ParkinglotSpace],
 )
-def get_all_latest_parkingspace(db: Session = Depends(get_db)):
-    """
-    get the latest data for all parkinglots
-    """
-    subquery = db.query(
-        model.ParkinglotSpace,
-        func.row_number()
-        .over(
-            partition_by=model.ParkinglotSpace.parkinglot_id,
-            order_by=(
-                model.ParkinglotSpace.updateDate.desc(),
-                model.ParkinglotSpace.updateTime.desc(),
-            ),
-        )
-        .label("row_number"),
-    ).subquery()
+async def get_all_latest_parkingspace(request: Request):
+    """
+    get the latest data for all parkinglots, rendered once per snapshot version,
+    304 if the client has the current version already and 503 until the
+    snapshot is loaded
+    """
+    if not latest_space.ready:
+        # an empty list would be cached by its ETag as the current spaces
+        return Response(status_code=503, headers={"Retry-After": "5"})
+
+    version = latest_space.version
+    if space_payload.version != version:
+        space_payload.set(render_spaces(latest_space.all()), version)
 
-    # Alias the subquery for easier referencing
-    aliased_parkinglot_space = aliased(model.ParkinglotSpace, subquery)
+    return space_payload.response(request, latest_space.headers())
 
-    return db.query(aliased_parkinglot_space).filter(subquery.c.row_number == 1).all()
+
+def nearby_parkinglot_ids(
+    lat: float, lng: float, radius: float, k: Optional[int] = None
+) -> List[int]:
+    """
+    get the ids of the parking lots around the site, nearest first
+    """
+    if k is None:
+        id_dist_li = parkinglot_index.within(lat, lng, radius)
+    else:
+        id_dist_li = parkinglot_index.nearest(lat, lng, k, radius)
+
+    return [i for i, _ in id_dist_li]
+
+
+def nearby_spaces(
+    lat: float, lng: float, radius: float, k: Optional[int] = None
+) -> List[schema.ParkinglotSpace]:
+    """
+    get the latest space of the parking lots around the site, nearest first
+    """
+    # get the nearby parking lots sorted by their distance
+    sorted_id_li = nearby_parkinglot_ids(lat, lng, radius, k)
+
+    # get the latest space info of the nearby parkinglot
+    id_space_dict = latest_space.get_many(sorted_id_li)
+
+    return [id_space_dict[i] for i in sorted_id_li if i in id_space_dict]
 
 
 # return nearby parking lot by given lat and lng
@@ -117,64 +382,29 @@ def get_all_latest_parkingspace(db: Session = Depends(get_db)):
     summary="get all nearby parking space",
     response_model=List[schema.ParkinglotSpace],
 )
-def get_nearby_parkinglot_space(lat: float, lng: float, db: Session = Depends(get_db)):
+async def get_nearby_parkinglot_space(
+    lat: float,
+    lng: float,
+    response: Response,
+    radius: float = Query(500, gt=0, description="search radius in metres"),
+    k: Optional[int] = Query(None, gt=0, description="only return the k nearest"),
+):
     """
     Provide the latitude(lat) and longitude(lng) of the site
-    get the space of the parking lot within 500m (0.005 for lat and lng)
+    get the space of the parking lot within radius (default 500m)
     for testing: lat: 24.807, lng: 120.969783
     """
-    distance: float = 0.005  # 500m
-    min_lat, max_lat = lat - distance, lat + distance
-    min_lng, max_lng = lng - distance, lng + distance
-
-    # get all parking lots
-    nearby_parkinglot = (
-        db.query(model.ParkinglotInfo)
-        .filter(
-            model.ParkinglotInfo.latitude >= min_lat,
-            model.ParkinglotInfo.latitude <= max_lat,
-            model.ParkinglotInfo.longitude >= min_lng,
-            model.ParkinglotInfo.longitude <= max_lng,
-        )
-        .all()
-    )
-
-    # calculate their distance
-    id_dist_dict: dict = {
-        x.id: cal_dist(x.latitude, x.longitude, lat, lng) for x in nearby_parkinglot
-    }
-
-    sorted_id_li = [
-        k for k, _ in sorted(id_dist_dict.items(), key=lambda item: item[1])
-    ]
-
-    # get the latest space info of the nearby parkinglot
-    subquery = db.query(
-        model.ParkinglotSpace,
-        func.row_number()
-        .over(
-            partition_by=model.ParkinglotSpace.parkinglot_id,
-            order_by=(
-                model.ParkinglotSpace.updateDate.desc(),
-                model.ParkinglotSpace.updateTime.desc(),
-            ),
-        )
-        .label("row_number"),
-    ).subquery()
-
-    # Alias the subquery for easier referencing
-    aliased_parkinglot_space = aliased(model.ParkinglotSpace, subquery)
-
-    nearby_space = (
-        db.query(aliased_parkinglot_space)
-        .filter(subquery.c.row_number == 1, subquery.c.parkinglot_id.in_(sorted_id_li))
-        .all()
+    response.headers.update(latest_space.headers())
+
+    # the lots around the cell of the site are shared with the other sites of
+    # the cell, the distances are the ones of the site
+    cell_lat, cell_lng = geo_cache.cell(lat, lng)
+    candidates = geo_cache.get(
+        ("nearby", cell_lat, cell_lng, radius),
+        lambda: located(nearby_spaces(cell_lat, cell_lng, radius + geo_cache.reach)),
     )
 
-    id_space_dict = {x.parkinglot_id: x for x in nearby_space}
-    print(id_space_dict)
-
-    return [id_space_dict[i] for i in sorted_id_li]
+    return closest(candidates, lat, lng, radius, k)
 
 
 @app.get(
@@ -182,74 +412,150 @@ def get_nearby_parkinglot_space(lat: float, lng: float, db: Session = Depends(ge
     summary="get parking info (including predicted space) for the parking lot near target",
     response_model=List[schema.ParkinglotSpacePredict],
 )
-def get_nearby_parkinglot_space(lat: float, lng: float, minutes: int, db: Session = Depends(get_db)):
+async def get_predicted_parkinglot_space(
+    lat: float,
+    lng: float,
+    response: Response,
+    minutes: int = Query(
+        ...,
+        ge=0,
+        le=schema.PREDICT_MAX_MINUTES,
+        description="minutes to reach the spot",
+    ),
+    radius: float = Query(500, gt=0, description="search radius in metres"),
+    k: Optional[int] = Query(None, gt=0, description="only return the k nearest"),
+):
     """
     Provide the latitude(lat) and longitude(lng) of the site and the time (minutes)
     to reach the spot. Get the info and the predicted space for the nearby parking lot
-    (within 500m)
+    (within radius, default 500m)
 
     for testing: lat: 24.807, lng: 120.969783
     """
-    distance: float = 0.005  # 500m
-    min_lat, max_lat = lat - distance, lat + distance
-    min_lng, max_lng = lng - distance, lng + distance
-
-    # get all parking lots
-    nearby_parkinglot = (
-        db.query(model.ParkinglotInfo)
-        .filter(
-            model.ParkinglotInfo.latitude >= min_lat,
-            model.ParkinglotInfo.latitude <= max_lat,
-            model.ParkinglotInfo.longitude >= min_lng,
-            model.ParkinglotInfo.longitude <= max_lng,
-        )
-        .all()
+    response.headers.update(latest_space.headers())
+    cell_lat, cell_lng = geo_cache.cell(lat, lng)
+    minutes = geo_cache.minutes(minutes)
+
+    # predict the space of all the lots around the cell in one batch
+    candidates = geo_cache.get(
+        ("predict", cell_lat, cell_lng, minutes, radius),
+        lambda: located(
+            forecaster.predict_spaces(
+                nearby_spaces(cell_lat, cell_lng, radius + geo_cache.reach), minutes
+            )
+        ),
     )
 
-    # calculate their distance
-    id_dist_dict: dict = {
-        x.id: cal_dist(x.latitude, x.longitude, lat, lng) for x in nearby_parkinglot
-    }
+    return closest(candidates, lat, lng, radius, k)
 
-    sorted_id_li = [
-        k for k, _ in sorted(id_dist_dict.items(), key=lambda item: item[1])
-    ]
 
-    # get the latest space info of the nearby parkinglot
-    subquery = db.query(
-        model.ParkinglotSpace,
-        func.row_number()
-        .over(
-            partition_by=model.ParkinglotSpace.parkinglot_id,
-            order_by=(
-                model.ParkinglotSpace.updateDate.desc(),
-                model.ParkinglotSpace.updateTime.desc(),
-            ),
-        )
-        .label("row_number"),
-    ).subquery()
+@app.get(
+    "/parking/rank",
+    summary="get the best parking lots near target, open at arrival",
+    response_model=List[schema.ParkinglotRank],
+)
+async def get_ranked_parkinglot(
+    lat: float,
+    lng: float,
+    response: Response,
+    minutes: int = Query(
+        0, ge=0, le=schema.PREDICT_MAX_MINUTES, description="minutes to reach the spot"
+    ),
+    radius: float = Query(1000, gt=0, description="search radius in metres"),
+    k: int = Query(10, gt=0, le=100),
+    vehicle: schema.Vehicle = schema.Vehicle.car,
+    w_distance: float = Query(1.0, ge=0, description="weight of the distance"),
+    w_avail: float = Query(1.0, ge=0, description="weight of the predicted space"),
+    w_price: float = Query(0.5, ge=0, description="weight of the fee"),
+):
+    """
+    the k lots within radius with the lowest score, a weighted sum of the
+    distance, the lack of predicted space at arrival and the fee. Lots closed
+    at arrival are left out.
 
-    # Alias the subquery for easier referencing
-    aliased_parkinglot_space = aliased(model.ParkinglotSpace, subquery)
+    for testing: lat: 24.807, lng: 120.969783
+    """
+    response.headers.update(latest_space.headers())
 
-    nearby_space_li = (
-        db.query(aliased_parkinglot_space)
-        .filter(subquery.c.row_number == 1, subquery.c.parkinglot_id.in_(sorted_id_li))
-        .all()
+    return lot_ranker.rank(
+        lat, lng, minutes, radius, k, vehicle, w_distance, w_avail, w_price
     )
 
 
-    pred_parkinglot_li = []
-    for curr_p in nearby_space_li:
-        pred_change = pred_spaces_change(curr_p.parkinglot_id, minutes)
+@app.post(
+    "/parking/predict/batch",
+    summary="get nearby parking info (including predicted space) for many sites",
+    response_model=List[schema.NearbyBatchResult],
+)
+async def get_nearby_parkinglot_space_batch(
+    body: schema.NearbyBatchRequest, response: Response
+):
+    """
+    `/parking/predict` for many sites (e.g. the waypoints of a route) in one
+    call: the nearby lots of each site, nearest first, with their latest and
+    predicted space. The snapshot is read once for all sites and the
+    predictions are done in one batch.
+    """
+    response.headers.update(latest_space.headers())
 
-        p_dict = {k: v for k, v in curr_p.__dict__.items() if k in curr_p.__table__.columns}
-        p_dict["carAvailPred"] = max(curr_p.carAvail - pred_change, 0)
-        p_dict["motoAvailPred"] = curr_p.motoAvail
-        pred_parkinglot = schema.ParkinglotSpacePredict(**p_dict)
+    sorted_id_lis = [
+        nearby_parkinglot_ids(p.lat, p.lng, body.radius, body.k) for p in body.points
+    ]
+    id_space_dict = latest_space.get_many(
+        set(i for id_li in sorted_id_lis for i in id_li)
+    )
 
-        pred_parkinglot_li.append(pred_parkinglot)
+    # one flat batch of (space, minutes) over all sites
+    space_li, minutes_li = [], []
+    for p, id_li in zip(body.points, sorted_id_lis):
+        for i in id_li:
+            if i in id_space_dict:
+                space_li.append(id_space_dict[i])
+                minutes_li.append(p.minutes)
+    pred_li = forecaster.predict_spaces(space_li, minutes_li)
+
+    result, start = [], 0
+    for p, id_li in zip(body.points, sorted_id_lis):
+        n = sum(1 for i in id_li if i in id_space_dict)
+        result.append(
+            schema.NearbyBatchResult(
+                lat=p.lat,
+                lng=p.lng,
+                minutes=p.minutes,
+                parkinglots=pred_li[start : start + n],
+            )
+        )
+        start += n
 
-    id_space_dict = {x.parkinglot_id: x for x in pred_parkinglot_li}
+    return result
 
-    return [id_space_dict[i] for i in sorted_id_li]
+
+@app.get(
+    "/parking/stream",
+    summary="stream the space changes of the given or nearby parking lots (SSE)",
+)
+async def stream_parkingspace(
+    ids: Optional[List[int]] = Query(None, description="parking lot ids"),
+    lat: Optional[float] = None,
+    lng: Optional[float] = None,
+    radius: float = Query(500, gt=0, description="search radius in metres"),
+):
+    """
+    Subscribe to the parking lots of `ids`, or to those within radius of the
+    site (lat, lng). The stream starts with a `snapshot` event holding their
+    current space, then pushes a `diff` event with the lots whose carAvail or
+    motoAvail changed right after each ingest.
+    """
+    if ids is None:
+        if lat is None or lng is None:
+            raise HTTPException(status_code=422, detail="give either ids or lat and lng")
+        ids = nearby_parkinglot_ids(lat, lng, radius)
+
+    def snapshot():
+        return latest_space.version, list(latest_space.get_many(ids).values())
+
+    return StreamingResponse(
+        space_hub.stream(ids, snapshot),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
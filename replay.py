@@ -0,0 +1,46 @@
+"""
+backfill parkinglotSpace from the raw feed archive (FEED_ARCHIVE_DIR), parsed
+again by the current utils.process:
+    python replay.py --from 2024-10-01 --to 2024-10-31
+    python replay.py --from 2024-10-01 --to 2024-10-31 --replace --workers 8
+
+the days already compacted are skipped unless --replace, which deletes the
+stored rows of each replayed day first. The new rows are added to the
+aggregates, which --replace rebuilds from the whole history at the end
+"""
+import argparse
+from datetime import date
+
+from utils.archive import FEED_ARCHIVE_DIR
+from utils.db_connect import engine
+from utils.replay import replay_archive
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--archive", default=FEED_ARCHIVE_DIR, required=FEED_ARCHIVE_DIR is None
+    )
+    parser.add_argument("--from", dest="start", type=date.fromisoformat, required=True)
+    parser.add_argument("--to", dest="end", type=date.fromisoformat, required=True)
+    parser.add_argument(
+        "--workers", type=int, help="parsing processes, the CPU count if empty"
+    )
+    parser.add_argument("--replace", action="store_true")
+    parser.add_argument(
+        "--no-aggregates",
+        dest="aggregates",
+        action="store_false",
+        help="leave the aggregates as they are",
+    )
+    args = parser.parse_args()
+
+    replay_archive(
+        engine,
+        args.archive,
+        args.start,
+        args.end,
+        args.workers,
+        args.replace,
+        args.aggregates,
+    )
@@ -0,0 +1,72 @@
+import os
+import json
+import tempfile
+from datetime import datetime
+from typing import Callable, Dict
+
+import pytest
+
+# the app modules create their engines on import, the tests use their own
+# SQLite files (see the fixtures), this one only keeps the import from needing
+# a postgres server
+DB_PATH = os.path.join(tempfile.mkdtemp(prefix="parking-tests-"), "app.db")
+os.environ.setdefault("DB_URL", f"sqlite:///{DB_PATH}")
+os.environ.setdefault("DB_ASYNC_URL", f"sqlite+aiosqlite:///{DB_PATH}")
+
+SEED = os.path.join(os.path.dirname(__file__), os.path.pardir, "data", "GetParkInfo.json")
+
+
+@pytest.fixture
+def db():
+    """
+    the app database (DB_URL) with the tables and the lot catalog of the seed,
+    emptied afterwards
+    """
+    from db import model
+    from utils.db_connect import engine, sync_parking_info
+
+    model.Base.metadata.create_all(bind=engine)
+    sync_parking_info(engine, SEED)
+    yield engine
+    model.Base.metadata.drop_all(bind=engine)
+
+
+@pytest.fixture
+def snapshot(monkeypatch):
+    """
+    a fresh latest space snapshot for the ingest and the endpoints
+    """
+    from utils import scheduler
+    from utils.snapshot import latest_space
+
+    monkeypatch.setattr(latest_space, "_state", (0, None, {}))
+    monkeypatch.setattr(scheduler, "parkinglot_id_map", {})
+
+    return latest_space
+
+
+def seed_feed(when: datetime, free: Dict[str, int] = {}) -> bytes:
+    """
+    a feed payload of the seed lots reported at `when`, with the free car
+    spaces of the given lots (by PARKINGNAME, the others keep the seed's)
+    """
+    with open(SEED, encoding="utf-8") as f:
+        records = json.load(f)
+    for r in records:
+        r["UPDATETIME"] = when.strftime("%Y-%m-%dT%H:%M:%S")
+        r["FREEQUANTITY"] = free.get(r["PARKINGNAME"], r["FREEQUANTITY"])
+
+    return json.dumps(records).encode()
+
+
+@pytest.fixture
+def ingest(db, snapshot) -> Callable[[datetime, Dict[str, int]], None]:
+    """
+    ingest one seed_feed
+    """
+    from utils.scheduler import store_parking_data
+
+    def run(when: datetime, free: Dict[str, int] = {}):
+        store_parking_data([seed_feed(when, free)])
+
+    return run
@@ -0,0 +1,70 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import select
+
+from db import model
+from utils import scheduler
+from utils.aggregate import rebuild_space_aggregates
+
+START = datetime(2024, 5, 6, 10, 0)
+# a lot staying the same (extended by the change-only ingest) and a busy one
+STILL, BUSY = "府後地下停車場", "赤土崎地下停車場"
+
+
+def aggregates(bind):
+    agg = model.ParkinglotSpaceAgg.__table__
+    with bind.connect() as conn:
+        return conn.execute(select(agg).order_by(*agg.primary_key.columns, *agg.c)).all()
+
+
+@pytest.fixture
+def change_only(monkeypatch):
+    monkeypatch.setattr(scheduler, "INGEST_CHANGE_ONLY", True)
+    # records extended across several aggregate buckets
+    monkeypatch.setattr(scheduler, "SPACE_COMPACT_MINUTES", 60)
+
+
+def test_rebuild_matches_the_incremental_aggregates(db, ingest, change_only):
+    for m in range(30):
+        ingest(START + timedelta(minutes=m), {STILL: 7, BUSY: m % 4})
+    # a gap, then reports every other minute: the same values, new records
+    for m in range(40, 50, 2):
+        ingest(START + timedelta(minutes=m), {STILL: 7, BUSY: 1})
+
+    space = model.ParkinglotSpace
+    still_id = scheduler.parkinglot_id_map[STILL]
+    with db.connect() as conn:
+        records = conn.execute(
+            select(space.updateTime, space.seenCount)
+            .where(space.parkinglot_id == still_id)
+            .order_by(space.updateTime)
+        ).all()
+    assert [tuple(r) for r in records][:2] == [
+        (START.time(), 30),
+        ((START + timedelta(minutes=40)).time(), None),
+    ]
+
+    incremental = aggregates(db)
+    with db.begin() as conn:
+        rebuild_space_aggregates(None, conn)
+
+    assert aggregates(db) == incremental
+
+
+def test_extended_record_is_counted_in_every_bucket(db, ingest, change_only):
+    for m in range(30):
+        ingest(START + timedelta(minutes=m), {STILL: 7})
+    with db.begin() as conn:
+        rebuild_space_aggregates(None, conn)
+
+    agg = model.ParkinglotSpaceAgg
+    still_id = scheduler.parkinglot_id_map[STILL]
+    with db.connect() as conn:
+        rows = conn.execute(
+            select(agg.bucket, agg.count, agg.carAvailSum)
+            .where(agg.parkinglot_id == still_id, agg.bucketMinutes == 5)
+            .order_by(agg.bucket)
+        ).all()
+
+    assert rows == [(600 + 5 * i, 5, 35) for i in range(6)]
@@ -0,0 +1,74 @@
+from datetime import date, datetime, time, timedelta
+
+from fastapi.testclient import TestClient
+from sqlalchemy import func, select
+
+import main
+from db import model
+from utils import scheduler
+from utils.aggregate import rebuild_space_aggregates
+from utils.compaction import compact_space_history
+
+# recent, the compaction goes through every day from the oldest record
+START = datetime.combine(date.today() - timedelta(days=3), time(10, 0))
+STILL, BUSY = "府後地下停車場", "赤土崎地下停車場"
+
+# the startup warmup is not run, the history is read from the database
+client = TestClient(main.app)
+
+
+def history(parking_id, resolution):
+    response = client.get(
+        f"/parking/space/{parking_id}/history",
+        params={
+            "from": START.date().isoformat(),
+            "to": START.date().isoformat(),
+            "resolution": resolution,
+        },
+    )
+    assert response.status_code == 200
+    return response.json()
+
+
+def aggregates(bind, resolution):
+    agg = model.ParkinglotSpaceAgg.__table__
+    with bind.connect() as conn:
+        return conn.execute(
+            select(agg)
+            .where(agg.c.bucketMinutes == resolution)
+            .order_by(*agg.primary_key.columns)
+        ).all()
+
+
+def test_compaction_round_trip(db, ingest, monkeypatch):
+    monkeypatch.setattr(scheduler, "INGEST_CHANGE_ONLY", True)
+    monkeypatch.setattr(scheduler, "SPACE_COMPACT_MINUTES", 15)
+    for m in range(45):
+        ingest(START + timedelta(minutes=m), {STILL: 7, BUSY: m % 5})
+    still_id = scheduler.parkinglot_id_map[STILL]
+    busy_id = scheduler.parkinglot_id_map[BUSY]
+
+    before = {i: history(i, 15) for i in (still_id, busy_id)}
+    incremental = {r: aggregates(db, r) for r in (15, 60)}
+
+    compact_space_history(db, after_days=1, minutes=15)
+
+    with db.connect() as conn:
+        raw = conn.execute(select(func.count()).select_from(model.ParkinglotSpace))
+        assert raw.scalar() == 0
+        compact = model.ParkinglotSpaceCompact
+        compacted = conn.execute(
+            select(compact.bucket, compact.count)
+            .where(compact.parkinglot_id == busy_id)
+            .order_by(compact.bucket)
+        ).all()
+    assert compacted == [(600, 15), (615, 15), (630, 15)]
+
+    # the compacted buckets read back as the raw records did
+    assert {i: history(i, 15) for i in (still_id, busy_id)} == before
+    assert history(busy_id, 1) == history(busy_id, 15)
+
+    # and rebuild the aggregates of the buckets they cover
+    with db.begin() as conn:
+        rebuild_space_aggregates(None, conn)
+    assert {r: aggregates(db, r) for r in (15, 60)} == incremental
@@ -0,0 +1,63 @@
+from datetime import date, datetime, time, timedelta
+
+import pytest
+
+from utils import scheduler
+from utils.compaction import compact_space_history
+from utils.export import export_space_history, exported_days, exported_file
+
+pa = pytest.importorskip("pyarrow")
+import pyarrow.ipc  # noqa: E402
+import pyarrow.parquet as pq  # noqa: E402
+
+# recent, the compaction goes through every day from the oldest record
+START = datetime.combine(date.today() - timedelta(days=3), time(10, 0))
+LOT = "府後地下停車場"
+
+
+def read(path):
+    if path.endswith(".parquet"):
+        return pq.read_table(path)
+    return pa.ipc.open_file(path).read_all()
+
+
+@pytest.mark.parametrize("fmt", ["parquet", "arrow"])
+def test_export_writes_each_complete_day_once(db, ingest, tmp_path, fmt):
+    for d in range(2):
+        for m in range(3):
+            ingest(START + timedelta(days=d, minutes=m), {LOT: m})
+    n_lots = len(scheduler.parkinglot_id_map)
+
+    export_space_history(db, str(tmp_path), fmt)
+    days = [START.date(), START.date() + timedelta(days=1)]
+    assert exported_days(str(tmp_path)) == days
+
+    table = read(exported_file(str(tmp_path), days[0]))
+    assert table.num_rows == 3 * n_lots
+    rows = [r for r in table.to_pylist() if r["name"] == LOT]
+    assert [r["carAvail"] for r in rows] == [0, 1, 2]
+    assert [r["carAvailMean"] for r in rows] == [0.0, 1.0, 2.0]
+    assert [r["carAvailMax"] for r in rows] == [0, 1, 2]
+    assert {r["bucketMinutes"] for r in rows} == {1}
+
+    # the next run starts after the last exported day
+    ingest(START + timedelta(days=1, minutes=3), {LOT: 3})
+    export_space_history(db, str(tmp_path), fmt)
+    assert read(exported_file(str(tmp_path), days[1])).num_rows == 3 * n_lots
+
+
+def test_export_compacted_day(db, ingest, tmp_path):
+    for m in range(15):
+        ingest(START + timedelta(minutes=m), {LOT: m % 2})
+    compact_space_history(db, after_days=1, minutes=15)
+
+    export_space_history(db, str(tmp_path))
+    table = read(exported_file(str(tmp_path), START.date()))
+    (row,) = [r for r in table.to_pylist() if r["name"] == LOT]
+    assert row["bucketMinutes"] == 15
+    assert row["seenCount"] == 15
+    assert row["updateTime"] == START.time()
+    # the exact mean and the range next to the rounded mean
+    assert row["carAvail"] == 0
+    assert row["carAvailMean"] == pytest.approx(7 / 15)
+    assert (row["carAvailMin"], row["carAvailMax"]) == (0, 1)
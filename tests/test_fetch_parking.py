@@ -0,0 +1,120 @@
+import pytest
+from prometheus_client import REGISTRY
+
+from benchmarks import stub_upstream
+from benchmarks.stub_upstream import StubFeed, serve
+from utils import fetch_parking
+from utils.fetch_parking import fetch_raw, fetch_raw_all, forget_feed, parse_feed
+
+
+class Draws:
+    """
+    stands in for the random module of the stub, so whether a request fails
+    is scripted instead of drawn
+    """
+
+    def __init__(self, values):
+        self.values = list(values)
+
+    def random(self) -> float:
+        return self.values.pop(0) if self.values else 1.0
+
+
+def fetches(result: str) -> float:
+    return REGISTRY.get_sample_value("upstream_fetches_total", {"result": result}) or 0
+
+
+def errors(reason: str) -> float:
+    return REGISTRY.get_sample_value("upstream_errors_total", {"reason": reason}) or 0
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(fetch_parking, "FETCH_BACKOFF", 0.001)
+
+
+@pytest.fixture
+def upstream(request):
+    """
+    stub of the upstream feed on a free port, keyword arguments of serve
+    through indirect parametrization
+    """
+    server = serve(0, StubFeed(), **getattr(request, "param", {}))
+    server.target = f"http://127.0.0.1:{server.server_address[1]}/feed"
+    yield server
+    server.shutdown()
+    server.server_close()
+    forget_feed(server.target)
+
+
+def test_not_modified(upstream):
+    feed = upstream.feed
+
+    raw = fetch_raw(upstream.target)
+    assert raw == feed.body
+    assert len(parse_feed(raw).data) == len(feed.records)
+
+    not_modified = fetches("not_modified")
+    assert fetch_raw(upstream.target) is None
+    assert fetches("not_modified") == not_modified + 1
+    assert feed.requests == 2
+
+    feed.update()
+    assert fetch_raw(upstream.target) == feed.body
+
+
+def test_unchanged_content(upstream):
+    feed = upstream.feed
+
+    assert fetch_raw(upstream.target) == feed.body
+
+    # a new ETag for the same payload (e.g. another upstream server) is
+    # answered in full, the content hash tells it did not change
+    feed.etag = '"rotated"'
+    unchanged = fetches("unchanged")
+    assert fetch_raw(upstream.target) is None
+    assert fetches("unchanged") == unchanged + 1
+
+
+def test_unconditional(upstream):
+    assert fetch_raw(upstream.target) is not None
+    assert fetch_raw(upstream.target, conditional=False) == upstream.feed.body
+
+
+def test_forget_feed(upstream):
+    assert fetch_raw(upstream.target) is not None
+    assert fetch_raw(upstream.target) is None
+
+    # e.g. the payload failed to be stored, it is processed again
+    forget_feed(upstream.target)
+    assert fetch_raw(upstream.target) == upstream.feed.body
+
+
+@pytest.mark.parametrize("upstream", [{"fail_rate": 0.5}], indirect=True)
+def test_retry(upstream, monkeypatch):
+    # two 503 then the payload
+    monkeypatch.setattr(stub_upstream, "random", Draws([0.0, 0.0]))
+    failed = errors("503")
+
+    assert fetch_raw(upstream.target) == upstream.feed.body
+    assert upstream.feed.requests == 3
+    assert errors("503") == failed + 2
+
+
+@pytest.mark.parametrize("upstream", [{"fail_rate": 1.0}], indirect=True)
+def test_retries_exhausted(upstream, monkeypatch):
+    monkeypatch.setattr(stub_upstream, "random", Draws([0.0] * 10))
+    monkeypatch.setattr(fetch_parking, "FETCH_RETRIES", 2)
+    failed = fetches("error")
+
+    # a failing feed maps to None, the others are still fetched
+    with serve(0, StubFeed()) as other:
+        other_target = f"http://127.0.0.1:{other.server_address[1]}/feed"
+        result = fetch_raw_all([upstream.target, other_target])
+        other.shutdown()
+    forget_feed(other_target)
+
+    assert result[upstream.target] is None
+    assert result[other_target] == other.feed.body
+    assert upstream.feed.requests == 3
+    assert fetches("error") == failed + 1
@@ -0,0 +1,88 @@
+import random
+from types import SimpleNamespace
+
+from utils.geocache import GeoCellCache, closest
+from utils.nearby import ParkinglotIndex, haversine
+
+
+def test_cell_candidates_cover_every_site_of_the_cell():
+    rng = random.Random(0)
+    lots = [
+        SimpleNamespace(
+            id=i,
+            latitude=24.78 + rng.random() * 0.06,
+            longitude=120.94 + rng.random() * 0.06,
+        )
+        for i in range(300)
+    ]
+    index = ParkinglotIndex()
+    index.build(lots)
+    cache = GeoCellCache()
+    radius = 500
+
+    for _ in range(50):
+        lat, lng = 24.78 + rng.random() * 0.06, 120.94 + rng.random() * 0.06
+        cell = cache.cell(lat, lng)
+        candidates = [
+            (*index.location(i), i)
+            for i, _ in index.within(*cell, radius + cache.reach)
+        ]
+        dist = {p.id: haversine(p.latitude, p.longitude, lat, lng) for p in lots}
+        expected = sorted((i for i in dist if dist[i] <= radius), key=dist.get)
+        assert closest(candidates, lat, lng, radius) == expected
+        assert closest(candidates, lat, lng, radius, k=3) == expected[:3]
+
+
+def test_minutes_are_rounded_to_the_step():
+    cache = GeoCellCache(minutes_step=5)
+    assert [cache.minutes(m) for m in (0, 2, 3, 7, 8)] == [0, 0, 5, 5, 10]
+    assert GeoCellCache(max_size=0).minutes(7) == 7
+
+
+def test_results_are_dropped_with_the_snapshot_version(snapshot):
+    cache = GeoCellCache(max_size=2)
+    calls = []
+
+    def compute(value):
+        def run():
+            calls.append(value)
+            return value
+
+        return run
+
+    assert cache.get(("nearby", 1), compute("a")) == "a"
+    assert cache.get(("nearby", 1), compute("b")) == "a"
+    assert calls == ["a"]
+
+    # a new ingest cycle
+    snapshot.swap([])
+    assert cache.get(("nearby", 1), compute("c")) == "c"
+
+    # least recently used first out
+    cache.get(("nearby", 2), compute("d"))
+    cache.get(("nearby", 1), compute("e"))
+    cache.get(("nearby", 3), compute("f"))
+    assert len(cache) == 2
+    assert cache.get(("nearby", 2), compute("g")) == "g"
+    assert calls == ["a", "c", "d", "f", "g"]
+
+
+def test_results_expire(snapshot, monkeypatch):
+    cache = GeoCellCache(ttl=60)
+    now = [1000.0]
+    monkeypatch.setattr("utils.geocache.time.monotonic", lambda: now[0])
+
+    assert cache.get(("predict", 1), lambda: "a") == "a"
+    now[0] += 59
+    assert cache.get(("predict", 1), lambda: "b") == "a"
+    now[0] += 2
+    assert cache.get(("predict", 1), lambda: "c") == "c"
+
+
+def test_disabled_cache_computes_every_time():
+    cache = GeoCellCache(max_size=0)
+    assert cache.cell(24.80012, 120.9701) == (24.80012, 120.9701)
+    assert cache.reach == 0
+    assert cache.get(("nearby", 1), lambda: "a") == "a"
+    assert cache.get(("nearby", 1), lambda: "b") == "b"
+    assert len(cache) == 0
@@ -0,0 +1,85 @@
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import insert
+
+import main
+from db import model
+from utils import scheduler
+
+START = datetime(2024, 5, 6, 10, 0)
+LOT = "府後地下停車場"
+
+# the startup warmup is not run, the history is read from the database
+client = TestClient(main.app)
+
+
+def history(parking_id, resolution):
+    response = client.get(
+        f"/parking/space/{parking_id}/history",
+        params={
+            "from": START.date().isoformat(),
+            "to": (START + timedelta(days=1)).date().isoformat(),
+            "resolution": resolution,
+        },
+    )
+    assert response.status_code == 200
+    return response.json()
+
+
+def rebucket(items, resolution):
+    buckets = defaultdict(list)
+    for x in items:
+        t = datetime.fromisoformat(f"{x['updateDate']}T{x['updateTime']}")
+        minute = t.hour * 60 + t.minute
+        buckets[(x["updateDate"], minute // resolution * resolution)].append(x)
+
+    return {
+        key: (len(xs), sum(x["carAvail"] for x in xs) / len(xs))
+        for key, xs in buckets.items()
+    }
+
+
+@pytest.mark.parametrize("resolution", [5, 15, 60])
+def test_resampled_history_matches_the_raw_stream(ingest, monkeypatch, resolution):
+    monkeypatch.setattr(scheduler, "INGEST_CHANGE_ONLY", True)
+    # records extended across several buckets
+    monkeypatch.setattr(scheduler, "SPACE_COMPACT_MINUTES", 60)
+    for m in range(30):
+        ingest(START + timedelta(minutes=m), {LOT: 7 if m < 20 else 3})
+    for m in range(40, 50, 2):
+        ingest(START + timedelta(minutes=m), {LOT: 3})
+    parking_id = scheduler.parkinglot_id_map[LOT]
+
+    # a record extended before reports had to be a minute apart: 5 over 12 minutes
+    next_day = START + timedelta(days=1)
+    with main.engine.begin() as conn:
+        conn.execute(
+            insert(model.ParkinglotSpace.__table__).values(
+                carAvail=5,
+                carTotal=100,
+                motoAvail=0,
+                motoTotal=0,
+                updateDate=next_day.date(),
+                updateDay=next_day.weekday(),
+                updateTime=next_day.time(),
+                updateDatetime=next_day,
+                lastSeen=next_day + timedelta(minutes=12),
+                seenCount=5,
+                parkinglot_id=parking_id,
+            )
+        )
+
+    raw = history(parking_id, 1)
+    resampled = history(parking_id, resolution)
+
+    assert len(raw) == 30 + 5 + 5
+    assert {
+        (x["updateDate"], int(x["updateTime"][:2]) * 60 + int(x["updateTime"][3:5])): (
+            x["count"],
+            x["carAvail"],
+        )
+        for x in resampled
+    } == rebucket(raw, resolution)
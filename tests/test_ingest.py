@@ -0,0 +1,63 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, select
+
+from db import model
+from utils import scheduler
+
+START = datetime(2024, 5, 6, 23, 57)
+LOT = "府後地下停車場"
+
+
+def records(bind, parking_id):
+    space = model.ParkinglotSpace
+    with bind.connect() as conn:
+        return [
+            tuple(r)
+            for r in conn.execute(
+                select(
+                    space.updateDatetime, space.carAvail, space.lastSeen, space.seenCount
+                )
+                .where(space.parkinglot_id == parking_id)
+                .order_by(space.updateDatetime)
+            )
+        ]
+
+
+def total_count(bind):
+    agg = model.ParkinglotSpaceAgg
+    with bind.connect() as conn:
+        return conn.execute(
+            select(func.sum(agg.count)).where(agg.bucketMinutes == 60)
+        ).scalar()
+
+
+def test_repeated_feed_is_stored_once(db, ingest):
+    ingest(START, {LOT: 7})
+    ingest(START, {LOT: 7})
+    parking_id = scheduler.parkinglot_id_map[LOT]
+
+    assert records(db, parking_id) == [(START, 7, None, None)]
+    assert total_count(db) == len(scheduler.parkinglot_id_map)
+
+
+def test_change_only_ingest_extends_unchanged_records(db, ingest, monkeypatch):
+    monkeypatch.setattr(scheduler, "INGEST_CHANGE_ONLY", True)
+    for m, free in [(0, 7), (1, 7), (1, 7), (2, 8), (3, 8), (5, 8), (6, 8)]:
+        ingest(START + timedelta(minutes=m), {LOT: free})
+    parking_id = scheduler.parkinglot_id_map[LOT]
+
+    def at(m):
+        return START + timedelta(minutes=m)
+
+    assert records(db, parking_id) == [
+        (at(0), 7, at(1), 2),
+        (at(2), 8, None, None),
+        # the next day starts a new record, as does a missed report
+        (at(3), 8, None, None),
+        (at(5), 8, at(6), 2),
+    ]
+    # the repeated feed is not counted twice
+    assert total_count(db) == 6 * len(scheduler.parkinglot_id_map)
+    # the snapshot has the last report
+    assert scheduler.latest_space.get(parking_id).updateDatetime == at(6)
@@ -0,0 +1,19 @@
+from apscheduler.schedulers.background import BackgroundScheduler
+
+import main
+from utils.jobs import add_ingest_jobs
+
+
+def jobs(scheduler):
+    return {job.id: str(job.trigger) for job in scheduler.get_jobs()}
+
+
+def test_ingester_runs_the_jobs_of_the_workers():
+    # the standalone ingester (ingest.py) next to INGEST_MODE=off workers
+    ingester = BackgroundScheduler(timezone="Asia/Taipei")
+    add_ingest_jobs(ingester, mode="leader")
+    ingester_jobs = jobs(ingester)
+
+    assert {"data", "catalog", "maintenance", "compaction"} <= set(ingester_jobs)
+    worker_jobs = jobs(main.scheduler)
+    assert {k: worker_jobs[k] for k in ingester_jobs} == ingester_jobs
@@ -0,0 +1,69 @@
+import random
+from types import SimpleNamespace
+
+import pytest
+
+from utils.nearby import ParkinglotIndex, haversine
+
+
+@pytest.fixture(scope="module")
+def lots():
+    rng = random.Random(0)
+    return [
+        SimpleNamespace(
+            id=i,
+            latitude=24.78 + rng.random() * 0.06,
+            longitude=120.94 + rng.random() * 0.06,
+        )
+        for i in range(300)
+    ]
+
+
+@pytest.fixture(scope="module")
+def index(lots):
+    index = ParkinglotIndex(cell_size=0.005)
+    index.build(lots)
+    return index
+
+
+def brute_force(lots, lat, lng):
+    return sorted(
+        ((p.id, haversine(p.latitude, p.longitude, lat, lng)) for p in lots),
+        key=lambda item: item[1],
+    )
+
+
+def sites():
+    rng = random.Random(1)
+    # inside the area, around it and far away from every lot
+    return [
+        (24.75 + rng.random() * 0.12, 120.91 + rng.random() * 0.12) for _ in range(30)
+    ] + [(25.2, 121.5)]
+
+
+def test_haversine():
+    assert haversine(24.8, 120.97, 24.8, 120.97) == 0
+    # a degree of latitude is ~111 km
+    assert haversine(24.0, 120.97, 25.0, 120.97) == pytest.approx(111195, rel=1e-3)
+
+
+@pytest.mark.parametrize("radius", [200, 1000, 3000])
+def test_within_matches_brute_force(lots, index, radius):
+    for lat, lng in sites():
+        expected = [x for x in brute_force(lots, lat, lng) if x[1] <= radius]
+        assert index.within(lat, lng, radius) == expected
+
+
+@pytest.mark.parametrize("k, radius", [(1, None), (5, None), (20, None), (5, 500)])
+def test_nearest_matches_brute_force(lots, index, k, radius):
+    for lat, lng in sites():
+        expected = brute_force(lots, lat, lng)
+        if radius is not None:
+            expected = [x for x in expected if x[1] <= radius]
+        assert index.nearest(lat, lng, k, radius) == expected[:k]
+
+
+def test_empty_index():
+    index = ParkinglotIndex()
+    assert index.nearest(24.8, 120.97, 5) == []
+    assert index.within(24.8, 120.97, 1000) == []
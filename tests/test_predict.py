@@ -0,0 +1,92 @@
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from db import schema
+from db.schema import PREDICT_MAX_MINUTES
+from utils.nearby import ParkinglotIndex
+
+# the startup warmup is not run, the caches are empty
+client = TestClient(main.app)
+SITE = {"lat": 24.807, "lng": 120.969783}
+
+
+@pytest.mark.parametrize("minutes", [-1, PREDICT_MAX_MINUTES + 1])
+def test_predict_horizon_out_of_range(minutes):
+    response = client.get("/parking/predict", params={**SITE, "minutes": minutes})
+    assert response.status_code == 422
+
+    response = client.get("/parking/rank", params={**SITE, "minutes": minutes})
+    assert response.status_code == 422
+
+    response = client.post(
+        "/parking/predict/batch", json={"points": [{**SITE, "minutes": minutes}]}
+    )
+    assert response.status_code == 422
+
+
+@pytest.mark.parametrize("minutes", [0, PREDICT_MAX_MINUTES])
+def test_predict_horizon_in_range(minutes):
+    response = client.get("/parking/predict", params={**SITE, "minutes": minutes})
+    assert response.status_code == 200
+
+
+def test_predict_requires_minutes():
+    assert client.get("/parking/predict", params=SITE).status_code == 422
+
+
+def test_nearby_and_predict_are_separate_handlers():
+    endpoints = {
+        route.path: route.endpoint
+        for route in main.app.routes
+        if route.path in ("/parking/nearby", "/parking/predict")
+    }
+    assert endpoints["/parking/nearby"] is main.get_nearby_parkinglot_space
+    assert endpoints["/parking/predict"] is main.get_predicted_parkinglot_space
+
+
+def test_batch_matches_the_single_site_predictions(snapshot, monkeypatch):
+    lots = [
+        SimpleNamespace(id=i, latitude=SITE["lat"] + i * 0.001, longitude=SITE["lng"])
+        for i in range(1, 6)
+    ]
+    index = ParkinglotIndex()
+    index.build(lots)
+    monkeypatch.setattr(main, "parkinglot_index", index)
+    monkeypatch.setattr("utils.geocache.parkinglot_index", index)
+    t = datetime(2024, 5, 6, 12, 0)
+    # lot 5 has no space yet
+    snapshot.swap(
+        [
+            schema.ParkinglotSpace(
+                id=i,
+                carAvail=i * 10,
+                carTotal=100,
+                motoAvail=i,
+                motoTotal=20,
+                updateDate=t.date(),
+                updateDay=t.weekday(),
+                updateTime=t.time(),
+                parkinglot_id=i,
+            )
+            for i in range(1, 5)
+        ]
+    )
+    points = [
+        {**SITE, "minutes": 0},
+        {"lat": SITE["lat"] + 0.004, "lng": SITE["lng"], "minutes": 30},
+        {"lat": 25.5, "lng": 121.5, "minutes": 10},
+    ]
+
+    response = client.post(
+        "/parking/predict/batch", json={"points": points, "radius": 300}
+    )
+    assert response.status_code == 200
+    results = response.json()
+    assert [len(r["parkinglots"]) for r in results] == [2, 3, 0]
+    for p, r in zip(points, results):
+        single = client.get("/parking/predict", params={**p, "radius": 300})
+        assert r["parkinglots"] == single.json()
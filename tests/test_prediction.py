@@ -0,0 +1,69 @@
+from datetime import date, datetime, timedelta
+
+import numpy as np
+
+from db import schema
+from utils.prediction import BUCKET_MINUTES, TREND_WINDOW, SpaceForecaster
+
+# a Monday
+MONDAY = date(2024, 5, 6)
+
+
+def forecaster() -> SpaceForecaster:
+    # lot 1 fills up from 8:00, lot 2 has no history
+    f = SpaceForecaster()
+    rows = [
+        (1, 0, bucket, 100.0 if bucket < 8 * 60 // BUCKET_MINUTES else 40.0, 10.0)
+        for bucket in range(24 * 60 // BUCKET_MINUTES)
+    ]
+    f.build([1, 2], rows)
+    return f
+
+
+def test_predict_follows_the_seasonal_profile():
+    f = forecaster()
+    pred = f.predict(
+        [1, 2, 3],
+        [(90, 10), (50, 5), (50, 5)],
+        [(120, 20), (120, 20), (120, 20)],
+        [0, 0, 0],
+        [7 * 60 + 30] * 3,
+        60,
+    )
+    # lot 1 loses what the profile loses, the others keep their space
+    assert pred.tolist() == [[30, 10], [50, 5], [50, 5]]
+
+
+def test_predict_is_clipped_to_the_capacity():
+    f = forecaster()
+    pred = f.predict([1], [(95, 10)], [(100, 20)], [0], [8 * 60], [0])
+    assert pred.tolist() == [[95, 10]]
+    # from 8:00 back to the night profile on the next day
+    pred = f.predict([1], [(40, 10)], [(100, 20)], [0], [8 * 60], [23 * 60])
+    assert pred.tolist() == [[100, 10]]
+
+
+def test_observe_fits_the_recent_trend():
+    f = forecaster()
+    t = datetime.combine(MONDAY, datetime.min.time()) + timedelta(hours=3)
+    spaces = [
+        schema.ParkinglotSpace(
+            id=m,
+            carAvail=100 - m,
+            carTotal=120,
+            motoAvail=10,
+            motoTotal=20,
+            updateDate=MONDAY,
+            updateDay=0,
+            updateTime=(t + timedelta(minutes=m)).time(),
+            parkinglot_id=1,
+        )
+        for m in range(0, TREND_WINDOW, 5)
+    ]
+    f.observe(spaces)
+    np.testing.assert_allclose(f._state[2][0], (-1.0, 0.0), atol=1e-6)
+
+    # the trend fades out instead of running on (75 - 15 at most)
+    for minutes in (60, 120):
+        (pred,) = f.predict_spaces(spaces[-1:], minutes)
+        assert pred.carAvailPred == 60
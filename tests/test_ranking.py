@@ -0,0 +1,97 @@
+from datetime import datetime
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from db import schema
+from utils.ranking import LOT_TIMEZONE, LotRanker, is_open
+
+SITE = (24.8, 120.97)
+# a Monday at noon, local time of the lots
+NOON = datetime(2024, 5, 6, 12, 0, tzinfo=LOT_TIMEZONE)
+
+
+def lot(i, d_lat, fee=20, hours=(0, 24)):
+    return SimpleNamespace(
+        id=i,
+        name=f"lot {i}",
+        latitude=SITE[0] + d_lat,
+        longitude=SITE[1],
+        carChargeFeeWeek=fee,
+        carChargeFeeHoli=fee * 2,
+        motoChargeFeeWeek=10,
+        motoChargeFeeHoli=10,
+        startHour=hours[0],
+        endHour=hours[1],
+    )
+
+
+def space(i, car_avail, car_total=100):
+    return schema.ParkinglotSpace(
+        id=i,
+        carAvail=car_avail,
+        carTotal=car_total,
+        motoAvail=0,
+        motoTotal=0,
+        updateDate=NOON.date(),
+        updateDay=NOON.weekday(),
+        updateTime=NOON.time(),
+        parkinglot_id=i,
+    )
+
+
+@pytest.fixture
+def ranker(snapshot):
+    ranker = LotRanker()
+    ranker.build(
+        [
+            lot(1, 0.001),
+            lot(2, 0.002),
+            lot(3, 0.003, fee=60),
+            # closed at noon, too far, without space info, without car spaces
+            lot(4, 0.001, hours=(18, 6)),
+            lot(5, 0.05),
+            lot(6, 0.001),
+            lot(7, 0.001),
+        ]
+    )
+    snapshot.swap(
+        [space(1, 0), space(2, 50), space(3, 50), space(4, 50), space(5, 50)]
+        + [space(7, 0, car_total=0)]
+    )
+    return ranker
+
+
+def test_is_open():
+    start, end = np.array([8, 22, 0, 9]), np.array([20, 6, 24, 9])
+    assert is_open(start, end, 12).tolist() == [True, False, True, True]
+    assert is_open(start, end, 23).tolist() == [False, True, True, True]
+    assert is_open(start, end, 3).tolist() == [False, True, True, True]
+
+
+def test_rank_drops_the_lots_not_worth_going_to(ranker):
+    ranked = ranker.rank(*SITE, radius=1000, now=NOON)
+    # a full lot ranks below a pricier one
+    assert [x.parkinglot_id for x in ranked] == [2, 3, 1]
+    assert ranked[0].fee == 20 and ranked[0].avail == 50
+
+    # distance only: the nearest first
+    ranked = ranker.rank(*SITE, radius=1000, w_avail=0, w_price=0, now=NOON)
+    assert [x.parkinglot_id for x in ranked] == [1, 2, 3]
+    assert ranked[0].distance == pytest.approx(111.2, abs=0.1)
+
+
+def test_rank_at_arrival(ranker):
+    # open again at 18:00, the holiday fees on Saturday
+    ranked = ranker.rank(*SITE, minutes=6 * 60, radius=1000, now=NOON)
+    assert 4 in [x.parkinglot_id for x in ranked]
+    saturday = NOON.replace(day=11)
+    ranked = ranker.rank(*SITE, radius=1000, k=1, w_avail=0, w_price=0, now=saturday)
+    assert ranked[0].fee == 40
+
+
+def test_rank_follows_the_snapshot(ranker, snapshot):
+    assert [x.parkinglot_id for x in ranker.rank(*SITE, k=1, now=NOON)] == [2]
+    snapshot.swap([space(1, 80)])
+    assert [x.parkinglot_id for x in ranker.rank(*SITE, k=1, now=NOON)] == [1]
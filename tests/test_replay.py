@@ -0,0 +1,56 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, select
+
+from db import model
+from tests.conftest import seed_feed
+from utils.archive import FeedArchive
+from utils.replay import replay_archive
+
+START = datetime(2024, 5, 6, 23, 58)
+LOT = "府後地下停車場"
+
+
+def stored(bind):
+    space = model.ParkinglotSpace
+    agg = model.ParkinglotSpaceAgg.__table__
+    columns = [
+        space.parkinglot_id,
+        space.carAvail,
+        space.carTotal,
+        space.motoAvail,
+        space.motoTotal,
+        space.updateDay,
+        space.updateDatetime,
+    ]
+    with bind.connect() as conn:
+        return (
+            conn.execute(select(*columns).order_by(*columns)).all(),
+            conn.execute(select(agg).order_by(*agg.primary_key.columns)).all(),
+        )
+
+
+def test_replay_rebuilds_the_ingested_history(db, ingest, tmp_path):
+    archive = FeedArchive(str(tmp_path))
+    # across midnight, one payload archived twice
+    for m in range(4):
+        when = START + timedelta(minutes=m)
+        ingest(when, {LOT: m})
+        archive.save({"feed": seed_feed(when, {LOT: m})}, now=when)
+    archive.save({"feed": seed_feed(START, {LOT: 0})}, now=START)
+    ingested = stored(db)
+
+    with db.begin() as conn:
+        conn.execute(delete(model.ParkinglotSpace))
+        conn.execute(delete(model.ParkinglotSpaceAgg))
+    day = START.date()
+    replay_archive(db, str(tmp_path), day, day + timedelta(days=1), workers=1)
+    assert stored(db) == ingested
+
+    # the stored rows are skipped, --replace rebuilds the same
+    replay_archive(db, str(tmp_path), day, day + timedelta(days=1), workers=1)
+    assert stored(db) == ingested
+    replay_archive(
+        db, str(tmp_path), day, day + timedelta(days=1), workers=1, replace=True
+    )
+    assert stored(db) == ingested
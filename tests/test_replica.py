@@ -0,0 +1,181 @@
+import time
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine, insert
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import sessionmaker
+
+from db import model
+from utils import db_connect
+from utils.replica import ReplicaGuard
+
+# seconds the replica may lag in these tests
+MAX_LAG = 0.2
+START = datetime(2024, 5, 6, 8, 0)
+
+
+def make_db(path) -> Engine:
+    bind = create_engine(f"sqlite:///{path}")
+    model.Base.metadata.create_all(bind=bind)
+    with bind.begin() as conn:
+        conn.execute(
+            insert(model.ParkinglotInfo),
+            dict(
+                id=1,
+                name="lot",
+                address="address",
+                startHour=0,
+                endHour=24,
+                carChargeFeeWeek=20,
+                carChargeFeeHoli=30,
+                motoChargeFeeWeek=10,
+                motoChargeFeeHoli=10,
+                latitude=24.8,
+                longitude=120.97,
+            ),
+        )
+
+    return bind
+
+
+def ingest(bind, minutes: range):
+    """
+    one parkinglotSpace record per minute after START
+    """
+    rows = []
+    for m in minutes:
+        t = START + timedelta(minutes=m)
+        rows.append(
+            dict(
+                carAvail=m,
+                carTotal=100,
+                motoAvail=0,
+                motoTotal=0,
+                updateDate=t.date(),
+                updateDay=t.weekday(),
+                updateTime=t.time(),
+                updateDatetime=t,
+                parkinglot_id=1,
+            )
+        )
+    with bind.begin() as conn:
+        conn.execute(insert(model.ParkinglotSpace), rows)
+
+
+@pytest.fixture
+def primary(tmp_path):
+    bind = make_db(tmp_path / "primary.db")
+    yield bind
+    bind.dispose()
+
+
+@pytest.fixture
+def replica(tmp_path):
+    bind = make_db(tmp_path / "replica.db")
+    yield bind
+    bind.dispose()
+
+
+@pytest.fixture
+def guard(primary, replica, monkeypatch):
+    """
+    the guard of read_session, on the two databases
+    """
+    guard = ReplicaGuard(primary, replica, max_lag=MAX_LAG)
+    monkeypatch.setattr(db_connect, "replica_guard", guard)
+    monkeypatch.setattr(db_connect, "SessionLocal", sessionmaker(bind=primary))
+    monkeypatch.setattr(db_connect, "ReadSessionLocal", sessionmaker(bind=replica))
+
+    return guard
+
+
+def read_bind():
+    with db_connect.read_session() as db:
+        return db.get_bind()
+
+
+def test_stale_until_checked(guard, primary):
+    assert not guard.fresh
+    assert read_bind() is primary
+
+
+def test_caught_up_replica_serves_reads(guard, primary, replica):
+    ingest(primary, range(10))
+    ingest(replica, range(10))
+
+    assert guard.check()
+    assert guard.info()["lag"] == 0.0
+    assert read_bind() is replica
+
+
+def test_fallback_and_recovery(guard, primary, replica):
+    ingest(primary, range(10))
+    ingest(replica, range(5))
+
+    # behind at the first check: for how long is unknown
+    assert not guard.check()
+    assert guard.info()["lag"] is None
+    assert read_bind() is primary
+
+    # still unknown until the replica gets there
+    assert not guard.check()
+    assert read_bind() is primary
+
+    # the replica reaches it while the ingest goes on, behind by less than the
+    # max lag
+    ingest(primary, range(10, 15))
+    assert not guard.check()
+    ingest(replica, range(5, 10))
+    assert guard.check()
+    assert 0 <= guard.info()["lag"] <= MAX_LAG
+    assert read_bind() is replica
+
+    # still behind past the max lag
+    time.sleep(MAX_LAG * 1.5)
+    assert not guard.check()
+    assert guard.info()["lag"] > MAX_LAG
+    assert read_bind() is primary
+
+    # the replica catches up
+    ingest(replica, range(10, 15))
+    assert guard.check()
+    assert guard.info()["lag"] == 0.0
+    assert read_bind() is replica
+
+
+def test_lag_counts_from_the_first_unreached_marker(guard, primary, replica):
+    ingest(primary, range(5))
+    ingest(replica, range(5))
+    assert guard.check()
+
+    # the primary moves on twice, the replica only applies the first batch
+    ingest(primary, range(5, 10))
+    assert guard.check()
+    time.sleep(MAX_LAG * 1.5)
+    ingest(primary, range(10, 15))
+    ingest(replica, range(5, 10))
+
+    # the second batch was only just seen, the replica is not stale yet
+    assert guard.check()
+    assert guard.info()["lag"] <= MAX_LAG
+
+
+def test_unreachable_replica_falls_back(primary, tmp_path, monkeypatch):
+    missing = create_engine(f"sqlite:///{tmp_path / 'missing' / 'replica.db'}")
+    guard = ReplicaGuard(primary, missing, max_lag=MAX_LAG)
+    monkeypatch.setattr(db_connect, "replica_guard", guard)
+    monkeypatch.setattr(db_connect, "SessionLocal", sessionmaker(bind=primary))
+    monkeypatch.setattr(db_connect, "ReadSessionLocal", sessionmaker(bind=missing))
+
+    assert not guard.check()
+    assert guard.info()["lag"] is None
+    assert read_bind() is primary
+
+
+def test_without_replica_always_fresh(primary):
+    guard = ReplicaGuard(primary, primary)
+
+    assert not guard.enabled
+    assert guard.fresh
+    assert guard.check()
@@ -0,0 +1,95 @@
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from db import schema
+from utils.payload import space_payload
+
+# the startup warmup is not run, the tests fill the snapshot themselves
+client = TestClient(main.app)
+START = datetime(2024, 5, 6, 8, 0)
+
+
+@pytest.fixture
+def payload(monkeypatch):
+    monkeypatch.setattr(space_payload, "_state", (None, None, {}))
+
+    return space_payload
+
+
+def test_all_spaces_unavailable_until_the_snapshot_is_loaded(snapshot, payload):
+    response = client.get("/parking/space")
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "5"
+    assert "ETag" not in response.headers
+
+    snapshot.swap([])
+    response = client.get("/parking/space")
+    assert response.status_code == 200
+    assert response.json() == []
+    assert "ETag" in response.headers
+
+
+def space(parkinglot_id: int, car_avail: int, minute: int) -> schema.ParkinglotSpace:
+    t = START + timedelta(minutes=minute)
+    return schema.ParkinglotSpace(
+        id=parkinglot_id * 1000 + minute,
+        carAvail=car_avail,
+        carTotal=100,
+        motoAvail=0,
+        motoTotal=0,
+        updateDate=t.date(),
+        updateDay=t.weekday(),
+        updateTime=t.time(),
+        updateDatetime=t,
+        parkinglot_id=parkinglot_id,
+    )
+
+
+def test_swap_keeps_the_latest_space_of_each_lot(snapshot):
+    assert not snapshot.ready
+    assert snapshot.swap([space(1, 10, 0), space(2, 20, 0)]) == 1
+    assert snapshot.ready
+
+    # a late record does not replace a newer one
+    assert snapshot.swap([space(1, 11, 1), space(2, 21, -1)]) == 2
+    assert {x.parkinglot_id: x.carAvail for x in snapshot.all()} == {1: 11, 2: 20}
+    assert snapshot.headers()["X-Data-Version"] == "2"
+
+    changed = snapshot.changed([space(1, 11, 2), space(2, 22, 2), space(3, 30, 2)])
+    assert [x.parkinglot_id for x in changed] == [2, 3]
+
+
+def test_all_spaces_etag_lifecycle(snapshot, payload):
+    snapshot.swap([space(1, 10, 0), space(2, 20, 0)])
+    response = client.get("/parking/space")
+    assert response.status_code == 200
+    assert [x["carAvail"] for x in response.json()] == [10, 20]
+    etag = response.headers["ETag"]
+    assert response.headers["X-Data-Version"] == "1"
+
+    response = client.get("/parking/space", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.content == b""
+
+    # a new version with the same spaces keeps the ETag
+    snapshot.swap([space(1, 10, 0)])
+    response = client.get("/parking/space", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["X-Data-Version"] == "2"
+
+    snapshot.swap([space(1, 12, 1)])
+    response = client.get("/parking/space", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    assert [x["carAvail"] for x in response.json()] == [12, 20]
+
+
+def test_all_spaces_compressed_once_per_version(snapshot, payload):
+    snapshot.swap([space(i, i, 0) for i in range(1, 50)])
+    response = client.get("/parking/space", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert len(response.json()) == 49
+    assert payload.version == snapshot.version
@@ -0,0 +1,62 @@
+import os
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, select
+
+from db import model
+from tests.conftest import seed_feed
+from utils import scheduler
+from utils.spool import IngestSpool
+
+START = datetime(2024, 5, 6, 10, 0)
+
+
+def reopen(spool: IngestSpool) -> IngestSpool:
+    # a process restart, the lock goes with the old process
+    spool._owner.close()
+    return IngestSpool(spool.directory)
+
+
+def test_spool_round_trip(tmp_path):
+    spool = IngestSpool(str(tmp_path))
+    spool.append([b"a", b"b"])
+    spool.append([b"c"])
+    pending = list(spool.pending())
+    assert [raw for _, raw in pending] == [b"a", b"b", b"c"]
+
+    spool.ack(pending[1][0])
+    assert [raw for _, raw in spool.pending()] == [b"c"]
+
+    # a record torn by a crash is skipped, the restart writes a new segment
+    with open(spool._path(spool._segment), "ab") as f:
+        f.write(b"\x10\x00\x00\x00torn")
+    spool = reopen(spool)
+    spool.append([b"d"])
+    assert [raw for _, raw in spool.pending()] == [b"c", b"d"]
+
+    spool.ack(list(spool.pending())[-1][0])
+    assert list(spool.pending()) == []
+    assert spool.pending_bytes() == 0
+    assert spool.segments() == [spool._segment]
+
+
+def test_drain_moves_a_malformed_feed_to_the_dead_letters(
+    db, snapshot, tmp_path, monkeypatch
+):
+    spool = IngestSpool(str(tmp_path))
+    monkeypatch.setattr(scheduler, "ingest_spool", spool)
+    spool.append(
+        [seed_feed(START), b"not a feed", seed_feed(START + timedelta(minutes=1))]
+    )
+
+    scheduler.drain_spool(batch_bytes=1 << 20)
+
+    assert list(spool.pending()) == []
+    assert spool.dead_letters() == 1
+    (name,) = os.listdir(tmp_path / "dead")
+    assert (tmp_path / "dead" / name).read_bytes() == b"not a feed"
+    with db.connect() as conn:
+        times = conn.execute(
+            select(func.count(func.distinct(model.ParkinglotSpace.updateTime)))
+        ).scalar()
+    assert times == 2
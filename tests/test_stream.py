@@ -0,0 +1,108 @@
+import asyncio
+from datetime import date, time
+
+from db import schema
+from utils import stream
+from utils.stream import SpaceStreamHub
+
+
+def space(lot_id: int, car_avail: int) -> schema.ParkinglotSpace:
+    return schema.ParkinglotSpace(
+        id=lot_id,
+        carAvail=car_avail,
+        carTotal=100,
+        motoAvail=0,
+        motoTotal=0,
+        updateDate=date(2024, 5, 6),
+        updateDay=0,
+        updateTime=time(8, 0),
+        parkinglot_id=lot_id,
+    )
+
+
+def event_name(event: bytes) -> str:
+    return event.split(b"\n", 1)[0].decode().removeprefix("event: ")
+
+
+def test_diff_published_while_taking_the_snapshot():
+    async def run():
+        hub = SpaceStreamHub()
+        hub.bind(asyncio.get_running_loop())
+
+        def snapshot():
+            # the ingest commits right after the client subscribed
+            hub.publish(2, [space(1, 10)])
+            return 1, [space(1, 20)]
+
+        events = hub.stream([1], snapshot)
+        first = await events.__anext__()
+        second = await asyncio.wait_for(events.__anext__(), 1)
+        await events.aclose()
+
+        return hub, first, second
+
+    hub, first, second = asyncio.run(run())
+
+    assert event_name(first) == "snapshot"
+    assert event_name(second) == "diff"
+    assert b'"carAvail":10' in second
+    assert hub.info()["subscribers"] == 0
+
+
+def test_groups_share_events_and_only_get_their_lots():
+    async def run():
+        hub = SpaceStreamHub()
+        hub.bind(asyncio.get_running_loop())
+        a = hub.stream([1, 2], lambda: (0, []))
+        b = hub.stream([2, 1], lambda: (0, []))
+        c = hub.stream([3], lambda: (0, []))
+        for s in (a, b, c):
+            await s.__anext__()
+        assert hub.info() == {
+            "groups": 2,
+            "subscribers": 3,
+            "published": 0,
+            "dropped": 0,
+        }
+
+        hub.publish(1, [space(2, 5)])
+        got_a = await asyncio.wait_for(a.__anext__(), 1)
+        got_b = await asyncio.wait_for(b.__anext__(), 1)
+        c_task = asyncio.ensure_future(c.__anext__())
+        await asyncio.sleep(0.05)
+        c_waiting = not c_task.done()
+        c_task.cancel()
+        for s in (a, b):
+            await s.aclose()
+
+        return got_a, got_b, c_waiting
+
+    got_a, got_b, c_waiting = asyncio.run(run())
+
+    # serialized once for the group
+    assert got_a is got_b
+    assert c_waiting
+
+
+def test_slow_subscriber_is_dropped(monkeypatch):
+    monkeypatch.setattr(stream, "STREAM_QUEUE_SIZE", 2)
+
+    async def run():
+        hub = SpaceStreamHub()
+        hub.bind(asyncio.get_running_loop())
+        events = hub.stream([1], lambda: (0, []))
+        await events.__anext__()
+        for version in range(1, 4):
+            hub.publish(version, [space(1, version)])
+        await asyncio.sleep(0.05)
+
+        # the stream ends, the client reconnects for a new snapshot
+        rest = [e async for e in events]
+
+        return hub, rest
+
+    hub, rest = asyncio.run(run())
+
+    assert hub.dropped == 1
+    assert [event_name(e) for e in rest] == ["diff"]
+    assert hub.info()["subscribers"] == 0
@@ -0,0 +1,51 @@
+from fastapi.testclient import TestClient
+
+import main
+from utils.leader import lead_or_follow
+from utils.warmup import Warmup
+
+
+def test_failed_step_is_retried_until_ready():
+    warmup = Warmup(retry_seconds=0)
+    done = []
+
+    def flaky():
+        done.append("cache")
+        if done.count("cache") < 3:
+            raise ConnectionError("database is starting up")
+
+    assert warmup.info()["status"] == "starting"
+    warmup.run([("schema", lambda: done.append("schema")), ("cache", flaky)])
+
+    assert done == ["schema", "cache", "cache", "cache"]
+    assert warmup.ready
+    assert warmup.info()["status"] == "ready"
+    assert warmup.info()["error"] is None
+
+
+def test_health_is_503_until_ready(monkeypatch):
+    warmup = Warmup(retry_seconds=0)
+    monkeypatch.setattr(main, "warmup", warmup)
+    client = TestClient(main.app)
+
+    response = client.get("/health")
+    assert response.status_code == 503
+    assert response.json()["status"] == "starting"
+
+    warmup.run([])
+    assert client.get("/health").status_code == 200
+
+
+def test_lead_or_follow():
+    def job():
+        return "job"
+
+    def follow():
+        return "follow"
+
+    assert lead_or_follow(job, follow, mode="embedded")() == "job"
+    assert lead_or_follow(job, follow, mode="off")() == "follow"
+    assert lead_or_follow(job, mode="off")() is None
+    # not on Postgres: the single process holds the lease
+    assert lead_or_follow(job, follow, mode="leader")() == "job"
+    assert lead_or_follow(job, follow, mode="leader").__name__ == "job"
@@ -0,0 +1,354 @@
+from datetime import datetime, timedelta
+from typing import Iterable, List, Optional
+
+from sqlalchemy import (
+    Integer,
+    case,
+    cast,
+    delete,
+    extract,
+    func,
+    inspect,
+    literal,
+    select,
+    union_all,
+)
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from db import model
+
+# minutes per time bucket of the aggregates (the hourly one is the rollup)
+AGG_RESOLUTIONS = (5, 15, 60)
+
+AGG_KEYS = ["parkinglot_id", "updateDay", "bucketMinutes", "bucket"]
+# aggregate rows per upsert statement, keeps the bind parameters under the
+# limits of the drivers (a replayed day folds in hundreds of thousands)
+AGG_UPSERT_BATCH = 2500
+
+
+def minute_of_day(column):
+    """
+    SQL expression of the minute of the day (0 ~ 1439) of a time column
+    """
+    return cast(extract("hour", column), Integer) * 60 + cast(
+        extract("minute", column), Integer
+    )
+
+
+def extended_minutes():
+    """
+    SQL expression of the minutes from the start of a raw record to its
+    lastSeen, 0 if the change-only ingest did not extend it (it only extends a
+    record within its day)
+    """
+    space = model.ParkinglotSpace
+
+    return case(
+        (space.lastSeen.is_(None), 0),
+        else_=minute_of_day(space.lastSeen) - minute_of_day(space.updateTime),
+    )
+
+
+def max_extended_minutes(*where):
+    """
+    select the longest extended_minutes of the raw records matching `where`
+    """
+    space = model.ParkinglotSpace
+
+    return select(func.coalesce(func.max(extended_minutes()), 0)).where(
+        space.lastSeen.is_not(None), *where
+    )
+
+
+def extended_reports(start: datetime, last_seen: Optional[datetime], seen_count: Optional[int]) -> List[datetime]:
+    """
+    when the reports a raw record stands for were made: a record extended by
+    the change-only ingest stands for seenCount reports from its start to
+    lastSeen, taken as evenly spaced: one per minute as the ingest only extends
+    a record by the minute after it, spread out for older records
+    """
+    if last_seen is None or not seen_count or seen_count < 2:
+        return [start]
+
+    span = int((last_seen - start).total_seconds()) // 60
+    return [
+        start + timedelta(minutes=i * span // (seen_count - 1))
+        for i in range(seen_count)
+    ]
+
+
+def spread_space(resolution: int, max_span: int, *where):
+    """
+    select the raw records matching `where` per bucket of `resolution` minutes
+    (parkinglot_id, updateDate, updateDay, bucket, count, carAvail, carTotal,
+    motoAvail, motoTotal), the reports of a record extended by the change-only
+    ingest (at most `max_span` minutes long) counted in the buckets they were
+    made in, see extended_reports
+    """
+    space = model.ParkinglotSpace
+    start = minute_of_day(space.updateTime)
+    span = extended_minutes()
+    seen = func.coalesce(space.seenCount, 1)
+
+    # offsets of the buckets a record can reach from the one it starts in
+    offsets = union_all(
+        *(
+            select(literal(k * resolution, Integer).label("offset"))
+            for k in range(-(-max_span // resolution) + 1)
+        )
+    ).subquery("offsets")
+    bucket = start // resolution * resolution + offsets.c.offset
+    # first and last minute of the record within the bucket, from its start
+    first = case((bucket > start, bucket - start), else_=0)
+    last = case(
+        (bucket + (resolution - 1) < start + span, bucket + (resolution - 1) - start),
+        else_=span,
+    )
+
+    # reports i * span // (seen - 1) up to minute x: ceil((x + 1) * (seen - 1) / span)
+    def reports_until(x):
+        return (x * (seen - 1) + span - 1) // span
+
+    count = case(
+        ((span == 0) | (seen < 2), case((first == 0, seen), else_=0)),
+        else_=reports_until(last + 1) - reports_until(first),
+    )
+
+    return (
+        select(
+            space.parkinglot_id.label("parkinglot_id"),
+            space.updateDate.label("updateDate"),
+            space.updateDay.label("updateDay"),
+            bucket.label("bucket"),
+            count.label("count"),
+            space.carAvail.label("carAvail"),
+            space.carTotal.label("carTotal"),
+            space.motoAvail.label("motoAvail"),
+            space.motoTotal.label("motoTotal"),
+        )
+        .join(offsets, bucket <= start + span)
+        .where(count > 0, *where)
+    )
+
+
+def aggregate_rows(rows: Iterable) -> List[dict]:
+    """
+    fold newly inserted parkinglotSpace rows into aggregate rows, one per
+    (lot, weekday, resolution, bucket)
+    """
+    agg_dict = {}
+    for r in rows:
+        minute = r.updateTime.hour * 60 + r.updateTime.minute
+        for resolution in AGG_RESOLUTIONS:
+            bucket = minute // resolution * resolution
+            key = (r.parkinglot_id, r.updateDay, resolution, bucket)
+            agg = agg_dict.get(key)
+            if agg is None:
+                agg_dict[key] = dict(
+                    zip(AGG_KEYS, key),
+                    count=1,
+                    carAvailSum=r.carAvail,
+                    carAvailMin=r.carAvail,
+                    carAvailMax=r.carAvail,
+                    motoAvailSum=r.motoAvail,
+                    motoAvailMin=r.motoAvail,
+                    motoAvailMax=r.motoAvail,
+                )
+                continue
+
+            agg["count"] += 1
+            agg["carAvailSum"] += r.carAvail
+            agg["carAvailMin"] = min(agg["carAvailMin"], r.carAvail)
+            agg["carAvailMax"] = max(agg["carAvailMax"], r.carAvail)
+            agg["motoAvailSum"] += r.motoAvail
+            agg["motoAvailMin"] = min(agg["motoAvailMin"], r.motoAvail)
+            agg["motoAvailMax"] = max(agg["motoAvailMax"], r.motoAvail)
+
+    return list(agg_dict.values())
+
+
+def upsert_space_aggregates(db: Session, rows: Iterable) -> int:
+    """
+    add newly inserted parkinglotSpace rows to the aggregates (one statement
+    per AGG_UPSERT_BATCH aggregate rows), meant to run in the same transaction
+    as the insert
+    """
+    values = aggregate_rows(rows)
+    for i in range(0, len(values), AGG_UPSERT_BATCH):
+        db.execute(upsert_statement(values[i : i + AGG_UPSERT_BATCH]))
+
+    return len(values)
+
+
+def upsert_statement(values: List[dict]):
+    table = model.ParkinglotSpaceAgg.__table__
+    stmt = insert(table).values(values)
+    excluded = stmt.excluded
+
+    def smaller(name):
+        return case(
+            (excluded[name] < table.c[name], excluded[name]), else_=table.c[name]
+        )
+
+    def larger(name):
+        return case(
+            (excluded[name] > table.c[name], excluded[name]), else_=table.c[name]
+        )
+
+    stmt = stmt.on_conflict_do_update(
+        index_elements=AGG_KEYS,
+        set_={
+            "count": table.c["count"] + excluded["count"],
+            "carAvailSum": table.c["carAvailSum"] + excluded["carAvailSum"],
+            "carAvailMin": smaller("carAvailMin"),
+            "carAvailMax": larger("carAvailMax"),
+            "motoAvailSum": table.c["motoAvailSum"] + excluded["motoAvailSum"],
+            "motoAvailMin": smaller("motoAvailMin"),
+            "motoAvailMax": larger("motoAvailMax"),
+        },
+    )
+
+    return stmt
+
+
+def space_contributions(resolution: int, max_span: int, max_compact_minutes: int):
+    """
+    (lot, weekday, bucket, count, sums, min / max) contributions to the
+    aggregates of `resolution` of the raw records (see spread_space) and of the
+    compacted buckets. A compacted bucket longer than `resolution` is spread
+    evenly over the buckets it covers, with its mean and its min / max
+    """
+    space = model.ParkinglotSpace
+    compact = model.ParkinglotSpaceCompact
+
+    r = spread_space(
+        resolution, max_span, space.parkinglot_id.is_not(None)
+    ).subquery("raw")
+    raw = select(
+        r.c.parkinglot_id,
+        r.c.updateDay,
+        r.c.bucket,
+        r.c["count"],
+        (r.c.carAvail * r.c["count"]).label("carAvailSum"),
+        r.c.carAvail.label("carAvailMin"),
+        r.c.carAvail.label("carAvailMax"),
+        (r.c.motoAvail * r.c["count"]).label("motoAvailSum"),
+        r.c.motoAvail.label("motoAvailMin"),
+        r.c.motoAvail.label("motoAvailMax"),
+    )
+    if not max_compact_minutes:
+        return raw
+
+    # offsets of the buckets of `resolution` within a compacted bucket
+    offsets = union_all(
+        *(
+            select(literal(k * resolution, Integer).label("offset"))
+            for k in range(max(-(-max_compact_minutes // resolution), 1))
+        )
+    ).subquery("offsets")
+    share = case(
+        (
+            compact.bucketMinutes > resolution,
+            case(
+                (compact.count * resolution // compact.bucketMinutes < 1, 1),
+                else_=compact.count * resolution // compact.bucketMinutes,
+            ),
+        ),
+        else_=compact.count,
+    )
+    spread = select(
+        compact.parkinglot_id,
+        compact.updateDay,
+        ((compact.bucket + offsets.c.offset) // resolution * resolution).label(
+            "bucket"
+        ),
+        share.label("count"),
+        (compact.carAvailSum * share // compact.count).label("carAvailSum"),
+        compact.carAvailMin,
+        compact.carAvailMax,
+        (compact.motoAvailSum * share // compact.count).label("motoAvailSum"),
+        compact.motoAvailMin,
+        compact.motoAvailMax,
+    ).join(offsets, offsets.c.offset < compact.bucketMinutes)
+
+    return union_all(raw, spread)
+
+
+def rebuild_space_aggregates(target, connection, **kw):
+    """
+    recompute all the aggregates from the parkinglotSpace history, the raw
+    records and the compacted buckets. Runs right after the aggregate table is
+    created and after a replay replacing history
+    """
+    space = model.ParkinglotSpace
+    compact = model.ParkinglotSpaceCompact
+    agg = model.ParkinglotSpaceAgg.__table__
+    if not inspect(connection).has_table(space.__tablename__):
+        return
+
+    max_span = connection.execute(max_extended_minutes()).scalar()
+    max_compact_minutes = 0
+    if inspect(connection).has_table(compact.__tablename__):
+        max_compact_minutes = connection.execute(
+            select(func.max(compact.bucketMinutes))
+        ).scalar() or 0
+
+    connection.execute(delete(agg))
+    for resolution in AGG_RESOLUTIONS:
+        c = space_contributions(resolution, max_span, max_compact_minutes).subquery()
+        connection.execute(
+            insert(agg).from_select(
+                AGG_KEYS
+                + [
+                    "count",
+                    "carAvailSum",
+                    "carAvailMin",
+                    "carAvailMax",
+                    "motoAvailSum",
+                    "motoAvailMin",
+                    "motoAvailMax",
+                ],
+                select(
+                    c.c.parkinglot_id,
+                    c.c.updateDay,
+                    literal(resolution),
+                    c.c.bucket,
+                    func.sum(c.c.count),
+                    func.sum(c.c.carAvailSum),
+                    func.min(c.c.carAvailMin),
+                    func.max(c.c.carAvailMax),
+                    func.sum(c.c.motoAvailSum),
+                    func.min(c.c.motoAvailMin),
+                    func.max(c.c.motoAvailMax),
+                ).group_by(c.c.parkinglot_id, c.c.updateDay, c.c.bucket),
+            )
+        )
+
+    print("Rebuild parkinglotSpace aggregates at: ", datetime.now())
+
+
+def typical_curve_query(
+    parking_id: int, resolution: int, day: Optional[int] = None
+):
+    """
+    select the typical-occupancy curve of a lot from the aggregates, for one
+    weekday or over the whole week
+    """
+    agg = model.ParkinglotSpaceAgg
+    count = func.sum(agg.count)
+
+    query = select(
+        agg.bucket,
+        count.label("count"),
+        (func.sum(agg.carAvailSum) * 1.0 / count).label("carAvailMean"),
+        func.min(agg.carAvailMin).label("carAvailMin"),
+        func.max(agg.carAvailMax).label("carAvailMax"),
+        (func.sum(agg.motoAvailSum) * 1.0 / count).label("motoAvailMean"),
+        func.min(agg.motoAvailMin).label("motoAvailMin"),
+        func.max(agg.motoAvailMax).label("motoAvailMax"),
+    ).where(agg.parkinglot_id == parking_id, agg.bucketMinutes == resolution)
+    if day is not None:
+        query = query.where(agg.updateDay == day)
+
+    return query.group_by(agg.bucket).order_by(agg.bucket)
@@ -0,0 +1,125 @@
+import os
+import gzip
+import hashlib
+import threading
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+from utils.fetch_parking import parse_feed
+from utils.process import process_parking_data
+
+# keeps every new raw feed payload of the ingest when set, for replay.py
+FEED_ARCHIVE_DIR = os.getenv("FEED_ARCHIVE_DIR")
+
+ARCHIVE_SUFFIX = ".json.gz"
+
+
+def feed_key(target: str) -> str:
+    return hashlib.sha1(target.encode()).hexdigest()[:8]
+
+
+class FeedArchive:
+    """
+    the raw feed payloads on disk, gzip compressed, one directory per day:
+        <dir>/YYYY-MM-DD/HHMMSS-<feed>-<content hash>.json.gz
+
+    a payload whose content is already archived that day is not written again
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._lock = threading.Lock()
+        # (day, content hashes archived that day)
+        self._seen: Tuple[Optional[date], Set[str]] = (None, set())
+
+    def _day_dir(self, day: date) -> str:
+        return os.path.join(self.directory, day.isoformat())
+
+    def _hashes(self, day: date) -> Set[str]:
+        seen_day, hashes = self._seen
+        if seen_day != day:
+            path = self._day_dir(day)
+            names = os.listdir(path) if os.path.isdir(path) else []
+            hashes = {
+                name[: -len(ARCHIVE_SUFFIX)].rsplit("-", 1)[-1]
+                for name in names
+                if name.endswith(ARCHIVE_SUFFIX)
+            }
+            self._seen = (day, hashes)
+
+        return hashes
+
+    def save(
+        self, raw_dict: Dict[str, bytes], now: Optional[datetime] = None
+    ) -> int:
+        """
+        archive the payloads of {feed url: payload} fetched at `now`, return
+        the number of files written
+        """
+        now = now or datetime.now()
+        written = 0
+        with self._lock:
+            hashes = self._hashes(now.date())
+            for target, raw in raw_dict.items():
+                digest = hashlib.sha256(raw).hexdigest()[:16]
+                if digest in hashes:
+                    continue
+
+                path = os.path.join(
+                    self._day_dir(now.date()),
+                    f"{now:%H%M%S}-{feed_key(target)}-{digest}{ARCHIVE_SUFFIX}",
+                )
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                # renamed into place, a partial file is never picked up
+                tmp_path = f"{path}.tmp"
+                with open(tmp_path, "wb") as f:
+                    f.write(gzip.compress(raw, compresslevel=6))
+                os.replace(tmp_path, path)
+                hashes.add(digest)
+                written += 1
+
+        return written
+
+
+def archived_files(
+    directory: str, start: date, end: date
+) -> Iterator[Tuple[date, str]]:
+    """
+    (day, path) of the archived payloads between two days (inclusive), in
+    the order they were fetched
+    """
+    day = start
+    while day <= end:
+        path = os.path.join(directory, day.isoformat())
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.endswith(ARCHIVE_SUFFIX):
+                    yield day, os.path.join(path, name)
+        day += timedelta(days=1)
+
+
+def parse_archived(path: str) -> List[tuple]:
+    """
+    the parkinglotSpace values of an archived payload, keyed by lot name, parsed
+    by process_parking_data (the reference parser). Runs in the replay workers
+    """
+    with open(path, "rb") as f:
+        raw = gzip.decompress(f.read())
+
+    return [
+        (
+            p.name,
+            p.carAvail,
+            p.carTotal,
+            p.motoAvail,
+            p.motoTotal,
+            p.updateDate,
+            p.updateDay,
+            p.updateTime,
+            p.updateDatetime,
+        )
+        for p in process_parking_data(parse_feed(raw))
+    ]
+
+
+feed_archive = FeedArchive(FEED_ARCHIVE_DIR) if FEED_ARCHIVE_DIR else None
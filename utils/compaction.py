@@ -0,0 +1,130 @@
+import os
+from datetime import date, datetime, timedelta
+from typing import List
+
+from sqlalchemy import and_, case, delete, func, literal, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.engine import Engine
+
+from db import model
+from utils.aggregate import max_extended_minutes, spread_space
+
+# raw records older than this many days are compacted
+SPACE_COMPACT_AFTER_DAYS = int(os.getenv("SPACE_COMPACT_AFTER_DAYS", "7"))
+# bucket size of the compacted history
+SPACE_COMPACT_MINUTES = int(os.getenv("SPACE_COMPACT_MINUTES", "15"))
+# lots compacted per transaction, bounds how long the rows stay locked
+SPACE_COMPACT_BATCH_LOTS = int(os.getenv("SPACE_COMPACT_BATCH_LOTS", "100"))
+
+COMPACT_KEYS = ["parkinglot_id", "updateDate", "bucket"]
+
+
+def compact_space_day(
+    bind: Engine, day: date, parkinglot_ids: List[int], minutes: int
+) -> int:
+    """
+    collapse the raw records of `day` of some lots into buckets and delete them,
+    in one transaction, return the number of deleted records
+    """
+    space = model.ParkinglotSpace
+    table = model.ParkinglotSpaceCompact.__table__
+    where = and_(space.updateDate == day, space.parkinglot_id.in_(parkinglot_ids))
+
+    with bind.connect() as conn:
+        max_span = conn.execute(max_extended_minutes(where)).scalar()
+    # a record extended by the change-only ingest counts in every bucket it reaches
+    r = spread_space(minutes, max_span, where).subquery("raw")
+
+    stmt = insert(table).from_select(
+        COMPACT_KEYS
+        + [
+            "bucketMinutes",
+            "updateDay",
+            "count",
+            "carAvailSum",
+            "carAvailMin",
+            "carAvailMax",
+            "carTotal",
+            "motoAvailSum",
+            "motoAvailMin",
+            "motoAvailMax",
+            "motoTotal",
+        ],
+        select(
+            r.c.parkinglot_id,
+            r.c.updateDate,
+            r.c.bucket,
+            literal(minutes),
+            func.min(r.c.updateDay),
+            func.sum(r.c["count"]),
+            func.sum(r.c.carAvail * r.c["count"]),
+            func.min(r.c.carAvail),
+            func.max(r.c.carAvail),
+            func.max(r.c.carTotal),
+            func.sum(r.c.motoAvail * r.c["count"]),
+            func.min(r.c.motoAvail),
+            func.max(r.c.motoAvail),
+            func.max(r.c.motoTotal),
+        ).group_by(r.c.parkinglot_id, r.c.updateDate, r.c.bucket),
+    )
+    excluded = stmt.excluded
+
+    def merged(name, op):
+        return case(
+            (op(excluded[name], table.c[name]), excluded[name]), else_=table.c[name]
+        )
+
+    # records arriving late for an already compacted bucket are merged in
+    stmt = stmt.on_conflict_do_update(
+        index_elements=COMPACT_KEYS,
+        set_={
+            "count": table.c["count"] + excluded["count"],
+            "carAvailSum": table.c["carAvailSum"] + excluded["carAvailSum"],
+            "carAvailMin": merged("carAvailMin", lambda a, b: a < b),
+            "carAvailMax": merged("carAvailMax", lambda a, b: a > b),
+            "carTotal": merged("carTotal", lambda a, b: a > b),
+            "motoAvailSum": table.c["motoAvailSum"] + excluded["motoAvailSum"],
+            "motoAvailMin": merged("motoAvailMin", lambda a, b: a < b),
+            "motoAvailMax": merged("motoAvailMax", lambda a, b: a > b),
+            "motoTotal": merged("motoTotal", lambda a, b: a > b),
+        },
+    )
+
+    with bind.begin() as conn:
+        conn.execute(stmt)
+        return conn.execute(delete(space).where(where)).rowcount
+
+
+def compact_space_history(
+    bind: Engine,
+    after_days: int = SPACE_COMPACT_AFTER_DAYS,
+    minutes: int = SPACE_COMPACT_MINUTES,
+    batch_lots: int = SPACE_COMPACT_BATCH_LOTS,
+):
+    """
+    compact the raw records older than `after_days` days, one day and
+    `batch_lots` lots per transaction
+    """
+    cutoff = date.today() - timedelta(days=after_days)
+    with bind.connect() as conn:
+        first_day = conn.execute(
+            select(func.min(model.ParkinglotSpace.updateDate)).where(
+                model.ParkinglotSpace.updateDate < cutoff
+            )
+        ).scalar()
+        parkinglot_ids = conn.execute(select(model.ParkinglotInfo.id)).scalars().all()
+
+    compacted, day = 0, first_day
+    while day is not None and day < cutoff:
+        for i in range(0, len(parkinglot_ids), batch_lots):
+            compacted += compact_space_day(
+                bind, day, parkinglot_ids[i : i + batch_lots], minutes
+            )
+        day += timedelta(days=1)
+
+    print(
+        "Compact parkinglotSpace at: ",
+        datetime.now(),
+        f"(records: {compacted}, before: {cutoff})",
+    )
+
@@ -1,11 +1,21 @@
 import os
+from contextlib import contextmanager
 from datetime import datetime
+from typing import List, Optional
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, inspect, select, text
+from sqlalchemy.schema import DropIndex
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 
-from utils.fetch_parking import fetch_parking
+from utils.fetch_parking import fetch_parking, parse_feed, PARKING_FEED_URLS
 from utils.process import process_parking_data
+from utils.nearby import parkinglot_index
+from utils.payload import load_info_payload
+from utils.metrics import instrument_engine
+from utils.aggregate import rebuild_space_aggregates
+from utils.maintenance import dedup_space_rows, ensure_space_partitions
+from utils.replica import ReplicaGuard
 from db import model
 
 DB_HOST = str(os.getenv("DB_HOST"))
@@ -14,14 +24,90 @@ DB_NAME = str(os.getenv("DB_NAME"))
 DB_USERNAME = str(os.getenv("DB_USERNAME"))
 DB_PASSWORD = str(os.getenv("DB_PASSWORD"))
 
-SQLALCHEMY_DATABASE_URL = (
+# connection pool, shared by the sync and the async engine
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+
+# full urls override the DB_* settings above (e.g. a local stand-in database)
+SQLALCHEMY_DATABASE_URL = os.getenv("DB_URL") or (
     f"postgresql://{DB_USERNAME}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
 )
+ASYNC_SQLALCHEMY_DATABASE_URL = os.getenv("DB_ASYNC_URL") or (
+    f"postgresql+asyncpg://{DB_USERNAME}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+)
+
+# read replica for the query endpoints, the primary serves every read when unset
+DB_READ_HOST = os.getenv("DB_READ_HOST")
+DB_READ_PORT = str(os.getenv("DB_READ_PORT", DB_PORT))
+READ_DATABASE_URL = os.getenv("DB_READ_URL") or (
+    f"postgresql://{DB_USERNAME}:{DB_PASSWORD}@{DB_READ_HOST}:{DB_READ_PORT}/{DB_NAME}"
+    if DB_READ_HOST
+    else None
+)
+ASYNC_READ_DATABASE_URL = os.getenv("DB_READ_ASYNC_URL") or (
+    f"postgresql+asyncpg://{DB_USERNAME}:{DB_PASSWORD}@{DB_READ_HOST}:{DB_READ_PORT}/{DB_NAME}"
+    if DB_READ_HOST
+    else None
+)
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
+# local copy of the feed (e.g. data/GetParkInfo.json) the parkinglotInfo table
+# is seeded from when it is created, instead of fetching the upstream feeds
+PARKING_INFO_SEED = os.getenv("PARKING_INFO_SEED")
+
+# advisory lock serializing the schema setup of concurrently starting processes
+SCHEMA_LOCK_KEY = 7205423101
+
+pool_options = dict(
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT,
+    pool_recycle=DB_POOL_RECYCLE,
+    pool_pre_ping=True,
+)
+
+engine = create_engine(SQLALCHEMY_DATABASE_URL, **pool_options)
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+async_engine = create_async_engine(ASYNC_SQLALCHEMY_DATABASE_URL, **pool_options)
+
+AsyncSessionLocal = async_sessionmaker(
+    async_engine, autoflush=False, expire_on_commit=False
+)
+
+instrument_engine(engine, "sync")
+instrument_engine(async_engine.sync_engine, "async")
+
+if READ_DATABASE_URL and ASYNC_READ_DATABASE_URL:
+    read_engine = create_engine(READ_DATABASE_URL, **pool_options)
+    async_read_engine = create_async_engine(ASYNC_READ_DATABASE_URL, **pool_options)
+    instrument_engine(read_engine, "read")
+    instrument_engine(async_read_engine.sync_engine, "async_read")
+else:
+    read_engine, async_read_engine = engine, async_engine
+
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
+
+AsyncReadSessionLocal = async_sessionmaker(
+    async_read_engine, autoflush=False, expire_on_commit=False
+)
+
+# falls back to the primary when the replica lags behind the ingest
+replica_guard = ReplicaGuard(engine, read_engine)
+
+
+def read_session():
+    """
+    session on the replica if it is fresh, on the primary otherwise
+    """
+    return ReadSessionLocal() if replica_guard.fresh else SessionLocal()
+
+
+def async_read_session():
+    return AsyncReadSessionLocal() if replica_guard.fresh else AsyncSessionLocal()
+
 
 def get_db():
     db = SessionLocal()
@@ -31,26 +117,241 @@ def get_db():
         db.close()
 
 
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+def get_read_db():
+    db = read_session()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+async def get_async_read_db():
+    async with async_read_session() as db:
+        yield db
+
+
+def upgrade_schema(bind):
+    """
+    add the columns and indexes missing on tables that already exist
+    (create_all only creates them together with new tables)
+    """
+    inspector = inspect(bind)
+    with bind.begin() as conn:
+        for table in model.Base.metadata.sorted_tables:
+            existing = {c["name"] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing or not column.nullable:
+                    continue
+                conn.execute(
+                    text(
+                        f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" '
+                        f"{column.type.compile(dialect=bind.dialect)}"
+                    )
+                )
+
+    for table in model.Base.metadata.sorted_tables:
+        reflected = {
+            x["name"]: x for x in inspector.get_indexes(table.name) if x["name"]
+        }
+        for index in table.indexes:
+            if index.name in reflected:
+                if bind.dialect.name == "postgresql" and covers_less(
+                    reflected[index.name], index
+                ):
+                    rebuild_index(bind, index)
+                continue
+            if index.unique and table.name == model.ParkinglotSpace.__tablename__:
+                # duplicates would fail the index, and were counted twice
+                deduped = dedup_space_rows(bind)
+                if deduped:
+                    with bind.begin() as conn:
+                        rebuild_space_aggregates(None, conn)
+                print("Dedup parkinglotSpace at: ", datetime.now(), f"(rows: {deduped})")
+            create_index(bind, index)
+
+
+def covers_less(reflected: dict, index) -> bool:
+    """
+    whether an existing postgres index lacks INCLUDE columns of the model
+    (e.g. columns added since), which costs the index-only reads
+    """
+    wanted = index.dialect_options["postgresql"]["include"] or []
+    existing = reflected.get("dialect_options", {}).get("postgresql_include") or []
+
+    return bool(set(wanted) - set(existing))
+
+
+def rebuild_index(bind, index):
+    """
+    replace an existing index by the one of the model: the old one is renamed,
+    the new one built next to it, then the old one dropped
+    """
+    old_name = f"{index.name}_old"
+    with bind.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text(f'ALTER INDEX "{index.name}" RENAME TO "{old_name}"'))
+    create_index(bind, index)
+    with bind.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text(f'DROP INDEX IF EXISTS "{old_name}"'))
+
+    print("Rebuild index at: ", datetime.now(), f"({index.name})")
+
+
+def create_index(bind, index):
+    """
+    create a missing index of an existing table, without blocking the writes on
+    postgres (CONCURRENTLY, not possible on a partitioned table)
+    """
+    options = index.dialect_options["postgresql"]
+    if (
+        bind.dialect.name != "postgresql"
+        or index.table.dialect_options["postgresql"]["partition_by"]
+    ):
+        index.create(bind=bind, checkfirst=True)
+        return
+
+    options["concurrently"] = True
+    try:
+        with bind.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            try:
+                index.create(bind=conn, checkfirst=True)
+            except Exception:
+                # a failed concurrent build leaves an invalid index behind
+                conn.execute(DropIndex(index, if_exists=True))
+                raise
+    finally:
+        options["concurrently"] = False
+
+
+@contextmanager
+def advisory_lock(bind, key: int):
+    """
+    hold a Postgres session-level advisory lock for the block, waiting for it
+    if another process has it (no-op on other databases)
+    """
+    if bind.dialect.name != "postgresql":
+        yield
+        return
+
+    with bind.connect() as conn:
+        conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": key})
+        conn.commit()
+        try:
+            yield
+        finally:
+            conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": key})
+            conn.commit()
+
+
+def init_database(bind):
+    """
+    create / upgrade the tables, one process at a time
+    """
+    # insert data right after the table creation
+    if not event.contains(
+        model.ParkinglotInfo.__table__, "after_create", insert_parking_info
+    ):
+        event.listen(
+            model.ParkinglotInfo.__table__, "after_create", insert_parking_info
+        )
+    # fill the aggregates from the existing history when the table is new
+    if not event.contains(
+        model.ParkinglotSpaceAgg.__table__, "after_create", rebuild_space_aggregates
+    ):
+        event.listen(
+            model.ParkinglotSpaceAgg.__table__,
+            "after_create",
+            rebuild_space_aggregates,
+        )
+
+    with advisory_lock(bind, SCHEMA_LOCK_KEY):
+        model.Base.metadata.create_all(bind=bind)
+        upgrade_schema(bind)
+        ensure_space_partitions(bind)
+
+        # the DDL is not transactional everywhere (SQLite): a table created
+        # while the feeds were unreachable stays empty, fill it now or fail
+        with bind.connect() as conn:
+            empty = conn.execute(select(model.ParkinglotInfo.id).limit(1)).first() is None
+        if empty:
+            sync_parking_info(bind, PARKING_INFO_SEED)
+
+
+def read_parking_info(seed: Optional[str] = None) -> list:
+    """
+    the lots of the local seed file if given, of the upstream feeds otherwise,
+    raises if none of the feeds could be read
+    """
+    if seed:
+        with open(seed, "rb") as f:
+            return process_parking_data(parse_feed(f.read()))
+
+    parkinglot_li = []
+    for target in PARKING_FEED_URLS:
+        data = fetch_parking(target)
+        if data is None:
+            print("Failed to fetch parkinglot info from: ", target)
+            continue
+        parkinglot_li.extend(process_parking_data(data))
+
+    # an empty catalog would drop every ingested row as an unknown lot
+    if not parkinglot_li:
+        raise RuntimeError("no parkinglot info from the upstream feeds")
+
+    return parkinglot_li
+
+
+def parking_info_models(parkinglot_li: list) -> List[model.ParkinglotInfo]:
+    return [
+        model.ParkinglotInfo(
+            **{
+                k: v
+                for k, v in p.dict().items()
+                if k in model.ParkinglotInfo.__table__.columns
+            }
+        )
+        for p in parkinglot_li
+    ]
+
+
 def insert_parking_info(target, connection, **kw):
+    # raises without lots, the table creation is then rolled back (postgres)
+    # and the startup retries
     # Create a new session.
     Session = sessionmaker(autocommit=False, autoflush=False, bind=connection)
     db = Session()
 
-    data = fetch_parking()
-    parkinglot_li = process_parking_data(data)
-    parkinglot_models = []
-    for p in parkinglot_li:
-        parkinglot_models.append(
-            model.ParkinglotInfo(
-                **{
-                    k: v
-                    for k, v in p.dict().items()
-                    if k in model.ParkinglotInfo.__table__.columns
-                }
-            )
-        )
-
-    db.add_all(parkinglot_models)
+    db.add_all(parking_info_models(read_parking_info(PARKING_INFO_SEED)))
     db.commit()
 
-    print("Fetch parkinglot info and save at: ", datetime.now())
+    # new lots are added, rebuild the spatial index and the /parking payload
+    parkinglot_index.load(db)
+    load_info_payload(db)
+
+    print(
+        "Fetch parkinglot info and save at: ",
+        datetime.now(),
+        f"(from: {PARKING_INFO_SEED or 'upstream'})",
+    )
+
+
+def sync_parking_info(bind, seed: Optional[str] = None) -> int:
+    """
+    add the lots of the upstream feeds (or of the seed file) missing from
+    parkinglotInfo, e.g. new since the seed snapshot, return the number of new
+    lots
+    """
+    parkinglot_li = read_parking_info(seed)
+
+    with sessionmaker(bind=bind).begin() as db:
+        known = set(db.scalars(select(model.ParkinglotInfo.name)))
+        new_li = [p for p in parkinglot_li if p.name not in known]
+        db.add_all(parking_info_models(new_li))
+
+    print("Sync parkinglot info at: ", datetime.now(), f"(new lots: {len(new_li)})")
+
+    return len(new_li)
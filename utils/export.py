@@ -0,0 +1,332 @@
+import os
+from datetime import date, datetime, time, timedelta
+from typing import Iterator, List, Optional
+
+from sqlalchemy import Float, cast, func, literal, select
+from sqlalchemy.engine import Connection, Engine
+
+from db import model
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+# where the columnar export is written, the export job only runs when set
+EXPORT_DIR = os.getenv("EXPORT_DIR")
+# "parquet" or "arrow" (Arrow IPC file), both zstd compressed
+EXPORT_FORMAT = os.getenv("EXPORT_FORMAT", "parquet").lower()
+# rows fetched from the server-side cursor and written per record batch
+EXPORT_CHUNK_ROWS = int(os.getenv("EXPORT_CHUNK_ROWS", "50000"))
+
+EXPORT_SUFFIXES = {"parquet": ".parquet", "arrow": ".arrow"}
+PARTITION_PREFIX = "day="
+
+space = model.ParkinglotSpace
+compact = model.ParkinglotSpaceCompact
+info = model.ParkinglotInfo
+
+INFO_COLUMNS = [
+    info.name,
+    info.address,
+    info.latitude,
+    info.longitude,
+    info.carChargeFeeWeek,
+    info.carChargeFeeHoli,
+    info.motoChargeFeeWeek,
+    info.motoChargeFeeHoli,
+]
+# a raw record is a bucket of one minute, its space is its mean, min and max
+EXPORT_COLUMNS = [
+    space.id,
+    space.parkinglot_id,
+    space.updateDate,
+    space.updateDay,
+    space.updateTime,
+    space.updateDatetime,
+    space.lastSeen,
+    space.seenCount,
+    literal(1).label("bucketMinutes"),
+    space.carAvail,
+    space.carTotal,
+    space.motoAvail,
+    space.motoTotal,
+    cast(space.carAvail, Float).label("carAvailMean"),
+    space.carAvail.label("carAvailMin"),
+    space.carAvail.label("carAvailMax"),
+    cast(space.motoAvail, Float).label("motoAvailMean"),
+    space.motoAvail.label("motoAvailMin"),
+    space.motoAvail.label("motoAvailMax"),
+    *INFO_COLUMNS,
+]
+# the compacted buckets, turned into rows like the raw records by compact_row
+COMPACT_COLUMNS = [
+    compact.parkinglot_id,
+    compact.updateDate,
+    compact.updateDay,
+    compact.bucket,
+    compact.bucketMinutes,
+    compact.count,
+    compact.carAvailSum,
+    compact.carAvailMin,
+    compact.carAvailMax,
+    compact.carTotal,
+    compact.motoAvailSum,
+    compact.motoAvailMin,
+    compact.motoAvailMax,
+    compact.motoTotal,
+    *INFO_COLUMNS,
+]
+
+
+def export_schema():
+    """
+    explicit arrow types, so every file of the dataset has the same schema
+    whatever the values of its first chunk
+    """
+    return pa.schema(
+        [
+            ("id", pa.int64()),
+            ("parkinglot_id", pa.int32()),
+            ("updateDate", pa.date32()),
+            ("updateDay", pa.int8()),
+            ("updateTime", pa.time64("us")),
+            ("updateDatetime", pa.timestamp("us")),
+            ("lastSeen", pa.timestamp("us")),
+            ("seenCount", pa.int32()),
+            ("bucketMinutes", pa.int16()),
+            ("carAvail", pa.int32()),
+            ("carTotal", pa.int32()),
+            ("motoAvail", pa.int32()),
+            ("motoTotal", pa.int32()),
+            ("carAvailMean", pa.float64()),
+            ("carAvailMin", pa.int32()),
+            ("carAvailMax", pa.int32()),
+            ("motoAvailMean", pa.float64()),
+            ("motoAvailMin", pa.int32()),
+            ("motoAvailMax", pa.int32()),
+            ("name", pa.string()),
+            ("address", pa.string()),
+            ("latitude", pa.float64()),
+            ("longitude", pa.float64()),
+            ("carChargeFeeWeek", pa.int32()),
+            ("carChargeFeeHoli", pa.int32()),
+            ("motoChargeFeeWeek", pa.int32()),
+            ("motoChargeFeeHoli", pa.int32()),
+        ]
+    )
+
+
+def partition_dir(directory: str, day: date) -> str:
+    return os.path.join(directory, f"{PARTITION_PREFIX}{day.isoformat()}")
+
+
+def exported_days(directory: str) -> List[date]:
+    """
+    the days already exported to `directory`, oldest first
+    """
+    if not os.path.isdir(directory):
+        return []
+
+    days = []
+    for name in os.listdir(directory):
+        if not name.startswith(PARTITION_PREFIX):
+            continue
+        try:
+            days.append(date.fromisoformat(name[len(PARTITION_PREFIX) :]))
+        except ValueError:
+            continue
+
+    return sorted(days)
+
+
+def exported_file(directory: str, day: date) -> Optional[str]:
+    """
+    the file of an exported day, None if the day is not exported
+    """
+    path = partition_dir(directory, day)
+    if not os.path.isdir(path):
+        return None
+    for name in sorted(os.listdir(path)):
+        if name.endswith(tuple(EXPORT_SUFFIXES.values())):
+            return os.path.join(path, name)
+
+    return None
+
+
+def compact_row(row) -> tuple:
+    """
+    a compacted bucket as an export row: the bucket start as time, the number
+    of reports as seenCount, the exact mean and the min / max of the space in
+    their columns and the mean rounded to the nearest integer as space (what
+    the readers of carAvail / motoAvail alone get)
+    """
+    (
+        parkinglot_id,
+        day,
+        weekday,
+        bucket,
+        minutes,
+        count,
+        car_sum,
+        car_min,
+        car_max,
+        car_total,
+        moto_sum,
+        moto_min,
+        moto_max,
+        moto_total,
+        *lot,
+    ) = row
+    start = time(bucket // 60, bucket % 60)
+
+    return (
+        None,
+        parkinglot_id,
+        day,
+        weekday,
+        start,
+        datetime.combine(day, start),
+        None,
+        count,
+        minutes,
+        round(car_sum / count),
+        car_total,
+        round(moto_sum / count),
+        moto_total,
+        car_sum / count,
+        car_min,
+        car_max,
+        moto_sum / count,
+        moto_min,
+        moto_max,
+        *lot,
+    )
+
+
+def day_rows(conn: Connection, day: date, chunk_rows: int) -> Iterator[list]:
+    """
+    the rows of `day`, `chunk_rows` at a time: the raw records, then the
+    compacted buckets of a day older than the compaction window
+    """
+    raw = (
+        select(*EXPORT_COLUMNS)
+        .join(info, info.id == space.parkinglot_id)
+        .where(space.updateDate == day)
+        .order_by(space.parkinglot_id, space.updateTime)
+    )
+    buckets = (
+        select(*COMPACT_COLUMNS)
+        .join(info, info.id == compact.parkinglot_id)
+        .where(compact.updateDate == day)
+        .order_by(compact.parkinglot_id, compact.bucket)
+    )
+
+    conn = conn.execution_options(yield_per=chunk_rows)
+    yield from conn.execute(raw).partitions()
+    for chunk in conn.execute(buckets).partitions():
+        yield [compact_row(r) for r in chunk]
+
+
+def export_day(
+    bind: Engine,
+    day: date,
+    directory: str,
+    fmt: str = EXPORT_FORMAT,
+    chunk_rows: int = EXPORT_CHUNK_ROWS,
+) -> int:
+    """
+    write the records of `day` (raw or compacted, see bucketMinutes) joined
+    with their lot into one file of the day's partition, streamed from the
+    database `chunk_rows` at a time. Return the number of rows, nothing is
+    written for a day without records
+    """
+    if pa is None:
+        raise RuntimeError("the export needs pyarrow installed")
+    if fmt not in EXPORT_SUFFIXES:
+        raise ValueError(f"unknown export format: {fmt}")
+
+    schema = export_schema()
+    path = os.path.join(partition_dir(directory, day), f"part-0{EXPORT_SUFFIXES[fmt]}")
+    # written under a temporary name, a day only shows up once it is complete
+    tmp_path = os.path.join(directory, f".{day.isoformat()}{EXPORT_SUFFIXES[fmt]}.tmp")
+    os.makedirs(directory, exist_ok=True)
+
+    rows, writer = 0, None
+    try:
+        with bind.connect() as conn:
+            for chunk in day_rows(conn, day, chunk_rows):
+                batch = pa.record_batch(
+                    [
+                        pa.array(column, type=field.type)
+                        for column, field in zip(zip(*chunk), schema)
+                    ],
+                    schema=schema,
+                )
+                if writer is None:
+                    if fmt == "parquet":
+                        writer = pq.ParquetWriter(tmp_path, schema, compression="zstd")
+                    else:
+                        writer = pa.ipc.new_file(
+                            tmp_path,
+                            schema,
+                            options=pa.ipc.IpcWriteOptions(compression="zstd"),
+                        )
+                writer.write_batch(batch)
+                rows += batch.num_rows
+    except BaseException:
+        if writer is not None:
+            writer.close()
+            os.remove(tmp_path)
+        raise
+
+    if writer is None:
+        return 0
+
+    writer.close()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    os.replace(tmp_path, path)
+
+    return rows
+
+
+def export_space_history(
+    bind: Engine,
+    directory: Optional[str] = EXPORT_DIR,
+    fmt: str = EXPORT_FORMAT,
+    since: Optional[date] = None,
+):
+    """
+    export every complete day (before today) after the last exported one, or
+    from `since` / the first day of the history on the first run
+    """
+    if not directory:
+        return
+
+    days = exported_days(directory)
+    if days:
+        first_day = days[-1] + timedelta(days=1)
+    elif since is not None:
+        first_day = since
+    else:
+        with bind.connect() as conn:
+            first_days = [
+                conn.execute(select(func.min(space.updateDate))).scalar(),
+                conn.execute(select(func.min(compact.updateDate))).scalar(),
+            ]
+        first_day = min((d for d in first_days if d is not None), default=None)
+
+    exported, n_days, day = 0, 0, first_day
+    while day is not None and day < date.today():
+        rows = export_day(bind, day, directory, fmt)
+        if rows:
+            exported += rows
+            n_days += 1
+        day += timedelta(days=1)
+
+    print(
+        "Export parkinglotSpace at: ",
+        datetime.now(),
+        f"(records: {exported}, days: {n_days}, to: {directory})",
+    )
@@ -5,35 +5,176 @@ if __name__ == "__main__":
     sys.path.append(os.path.join(os.path.dirname(__file__), os.path.pardir))
 
 
-import requests
+import os
+import json
+import time
+import random
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+import httpx
 
 from db import schema
+from utils.metrics import UPSTREAM_ERRORS, UPSTREAM_FETCHES
 
 
 # URL of the JSON data
 url_official = "https://hispark.hccg.gov.tw/OpenData/GetParkInfo?1111104155049"
 url = "https://ocam.live/c_hsinchu_city_parkinglots.json"
 
-
-def fetch_parking() -> schema.In_parking_lot_official_all:
-    try:
-        response = requests.get(url_official)
+# comma separated feeds fetched by the ingest job (one per city)
+PARKING_FEED_URLS = [
+    u.strip()
+    for u in os.getenv("PARKING_FEED_URLS", url_official).split(",")
+    if u.strip()
+]
+FETCH_TIMEOUT = float(os.getenv("FETCH_TIMEOUT", "10"))
+FETCH_RETRIES = int(os.getenv("FETCH_RETRIES", "3"))
+FETCH_BACKOFF = float(os.getenv("FETCH_BACKOFF", "0.5"))
+FETCH_MAX_BACKOFF = float(os.getenv("FETCH_MAX_BACKOFF", "8"))
+
+
+@dataclass
+class FeedState:
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    digest: Optional[str] = None
+
+
+# one keep-alive client for the whole process (httpx.Client is thread safe)
+client = httpx.Client(
+    timeout=httpx.Timeout(FETCH_TIMEOUT, connect=min(FETCH_TIMEOUT, 5.0)),
+    limits=httpx.Limits(max_keepalive_connections=8, keepalive_expiry=120),
+    follow_redirects=True,
+)
+
+feed_states: Dict[str, FeedState] = {}
+feed_states_lock = threading.Lock()
+
+
+def request_with_retry(target: str, headers: Dict[str, str]) -> httpx.Response:
+    """
+    GET with bounded exponential backoff on connection errors, 429 and 5xx
+    """
+    for attempt in range(FETCH_RETRIES + 1):
+        try:
+            response = client.get(target, headers=headers)
+            if response.status_code != 429 and response.status_code < 500:
+                return response
+            UPSTREAM_ERRORS.labels(str(response.status_code)).inc()
+            if attempt == FETCH_RETRIES:
+                response.raise_for_status()
+        except httpx.TransportError:
+            UPSTREAM_ERRORS.labels("transport").inc()
+            if attempt == FETCH_RETRIES:
+                raise
+
+        delay = min(FETCH_BACKOFF * 2**attempt, FETCH_MAX_BACKOFF)
+        time.sleep(delay * (0.5 + random.random() / 2))
+
+
+def fetch_raw(target: str = url_official, conditional: bool = True) -> Optional[bytes]:
+    """
+    fetch the raw payload of a feed. With `conditional`, return None when the
+    feed didn't change since the last conditional fetch (304 or same content
+    hash), so the caller can skip parsing and DB work.
+    """
+    if not conditional:
+        response = request_with_retry(target, {})
         response.raise_for_status()
+        return response.content
+
+    with feed_states_lock:
+        state = feed_states.setdefault(target, FeedState())
+
+    headers = {}
+    if state.etag:
+        headers["If-None-Match"] = state.etag
+    if state.last_modified:
+        headers["If-Modified-Since"] = state.last_modified
+
+    response = request_with_retry(target, headers)
+    if response.status_code == 304:
+        UPSTREAM_FETCHES.labels("not_modified").inc()
+        return None
+    response.raise_for_status()
+
+    content = response.content
+    digest = hashlib.sha256(content).hexdigest()
+    unchanged = state.digest == digest
+
+    state.etag = response.headers.get("ETag")
+    state.last_modified = response.headers.get("Last-Modified")
+    state.digest = digest
+
+    if unchanged:
+        UPSTREAM_FETCHES.labels("unchanged").inc()
+        return None
+
+    UPSTREAM_FETCHES.labels("changed").inc()
+    return content
+
+
+def forget_feed(target: str):
+    """
+    drop the conditional state of a feed, e.g. when its payload failed to be
+    stored, so the next fetch processes it again
+    """
+    with feed_states_lock:
+        feed_states.pop(target, None)
 
-        data = response.json()
 
-        # Print or process the data as needed
+def fetch_raw_all(
+    targets: Optional[List[str]] = None, conditional: bool = True
+) -> Dict[str, Optional[bytes]]:
+    """
+    fetch several feeds concurrently, a failing feed maps to None
+    """
+    targets = targets or PARKING_FEED_URLS
 
-        parkinglot_info = schema.In_parking_lot_official_all.model_validate({"data": data})
+    def fetch_one(target: str) -> Optional[bytes]:
+        try:
+            return fetch_raw(target, conditional)
+        except httpx.HTTPStatusError as http_err:
+            UPSTREAM_FETCHES.labels("error").inc()
+            print(f"HTTP error occurred: {http_err}")
+        except httpx.HTTPError as err:
+            UPSTREAM_FETCHES.labels("error").inc()
+            print(f"Other error occurred: {err}")
+
+    if len(targets) == 1:
+        return {targets[0]: fetch_one(targets[0])}
+
+    with ThreadPoolExecutor(max_workers=min(len(targets), 8)) as executor:
+        return dict(zip(targets, executor.map(fetch_one, targets)))
+
+
+def parse_feed(raw: bytes) -> schema.In_parking_lot_official_all:
+    data = json.loads(raw)
+
+    return schema.In_parking_lot_official_all.model_validate({"data": data})
+
+
+def fetch_parking(
+    target: str = url_official, conditional: bool = False
+) -> Optional[schema.In_parking_lot_official_all]:
+    try:
+        raw = fetch_raw(target, conditional)
+        if raw is None:
+            return None
+
+        parkinglot_info = parse_feed(raw)
 
         return parkinglot_info
 
-    except requests.exceptions.HTTPError as http_err:
+    except httpx.HTTPStatusError as http_err:
         print(f"HTTP error occurred: {http_err}")
-    except requests.exceptions.RequestException as err:
+    except httpx.HTTPError as err:
         print(f"Other error occurred: {err}")
 
 
 if __name__ == "__main__":
     fetch_parking()
-
@@ -0,0 +1,150 @@
+import os
+import math
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Iterable, List, Optional, Tuple
+
+from utils.metrics import GEO_CACHE_EVICTIONS, GEO_CACHE_REQUESTS
+from utils.nearby import METRE_PER_DEG_LAT, haversine, parkinglot_index
+from utils.snapshot import latest_space
+
+# results kept by the nearby / predict endpoints, 0 turns the cache off
+GEO_CACHE_SIZE = int(os.getenv("GEO_CACHE_SIZE", "4096"))
+# upper bound of the age of a result, it is dropped by the next ingest cycle anyway
+GEO_CACHE_TTL = float(os.getenv("GEO_CACHE_TTL", "60"))
+# size in degrees of the cells the coordinates are snapped to (~55 m)
+GEO_CACHE_CELL = float(os.getenv("GEO_CACHE_CELL", "0.0005"))
+# minutes of the predictions are rounded to this step
+GEO_CACHE_MINUTES = int(os.getenv("GEO_CACHE_MINUTES", "5"))
+
+
+class GeoCellCache:
+    """
+    LRU cache of the candidate lots of the location queries, per grid cell
+    (and step of minutes): the lots within the radius plus `reach` of the
+    centre of the cell, so they include the lots within the radius of any site
+    of the cell. The requests around the same venue share them, each one
+    filters and sorts them by its exact distance (see closest).
+
+    a result is only served for the snapshot version it was computed from and
+    for `ttl` seconds at most. Only used from the event loop, a miss is computed
+    there without yielding (it takes a millisecond, handing it to the thread
+    pool costs more), so concurrent misses of the same key are computed once:
+    the first one stores the result before the others run.
+    """
+
+    def __init__(
+        self,
+        max_size: int = GEO_CACHE_SIZE,
+        ttl: float = GEO_CACHE_TTL,
+        cell_size: float = GEO_CACHE_CELL,
+        minutes_step: int = GEO_CACHE_MINUTES,
+    ):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.cell_size = cell_size
+        self.minutes_step = minutes_step
+        # {key: (snapshot version, expires at, result)}, least recent first
+        self._entries: "OrderedDict[Hashable, Tuple[int, float, Any]]" = OrderedDict()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def cell(self, lat: float, lng: float) -> Tuple[float, float]:
+        """
+        the centre of the cell of a site, the site itself if the cache is off
+        """
+        if not self.enabled:
+            return lat, lng
+
+        size = self.cell_size
+        return round(round(lat / size) * size, 7), round(round(lng / size) * size, 7)
+
+    @property
+    def reach(self) -> float:
+        """
+        metres from the centre of a cell to its corners (at most), plus one
+        """
+        if not self.enabled:
+            return 0.0
+
+        return self.cell_size * METRE_PER_DEG_LAT * math.sqrt(2) / 2 + 1
+
+    def minutes(self, minutes: int) -> int:
+        if not self.enabled or self.minutes_step <= 1:
+            return minutes
+
+        step = self.minutes_step
+        return (minutes + step // 2) // step * step
+
+    def info(self) -> dict:
+        return {"size": len(self._entries), "max_size": self.max_size, "ttl": self.ttl}
+
+    def get(self, key: Tuple, compute: Callable[[], Any]) -> Any:
+        """
+        the cached result of `key` (its first item names the endpoint), or the
+        one of `compute`, stored for the current snapshot version
+        """
+        if not self.enabled:
+            return compute()
+
+        endpoint = key[0]
+        version = latest_space.version
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[0] == version and entry[1] > time.monotonic():
+                self._entries.move_to_end(key)
+                GEO_CACHE_REQUESTS.labels(endpoint, "hit").inc()
+                return entry[2]
+            del self._entries[key]
+            GEO_CACHE_EVICTIONS.labels("expired").inc()
+
+        GEO_CACHE_REQUESTS.labels(endpoint, "miss").inc()
+        result = compute()
+        self._entries[key] = (version, time.monotonic() + self.ttl, result)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            GEO_CACHE_EVICTIONS.labels("lru").inc()
+
+        return result
+
+
+def located(values: Iterable) -> List[Tuple[float, float, Any]]:
+    """
+    (lat, lng, value) of values of a lot (having parkinglot_id)
+    """
+    result = []
+    for v in values:
+        point = parkinglot_index.location(v.parkinglot_id)
+        if point is not None:
+            result.append((*point, v))
+
+    return result
+
+
+def closest(
+    candidates: List[Tuple[float, float, Any]],
+    lat: float,
+    lng: float,
+    radius: float,
+    k: Optional[int] = None,
+) -> List[Any]:
+    """
+    the values of the candidates within `radius` metres of the site, nearest
+    first (only the k nearest if given)
+    """
+    hits = []
+    for c_lat, c_lng, v in candidates:
+        dist = haversine(c_lat, c_lng, lat, lng)
+        if dist <= radius:
+            hits.append((dist, v))
+    hits.sort(key=lambda x: x[0])
+
+    return [v for _, v in hits[:k]]
+
+
+geo_cache = GeoCellCache()
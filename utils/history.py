@@ -0,0 +1,346 @@
+import os
+import csv
+import io
+from datetime import date, datetime, time, timedelta
+from typing import AsyncIterator, Iterator, Optional
+
+import orjson
+from sqlalchemy import DateTime, Time, and_, cast, func, literal, null, or_, select
+from sqlalchemy.sql import Select
+
+from db import model, schema
+from utils.aggregate import (
+    extended_reports,
+    max_extended_minutes,
+    minute_of_day,
+    spread_space,
+)
+from utils.db_connect import async_read_session
+
+# rows fetched from the server-side cursor at a time, and items per chunk sent
+HISTORY_YIELD_PER = int(os.getenv("HISTORY_YIELD_PER", "1000"))
+
+HISTORY_FIELDS = list(schema.ParkinglotSpaceHistory.model_fields)
+
+
+def history_sources(
+    parking_id: int, start: date, end: date, resolution: int = 1, max_span: int = 0
+):
+    """
+    the raw records and the compacted buckets of a lot between two dates
+    (inclusive) as one relation of weighted buckets. Resampled (`resolution`
+    above 1) the reports of a raw record extended by the change-only ingest (at
+    most `max_span` minutes long) are counted in the buckets they were made in
+    """
+    space = model.ParkinglotSpace
+    compact = model.ParkinglotSpaceCompact
+    where = (
+        space.parkinglot_id == parking_id,
+        space.updateDate >= start,
+        space.updateDate <= end,
+    )
+
+    if resolution == 1:
+        # a record extended by the change-only ingest stands for seenCount reports
+        weight = func.coalesce(space.seenCount, 1)
+        raw = select(
+            space.updateDate.label("updateDate"),
+            minute_of_day(space.updateTime).label("bucket"),
+            literal(1).label("bucketMinutes"),
+            space.updateTime.label("updateTime"),
+            space.lastSeen.label("lastSeen"),
+            weight.label("count"),
+            (space.carAvail * weight).label("carAvailSum"),
+            space.carAvail.label("carAvailMin"),
+            space.carAvail.label("carAvailMax"),
+            space.carTotal.label("carTotal"),
+            (space.motoAvail * weight).label("motoAvailSum"),
+            space.motoAvail.label("motoAvailMin"),
+            space.motoAvail.label("motoAvailMax"),
+            space.motoTotal.label("motoTotal"),
+        ).where(*where)
+    else:
+        r = spread_space(resolution, max_span, *where).subquery("raw")
+        raw = select(
+            r.c.updateDate,
+            r.c.bucket,
+            literal(1).label("bucketMinutes"),
+            cast(null(), Time).label("updateTime"),
+            cast(null(), DateTime).label("lastSeen"),
+            r.c["count"],
+            (r.c.carAvail * r.c["count"]).label("carAvailSum"),
+            r.c.carAvail.label("carAvailMin"),
+            r.c.carAvail.label("carAvailMax"),
+            r.c.carTotal,
+            (r.c.motoAvail * r.c["count"]).label("motoAvailSum"),
+            r.c.motoAvail.label("motoAvailMin"),
+            r.c.motoAvail.label("motoAvailMax"),
+            r.c.motoTotal,
+        )
+    compacted = select(
+        compact.updateDate,
+        compact.bucket,
+        compact.bucketMinutes,
+        cast(null(), Time),
+        cast(null(), DateTime),
+        compact.count,
+        compact.carAvailSum,
+        compact.carAvailMin,
+        compact.carAvailMax,
+        compact.carTotal,
+        compact.motoAvailSum,
+        compact.motoAvailMin,
+        compact.motoAvailMax,
+        compact.motoTotal,
+    ).where(
+        compact.parkinglot_id == parking_id,
+        compact.updateDate >= start,
+        compact.updateDate <= end,
+    )
+
+    return raw.union_all(compacted).subquery("history")
+
+
+def history_query(
+    parking_id: int,
+    start: date,
+    end: date,
+    resolution: int = 1,
+    after: Optional[datetime] = None,
+    limit: Optional[int] = None,
+    max_span: int = 0,
+) -> Select:
+    """
+    the history rows in (updateDate, bucket) order, resampled to `resolution`
+    minutes in SQL unless it is 1, starting after the `after` keyset cursor.
+    `max_span` is the longest extended record in the range, see
+    history_max_span
+    """
+    src = history_sources(parking_id, start, end, resolution, max_span)
+
+    if resolution == 1:
+        stmt = select(src)
+        if after is not None:
+            # an extended record started before the cursor can still reach past it
+            stmt = stmt.where(
+                or_(
+                    _after(src.c.updateDate, src.c.bucket, after),
+                    src.c.lastSeen > after,
+                )
+            )
+    else:
+        bucket = src.c.bucket // resolution * resolution
+        grouped = (
+            select(
+                src.c.updateDate,
+                bucket.label("bucket"),
+                func.max(src.c.bucketMinutes).label("bucketMinutes"),
+                func.sum(src.c["count"]).label("count"),
+                func.sum(src.c.carAvailSum).label("carAvailSum"),
+                func.min(src.c.carAvailMin).label("carAvailMin"),
+                func.max(src.c.carAvailMax).label("carAvailMax"),
+                func.max(src.c.carTotal).label("carTotal"),
+                func.sum(src.c.motoAvailSum).label("motoAvailSum"),
+                func.min(src.c.motoAvailMin).label("motoAvailMin"),
+                func.max(src.c.motoAvailMax).label("motoAvailMax"),
+                func.max(src.c.motoTotal).label("motoTotal"),
+            )
+            .group_by(src.c.updateDate, bucket)
+            .subquery("resampled")
+        )
+        stmt = select(grouped)
+        if after is not None:
+            stmt = stmt.where(_after(grouped.c.updateDate, grouped.c.bucket, after))
+        src = grouped
+
+    stmt = stmt.order_by(src.c.updateDate, src.c.bucket)
+    if limit is not None:
+        stmt = stmt.limit(limit)
+
+    return stmt
+
+
+def history_max_span(parking_id: int, start: date, end: date):
+    """
+    select the minutes the longest record of a lot between two dates was
+    extended over by the change-only ingest
+    """
+    space = model.ParkinglotSpace
+
+    return max_extended_minutes(
+        space.parkinglot_id == parking_id,
+        space.updateDate >= start,
+        space.updateDate <= end,
+    )
+
+
+def _after(day_column, bucket_column, after: datetime):
+    minute = after.hour * 60 + after.minute
+    return or_(
+        day_column > after.date(),
+        and_(day_column == after.date(), bucket_column > minute),
+    )
+
+
+def history_items(
+    row, parking_id: int, resolution: int, after: Optional[datetime]
+) -> Iterator[dict]:
+    """
+    the items of one history row, a raw record extended by the change-only
+    ingest is one item per report up to lastSeen (see extended_reports)
+    """
+    if resolution == 1 and row.updateTime is not None:
+        start = datetime.combine(row.updateDate, row.updateTime)
+        for t in extended_reports(start, row.lastSeen, row.count):
+            if after is None or t > after:
+                yield {
+                    "updateDate": t.date().isoformat(),
+                    "updateDay": t.weekday(),
+                    "updateTime": t.time().isoformat(),
+                    "bucketMinutes": 1,
+                    "count": 1,
+                    "carAvail": row.carAvailMin,
+                    "carAvailMin": row.carAvailMin,
+                    "carAvailMax": row.carAvailMax,
+                    "carTotal": row.carTotal,
+                    "motoAvail": row.motoAvailMin,
+                    "motoAvailMin": row.motoAvailMin,
+                    "motoAvailMax": row.motoAvailMax,
+                    "motoTotal": row.motoTotal,
+                    "parkinglot_id": parking_id,
+                }
+        return
+
+    yield {
+        "updateDate": row.updateDate.isoformat(),
+        "updateDay": row.updateDate.weekday(),
+        "updateTime": time(row.bucket // 60, row.bucket % 60).isoformat(),
+        # compacted buckets coarser than the resolution are kept as they are
+        "bucketMinutes": max(resolution, row.bucketMinutes),
+        "count": row.count,
+        "carAvail": row.carAvailSum / row.count,
+        "carAvailMin": row.carAvailMin,
+        "carAvailMax": row.carAvailMax,
+        "carTotal": row.carTotal,
+        "motoAvail": row.motoAvailSum / row.count,
+        "motoAvailMin": row.motoAvailMin,
+        "motoAvailMax": row.motoAvailMax,
+        "motoTotal": row.motoTotal,
+        "parkinglot_id": parking_id,
+    }
+
+
+def encode_ndjson(items) -> bytes:
+    return b"".join(orjson.dumps(x) + b"\n" for x in items)
+
+
+def encode_csv(items) -> bytes:
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, HISTORY_FIELDS, lineterminator="\n")
+    writer.writerows(items)
+    return buffer.getvalue().encode()
+
+
+async def stream_history(
+    parking_id: int,
+    start: date,
+    end: date,
+    resolution: int = 1,
+    fmt: schema.HistoryFormat = schema.HistoryFormat.ndjson,
+    after: Optional[datetime] = None,
+    limit: Optional[int] = None,
+) -> AsyncIterator[bytes]:
+    """
+    the history of a lot encoded in chunks of HISTORY_YIELD_PER items, read
+    through a server-side cursor so memory stays flat whatever the range
+
+    for the next page pass the date and time of the last item as `after`
+    """
+    if fmt == schema.HistoryFormat.csv:
+        encode = encode_csv
+        yield ",".join(HISTORY_FIELDS).encode() + b"\n"
+    elif fmt == schema.HistoryFormat.json:
+        encode = lambda items: b",".join(orjson.dumps(x) for x in items)
+        yield b"["
+    else:
+        encode = encode_ndjson
+
+    sent = 0
+    # the session lives as long as the response, not the request handler
+    async with async_read_session() as db:
+        max_span = 0
+        if resolution > 1:
+            max_span = await db.scalar(history_max_span(parking_id, start, end))
+        stmt = history_query(parking_id, start, end, resolution, after, limit, max_span)
+        stmt = stmt.execution_options(yield_per=HISTORY_YIELD_PER)
+
+        result = await db.stream(stmt)
+        async for rows in result.partitions():
+            items = [
+                x
+                for row in rows
+                for x in history_items(row, parking_id, resolution, after)
+            ]
+            if limit is not None:
+                items = items[: limit - sent]
+            if not items:
+                continue
+            chunk = encode(items)
+            if fmt == schema.HistoryFormat.json and sent:
+                chunk = b"," + chunk
+            sent += len(items)
+            yield chunk
+            if limit is not None and sent >= limit:
+                break
+        await result.close()
+
+    if fmt == schema.HistoryFormat.json:
+        yield b"]"
+
+
+def expand_space(row) -> Iterator[schema.ParkinglotSpace]:
+    """
+    the spaces of one raw record, a record extended by the change-only ingest
+    is one space per report up to lastSeen (the last one is present_space)
+    """
+    space = schema.ParkinglotSpace.model_validate(row, from_attributes=True)
+    yield space
+    if row.lastSeen is None:
+        return
+
+    start = datetime.combine(row.updateDate, row.updateTime)
+    for t in extended_reports(start, row.lastSeen, row.seenCount)[1:]:
+        yield space.model_copy(
+            update=dict(
+                updateDate=t.date(),
+                updateDay=t.weekday(),
+                updateTime=t.time(),
+                updateDatetime=t,
+            )
+        )
+
+
+async def stream_spaces(parking_id: int) -> AsyncIterator[bytes]:
+    """
+    every space of a lot as a JSON array, one per reported minute, read through
+    a server-side cursor
+    """
+    space = model.ParkinglotSpace
+    stmt = (
+        select(space)
+        .where(space.parkinglot_id == parking_id)
+        .execution_options(yield_per=HISTORY_YIELD_PER)
+    )
+
+    yield b"["
+    first = True
+    async with async_read_session() as db:
+        result = await db.stream_scalars(stmt)
+        async for rows in result.partitions():
+            chunk = b",".join(
+                x.model_dump_json().encode() for row in rows for x in expand_space(row)
+            )
+            yield chunk if first else b"," + chunk
+            first = False
+        await result.close()
+    yield b"]"
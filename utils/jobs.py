@@ -0,0 +1,69 @@
+from typing import Callable, Optional
+
+from apscheduler.schedulers.base import BaseScheduler
+from apscheduler.triggers.interval import IntervalTrigger
+
+from utils.scheduler import drain_spool, get_parking_data
+from utils.db_connect import engine, read_engine, sync_parking_info
+from utils.maintenance import maintain_space_table
+from utils.compaction import compact_space_history
+from utils.export import EXPORT_DIR, export_space_history
+from utils.leader import INGEST_MODE, lead_or_follow
+from utils.spool import INGEST_SPOOL_DRAIN_SECONDS, ingest_spool
+
+
+def add_ingest_jobs(
+    scheduler: BaseScheduler,
+    mode: str = INGEST_MODE,
+    follow: Optional[Callable] = None,
+    on_catalog: Optional[Callable] = None,
+    follow_catalog: Optional[Callable] = None,
+):
+    """
+    the jobs of the ingest (fetch, spool drain, catalog sync, maintenance,
+    compaction, export), the same for the API workers and the standalone
+    ingester. The processes not ingesting (per `mode`) run `follow` instead of
+    the fetch and `follow_catalog` instead of the catalog sync, `on_catalog`
+    runs after the sync changed the catalog
+    """
+
+    def sync_catalog():
+        if sync_parking_info(engine) and on_catalog is not None:
+            on_catalog()
+
+    # only the process holding the ingest lease fetches the data
+    scheduler.add_job(
+        lead_or_follow(get_parking_data, follow, mode=mode),
+        IntervalTrigger(minutes=1),
+        id="data",
+    )
+    if ingest_spool is not None:
+        # the fetch only appends to the spool, the database is written from here
+        scheduler.add_job(
+            drain_spool, IntervalTrigger(seconds=INGEST_SPOOL_DRAIN_SECONDS), id="spool"
+        )
+    # lots opened since the catalog was filled (or missing from the seed snapshot)
+    scheduler.add_job(
+        lead_or_follow(sync_catalog, follow_catalog, mode=mode),
+        IntervalTrigger(days=1),
+        id="catalog",
+    )
+    scheduler.add_job(
+        lead_or_follow(maintain_space_table, mode=mode),
+        IntervalTrigger(days=1),
+        args=[engine],
+        id="maintenance",
+    )
+    scheduler.add_job(
+        lead_or_follow(compact_space_history, mode=mode),
+        IntervalTrigger(days=1),
+        args=[engine],
+        id="compaction",
+    )
+    if EXPORT_DIR:
+        scheduler.add_job(
+            lead_or_follow(export_space_history, mode=mode),
+            IntervalTrigger(days=1),
+            args=[read_engine],
+            id="export",
+        )
@@ -0,0 +1,110 @@
+import os
+import functools
+import threading
+from datetime import datetime
+from typing import Callable, Optional
+
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+
+from utils.db_connect import engine
+
+# embedded: this process always ingests (single process deployment)
+# leader: the processes compete for the ingest lease, the holder ingests
+# off: never ingest here (API only workers next to a standalone ingest.py)
+INGEST_MODE = os.getenv("INGEST_MODE", "leader").lower()
+
+INGEST_LOCK_KEY = 7205423102
+
+
+class IngestLease:
+    """
+    exclusive lease on the ingest among all the processes sharing the database,
+    held as a Postgres session-level advisory lock on a dedicated connection.
+    It goes away with the holder (or its connection), the next process trying
+    then takes over. On other databases there is a single process, which
+    always holds it.
+    """
+
+    def __init__(self, bind, key: int):
+        self.bind = bind
+        self.key = key
+        self._lock = threading.Lock()
+        self._conn = None
+
+    @property
+    def held(self) -> bool:
+        return self._conn is not None or self.bind.dialect.name != "postgresql"
+
+    def acquire(self) -> bool:
+        """
+        keep the lease or try to take it, without waiting
+        """
+        if self.bind.dialect.name != "postgresql":
+            return True
+
+        with self._lock:
+            if self._conn is not None:
+                try:
+                    self._conn.execute(text("SELECT 1"))
+                    self._conn.commit()
+                    return True
+                except DBAPIError:
+                    # the lock went away with the connection
+                    self._conn.invalidate()
+                    self._conn = None
+                    print("Lost ingest lease at: ", datetime.now())
+
+            conn = self.bind.connect()
+            try:
+                acquired = conn.execute(
+                    text("SELECT pg_try_advisory_lock(:key)"), {"key": self.key}
+                ).scalar()
+                conn.commit()
+            except DBAPIError:
+                conn.invalidate()
+                raise
+
+            if not acquired:
+                conn.close()
+                return False
+
+            self._conn = conn
+            print("Acquired ingest lease at: ", datetime.now())
+
+            return True
+
+    def release(self):
+        with self._lock:
+            if self._conn is None:
+                return
+            try:
+                self._conn.execute(
+                    text("SELECT pg_advisory_unlock(:key)"), {"key": self.key}
+                )
+                self._conn.commit()
+                self._conn.close()
+            except DBAPIError:
+                self._conn.invalidate()
+            self._conn = None
+
+
+ingest_lease = IngestLease(engine, INGEST_LOCK_KEY)
+
+
+def lead_or_follow(
+    job: Callable, follow: Optional[Callable] = None, mode: str = INGEST_MODE
+) -> Callable:
+    """
+    wrap a scheduled job: run `job` if this process ingests (per `mode`),
+    otherwise run `follow`
+    """
+
+    @functools.wraps(job)
+    def run(*args, **kwargs):
+        if mode == "embedded" or (mode == "leader" and ingest_lease.acquire()):
+            return job(*args, **kwargs)
+        if follow is not None:
+            return follow()
+
+    return run
@@ -0,0 +1,193 @@
+import os
+from datetime import date, datetime
+from typing import Iterable, List, Optional, Set
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+from db import model
+
+# number of months of parkinglotSpace partitions to keep (unset: keep forever)
+SPACE_RETENTION_MONTHS = os.getenv("SPACE_RETENTION_MONTHS")
+# what to do with expired partitions: "detach" keeps them as standalone tables
+SPACE_RETENTION_ACTION = os.getenv("SPACE_RETENTION_ACTION", "detach").lower()
+SPACE_PARTITION_AHEAD = int(os.getenv("SPACE_PARTITION_AHEAD", "2"))
+
+SPACE_TABLE = model.ParkinglotSpace.__tablename__
+
+# partitions known to exist, so the ingest only issues the DDL for new months
+known_partitions: Set[str] = set()
+
+
+def add_months(d: date, months: int) -> date:
+    month = d.year * 12 + d.month - 1 + months
+    return date(month // 12, month % 12 + 1, 1)
+
+
+def partition_name(month_start: date) -> str:
+    return f"{SPACE_TABLE}_p{month_start:%Y%m}"
+
+
+def is_partitioned(bind: Engine) -> bool:
+    return model.DB_PARTITION_SPACE and bind.dialect.name == "postgresql"
+
+
+def create_space_partitions(bind: Engine, days: Iterable[date]) -> List[str]:
+    """
+    create the monthly partitions of the months of some days, those already
+    known to exist are skipped without touching the database
+    """
+    if not is_partitioned(bind):
+        return []
+
+    missing = sorted(
+        m
+        for m in {d.replace(day=1) for d in days}
+        if partition_name(m) not in known_partitions
+    )
+    if not missing:
+        return []
+
+    created = []
+    with bind.begin() as conn:
+        for start in missing:
+            end = add_months(start, 1)
+            name = partition_name(start)
+            conn.execute(
+                text(
+                    f'CREATE TABLE IF NOT EXISTS "{name}" PARTITION OF "{SPACE_TABLE}" '
+                    f"FOR VALUES FROM ('{start}') TO ('{end}')"
+                )
+            )
+            created.append(name)
+    known_partitions.update(created)
+
+    return created
+
+
+def ensure_space_partitions(
+    bind: Engine,
+    today: Optional[date] = None,
+    months_ahead: int = SPACE_PARTITION_AHEAD,
+) -> List[str]:
+    """
+    create the monthly partitions from this month up to `months_ahead` months
+    """
+    this_month = (today or date.today()).replace(day=1)
+
+    return create_space_partitions(
+        bind, [add_months(this_month, i) for i in range(months_ahead + 1)]
+    )
+
+
+def list_space_partitions(bind: Engine) -> List[str]:
+    with bind.connect() as conn:
+        return list(
+            conn.execute(
+                text(
+                    "SELECT c.relname FROM pg_inherits i "
+                    "JOIN pg_class c ON c.oid = i.inhrelid "
+                    "JOIN pg_class p ON p.oid = i.inhparent "
+                    "WHERE p.relname = :table ORDER BY c.relname"
+                ),
+                {"table": SPACE_TABLE},
+            ).scalars()
+        )
+
+
+def expire_space_partitions(
+    bind: Engine,
+    retention_months: Optional[int] = None,
+    action: str = SPACE_RETENTION_ACTION,
+    today: Optional[date] = None,
+) -> List[str]:
+    """
+    detach (or drop) the partitions older than the retention window, detached
+    partitions stay in the database as plain tables for archiving
+    """
+    if retention_months is None and SPACE_RETENTION_MONTHS:
+        retention_months = int(SPACE_RETENTION_MONTHS)
+    if not is_partitioned(bind) or retention_months is None:
+        return []
+
+    oldest = add_months((today or date.today()).replace(day=1), -retention_months)
+    expired = [
+        name
+        for name in list_space_partitions(bind)
+        if name < partition_name(oldest)
+    ]
+
+    with bind.begin() as conn:
+        for name in expired:
+            conn.execute(
+                text(f'ALTER TABLE "{SPACE_TABLE}" DETACH PARTITION "{name}"')
+            )
+            if action == "drop":
+                conn.execute(text(f'DROP TABLE "{name}"'))
+    known_partitions.difference_update(expired)
+
+    return expired
+
+
+def backfill_update_datetime(bind: Engine, batch_size: int = 10000) -> int:
+    """
+    fill updateDatetime of the rows stored before the column existed, in
+    small batches to avoid long locks
+    """
+    total = 0
+    while True:
+        with bind.begin() as conn:
+            updated = conn.execute(
+                text(
+                    f'UPDATE "{SPACE_TABLE}" SET "updateDatetime" = '
+                    f'"updateDate" + "updateTime" WHERE id IN ('
+                    f'SELECT id FROM "{SPACE_TABLE}" WHERE "updateDatetime" IS NULL '
+                    "LIMIT :batch_size)"
+                ),
+                {"batch_size": batch_size},
+            ).rowcount
+        total += updated
+        if updated < batch_size:
+            return total
+
+
+def dedup_space_rows(bind: Engine, batch_size: int = 10000) -> int:
+    """
+    delete the rows repeating the (lot, date, time) of another one (written by
+    concurrent workers before the unique index existed), keeping the lowest id,
+    `batch_size` repeated keys per transaction
+    """
+    total = 0
+    while True:
+        with bind.begin() as conn:
+            deleted = conn.execute(
+                text(
+                    f'DELETE FROM "{SPACE_TABLE}" WHERE id IN ('
+                    f'SELECT s.id FROM "{SPACE_TABLE}" s JOIN ('
+                    'SELECT parkinglot_id, "updateDate", "updateTime", min(id) AS keep '
+                    f'FROM "{SPACE_TABLE}" WHERE parkinglot_id IS NOT NULL '
+                    'GROUP BY parkinglot_id, "updateDate", "updateTime" '
+                    "HAVING count(*) > 1 LIMIT :batch_size) d "
+                    "ON s.parkinglot_id = d.parkinglot_id "
+                    'AND s."updateDate" = d."updateDate" '
+                    'AND s."updateTime" = d."updateTime" AND s.id > d.keep)'
+                ),
+                {"batch_size": batch_size},
+            ).rowcount
+        total += deleted
+        if not deleted:
+            return total
+
+
+def maintain_space_table(bind: Engine):
+    created = ensure_space_partitions(bind)
+    expired = expire_space_partitions(bind)
+    backfilled = 0
+    if bind.dialect.name == "postgresql":
+        backfilled = backfill_update_datetime(bind)
+
+    print(
+        "Maintain parkinglotSpace at: ",
+        datetime.now(),
+        f"(partitions: {len(created)}, expired: {expired}, backfilled: {backfilled})",
+    )
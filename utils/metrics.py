@@ -0,0 +1,183 @@
+import os
+import time
+from contextvars import ContextVar
+from typing import List, Optional
+
+from apscheduler.events import EVENT_JOB_ERROR, EVENT_JOB_MISSED, EVENT_JOB_SUBMITTED
+from fastapi import Response
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# routes whose duration is not a latency (long lived streams, the scrape)
+UNTIMED_ROUTES = {"/parking/stream", "/metrics", "/health"}
+
+REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds",
+    "duration of the HTTP requests",
+    ["method", "route", "status"],
+)
+REQUEST_DB_QUERIES = Histogram(
+    "http_request_db_queries",
+    "database queries run per HTTP request",
+    ["route"],
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50),
+)
+DB_QUERY_DURATION = Histogram(
+    "db_query_duration_seconds",
+    "duration of the database queries",
+    ["engine"],
+)
+INGEST_STAGE_DURATION = Histogram(
+    "ingest_stage_duration_seconds",
+    "duration of each stage of the ingest cycle",
+    ["stage"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+INGEST_ROWS = Counter(
+    "ingest_rows_total", "parkinglotSpace rows of the ingest cycles", ["result"]
+)
+INGEST_SPOOL_PENDING = Gauge(
+    "ingest_spool_pending_bytes",
+    "bytes of the ingest spool not written to the database yet",
+)
+INGEST_SPOOL_DEAD_LETTERS = Counter(
+    "ingest_spool_dead_letters_total",
+    "spooled feeds moved aside because they could not be written",
+)
+UPSTREAM_FETCHES = Counter(
+    "upstream_fetches_total", "fetches of the upstream feeds", ["result"]
+)
+UPSTREAM_ERRORS = Counter(
+    "upstream_errors_total",
+    "failed attempts to fetch the upstream feeds, retried or not",
+    ["reason"],
+)
+DB_REPLICA_LAG = Gauge(
+    "db_replica_lag_seconds",
+    "how far the read replica is behind the primary, as of the last check",
+)
+GEO_CACHE_REQUESTS = Counter(
+    "geo_cache_requests_total",
+    "lookups of the geo-cell result cache",
+    ["endpoint", "result"],
+)
+GEO_CACHE_EVICTIONS = Counter(
+    "geo_cache_evictions_total",
+    "results dropped from the geo-cell result cache",
+    ["reason"],
+)
+SCHEDULER_LAG = Gauge(
+    "scheduler_job_lag_seconds",
+    "delay between the scheduled and the actual start of the last job run",
+    ["job"],
+)
+SCHEDULER_JOB_ERRORS = Counter(
+    "scheduler_job_errors_total",
+    "scheduled job runs that failed or were missed",
+    ["job", "event"],
+)
+
+# queries run so far by the current request, None outside of requests
+request_queries: ContextVar[Optional[List[int]]] = ContextVar(
+    "request_queries", default=None
+)
+
+
+def instrument_engine(engine: Engine, name: str):
+    """
+    time every query of `engine` (the sync_engine of an async one) and count
+    it to the current request
+    """
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, many):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, many):
+        start = conn.info["query_start"].pop()
+        DB_QUERY_DURATION.labels(name).observe(time.perf_counter() - start)
+
+        queries = request_queries.get()
+        if queries is not None:
+            queries[0] += 1
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(context):
+        conn = context.connection
+        if conn is not None and conn.info.get("query_start"):
+            conn.info["query_start"].pop()
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording the duration and the number of database queries
+    of each request, labelled with the route template
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = [500]
+
+        async def send_wrapper(message: Message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        queries = [0]
+        token = request_queries.set(queries)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            request_queries.reset(token)
+            route = scope.get("route")
+            path = route.path if route is not None else "unmatched"
+            if path not in UNTIMED_ROUTES:
+                REQUEST_DURATION.labels(scope["method"], path, status[0]).observe(
+                    time.perf_counter() - start
+                )
+                REQUEST_DB_QUERIES.labels(path).observe(queries[0])
+
+
+def observe_scheduler(event):
+    """
+    APScheduler listener for submitted, failed and missed job runs
+    """
+    if event.code == EVENT_JOB_SUBMITTED:
+        scheduled = event.scheduled_run_times[-1]
+        lag = time.time() - scheduled.timestamp()
+        SCHEDULER_LAG.labels(event.job_id).set(max(lag, 0.0))
+    elif event.code == EVENT_JOB_ERROR:
+        SCHEDULER_JOB_ERRORS.labels(event.job_id, "error").inc()
+    elif event.code == EVENT_JOB_MISSED:
+        SCHEDULER_JOB_ERRORS.labels(event.job_id, "missed").inc()
+
+
+def metrics_response() -> Response:
+    """
+    the metrics in the Prometheus text format, merged over all the workers when
+    PROMETHEUS_MULTIPROC_DIR is set
+    """
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
+
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
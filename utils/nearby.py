@@ -1,12 +1,166 @@
 import math
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
 
+from sqlalchemy.orm import Session
 
-def cal_dist(
+from db import model
+
+EARTH_RADIUS = 6371008.8  # mean earth radius in metres
+METRE_PER_DEG_LAT = EARTH_RADIUS * math.pi / 180
+
+
+def haversine(
     source_lat: float, source_lng: float, target_lat: float, target_lng: float
 ) -> float:
     """
-    calculate the distance between the target spot and the parking lot (source)
+    calculate the great-circle distance (in metres) between two spots
     """
-    return math.sqrt(
-        math.pow(source_lat - target_lat, 2) + math.pow(source_lng - target_lng, 2)
+    phi_1, phi_2 = math.radians(source_lat), math.radians(target_lat)
+    d_phi = phi_2 - phi_1
+    d_lambda = math.radians(target_lng - source_lng)
+
+    a = (
+        math.sin(d_phi / 2) ** 2
+        + math.cos(phi_1) * math.cos(phi_2) * math.sin(d_lambda / 2) ** 2
     )
+
+    return 2 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(a)))
+
+
+class ParkinglotIndex:
+    """
+    in-process grid index over the parking lot coordinates. Each lot is put in
+    a bucket of `cell_size` degrees, so radius and k-nearest queries only look
+    at the buckets around the target instead of every lot.
+    """
+
+    def __init__(self, cell_size: float = 0.01, max_ring: int = 32):
+        self.cell_size = cell_size
+        self.max_ring = max_ring
+        self._lock = threading.Lock()
+        # (grid, points), replaced as a whole on rebuild
+        self._state: Tuple[Dict[Tuple[int, int], list], Dict[int, Tuple[float, float]]] = (
+            {},
+            {},
+        )
+
+    def __len__(self) -> int:
+        return len(self._state[1])
+
+    def _cell(self, lat: float, lng: float) -> Tuple[int, int]:
+        return math.floor(lat / self.cell_size), math.floor(lng / self.cell_size)
+
+    def build(self, parkinglots: Iterable) -> None:
+        """
+        rebuild the index from objects having id, latitude and longitude
+        """
+        grid: Dict[Tuple[int, int], list] = {}
+        points: Dict[int, Tuple[float, float]] = {}
+        for p in parkinglots:
+            points[p.id] = (p.latitude, p.longitude)
+            grid.setdefault(self._cell(p.latitude, p.longitude), []).append(
+                (p.id, p.latitude, p.longitude)
+            )
+
+        with self._lock:
+            self._state = (grid, points)
+
+    def load(self, db: Session) -> None:
+        self.build(
+            db.query(
+                model.ParkinglotInfo.id,
+                model.ParkinglotInfo.latitude,
+                model.ParkinglotInfo.longitude,
+            ).all()
+        )
+
+    def location(self, parkinglot_id: int) -> Optional[Tuple[float, float]]:
+        return self._state[1].get(parkinglot_id)
+
+    def within(
+        self, lat: float, lng: float, radius: float
+    ) -> List[Tuple[int, float]]:
+        """
+        get (id, distance) of the lots within `radius` metres, nearest first
+        """
+        grid, _ = self._state
+
+        d_lat = radius / METRE_PER_DEG_LAT
+        d_lng = d_lat / max(math.cos(math.radians(min(abs(lat) + d_lat, 89.9))), 1e-6)
+        min_i, min_j = self._cell(lat - d_lat, lng - d_lng)
+        max_i, max_j = self._cell(lat + d_lat, lng + d_lng)
+
+        result = []
+        for i in range(min_i, max_i + 1):
+            for j in range(min_j, max_j + 1):
+                for p_id, p_lat, p_lng in grid.get((i, j), ()):
+                    dist = haversine(p_lat, p_lng, lat, lng)
+                    if dist <= radius:
+                        result.append((p_id, dist))
+
+        result.sort(key=lambda item: item[1])
+
+        return result
+
+    def nearest(
+        self, lat: float, lng: float, k: int, radius: Optional[float] = None
+    ) -> List[Tuple[int, float]]:
+        """
+        get (id, distance) of the k nearest lots (optionally within `radius`
+        metres), nearest first. Searches rings of buckets around the target
+        until no unvisited bucket can hold a closer lot.
+        """
+        grid, points = self._state
+        if k <= 0 or not points:
+            return []
+
+        center_i, center_j = self._cell(lat, lng)
+
+        candidates: List[Tuple[int, float]] = []
+        visited, ring = 0, 0
+        while visited < len(points):
+            if ring > self.max_ring:
+                # target is far away from every lot, scanning them all is cheaper
+                candidates = sorted(
+                    (
+                        (p_id, haversine(p_lat, p_lng, lat, lng))
+                        for p_id, (p_lat, p_lng) in points.items()
+                    ),
+                    key=lambda item: item[1],
+                )
+                break
+
+            for i in range(center_i - ring, center_i + ring + 1):
+                for j in range(center_j - ring, center_j + ring + 1):
+                    if max(abs(i - center_i), abs(j - center_j)) != ring:
+                        continue
+                    for p_id, p_lat, p_lng in grid.get((i, j), ()):
+                        visited += 1
+                        candidates.append((p_id, haversine(p_lat, p_lng, lat, lng)))
+
+            # the closest lot outside the visited square is at least this far
+            lat_lo = (center_i - ring) * self.cell_size
+            lat_hi = (center_i + ring + 1) * self.cell_size
+            cos_lat = math.cos(math.radians(min(max(abs(lat_lo), abs(lat_hi)), 90.0)))
+            gap = min(
+                lat - lat_lo,
+                lat_hi - lat,
+                (lng - (center_j - ring) * self.cell_size) * cos_lat,
+                ((center_j + ring + 1) * self.cell_size - lng) * cos_lat,
+            ) * METRE_PER_DEG_LAT
+
+            candidates.sort(key=lambda item: item[1])
+            if radius is not None and gap >= radius:
+                break
+            if len(candidates) >= k and candidates[k - 1][1] <= gap:
+                break
+            ring += 1
+
+        if radius is not None:
+            candidates = [x for x in candidates if x[1] <= radius]
+
+        return candidates[:k]
+
+
+parkinglot_index = ParkinglotIndex()
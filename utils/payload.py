@@ -0,0 +1,113 @@
+import gzip
+import hashlib
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from fastapi import Request, Response
+from pydantic import TypeAdapter
+from sqlalchemy.orm import Session
+
+from db import model, schema
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# bodies smaller than this are not worth compressing
+MIN_COMPRESS_SIZE = 1024
+
+space_list_adapter = TypeAdapter(List[schema.ParkinglotSpace])
+info_list_adapter = TypeAdapter(List[schema.ParkinglotInfo])
+
+
+class PreparedPayload:
+    """
+    response body serialized (and compressed) once per data version and served
+    as is, with an ETag from its content so that clients polling with
+    If-None-Match get a 304 until the data changes
+    """
+
+    def __init__(self, cache_control: str):
+        self.cache_control = cache_control
+        self._lock = threading.Lock()
+        # (version, etag, {content-encoding: body}), replaced as a whole
+        self._state: Tuple[object, Optional[str], Dict[str, bytes]] = (
+            None,
+            None,
+            {},
+        )
+
+    @property
+    def version(self):
+        return self._state[0]
+
+    @property
+    def ready(self) -> bool:
+        return self._state[1] is not None
+
+    def set(self, body: bytes, version=None):
+        etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+        bodies = {"identity": body}
+        if len(body) >= MIN_COMPRESS_SIZE:
+            bodies["gzip"] = gzip.compress(body, compresslevel=6)
+            if brotli is not None:
+                bodies["br"] = brotli.compress(body)
+
+        with self._lock:
+            self._state = (version, etag, bodies)
+
+    def response(
+        self, request: Request, headers: Optional[Dict[str, str]] = None
+    ) -> Response:
+        _, etag, bodies = self._state
+        if etag is None:
+            # not loaded yet (startup warmup), like /health
+            return Response(status_code=503, headers={"Retry-After": "5"})
+
+        headers = {
+            **(headers or {}),
+            "ETag": etag,
+            "Cache-Control": self.cache_control,
+            "Vary": "Accept-Encoding",
+        }
+
+        if_none_match = request.headers.get("if-none-match", "")
+        if etag in (x.strip().removeprefix("W/") for x in if_none_match.split(",")):
+            return Response(status_code=304, headers=headers)
+
+        accept_encoding = request.headers.get("accept-encoding", "")
+        for encoding in ("br", "gzip"):
+            if encoding in bodies and encoding in accept_encoding:
+                headers["Content-Encoding"] = encoding
+                return Response(
+                    bodies[encoding], media_type="application/json", headers=headers
+                )
+
+        return Response(
+            bodies["identity"], media_type="application/json", headers=headers
+        )
+
+
+# latest space of all lots, rendered once per snapshot version
+space_payload = PreparedPayload("public, max-age=5")
+# parking lot info, only changes when lots are added
+info_payload = PreparedPayload("public, max-age=3600")
+
+
+def render_spaces(spaces: Iterable[schema.ParkinglotSpace]) -> bytes:
+    return space_list_adapter.dump_json(
+        sorted(spaces, key=lambda x: x.parkinglot_id)
+    )
+
+
+def load_info_payload(db: Session):
+    parkinglots = db.query(model.ParkinglotInfo).order_by(model.ParkinglotInfo.id)
+    info_payload.set(
+        info_list_adapter.dump_json(
+            [
+                schema.ParkinglotInfo.model_validate(x, from_attributes=True)
+                for x in parkinglots
+            ]
+        )
+    )
@@ -1,11 +1,249 @@
-import random
+import os
+import warnings
+import threading
+from collections import deque
+from datetime import date, datetime, timedelta
+from typing import Deque, Dict, Iterable, List, Optional, Sequence, Tuple, Union
 
-def pred_spaces_change(parkinglot_id: int, minutes: int) -> int:
-    # query data n_minutes ahead
+import numpy as np
+from sqlalchemy import func
+from sqlalchemy.orm import Session
 
-    pred_change = random.randint(0, minutes // 5)
+from utils.db_connect import read_session
+from utils.aggregate import minute_of_day
+from db import model, schema
 
-    # make the prediction based on the query data
-    # predict 5 minutes later
+BUCKET_MINUTES = 5
+N_BUCKETS = 24 * 60 // BUCKET_MINUTES
+# days of raw history the seasonal profile is fitted on in backtests
+PREDICT_HISTORY_DAYS = int(os.getenv("PREDICT_HISTORY_DAYS", "28"))
+# minutes of observations the recent trend is fitted on
+TREND_WINDOW = 30
+# minutes over which the recent trend fades out
+TREND_DECAY = 15.0
 
-    return pred_change
+
+class SpaceForecaster:
+    """
+    forecast the available space of the parking lots from a per-lot seasonal
+    profile (mean availability by weekday and 5-minute bucket, fitted from the
+    parkinglotSpace history) plus the recent trend of each lot. Everything is
+    held in NumPy arrays, so predicting for many lots is a few array lookups.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (lot id -> row in the arrays,
+        #  (n_lots, 7, N_BUCKETS, 2) mean car / moto availability,
+        #  (n_lots, 2) recent change per minute of car / moto availability),
+        # replaced as a whole
+        self._state: Tuple[Dict[int, int], np.ndarray, np.ndarray] = (
+            {},
+            np.full((0, 7, N_BUCKETS, 2), np.nan, dtype=np.float32),
+            np.zeros((0, 2), dtype=np.float32),
+        )
+        self.fitted_at: Optional[datetime] = None
+        self._recent: Dict[int, Deque[Tuple[float, int, int]]] = {}
+
+    @property
+    def lot_index(self) -> Dict[int, int]:
+        return self._state[0]
+
+    def fit(self, db: Session, until: Optional[date] = None):
+        """
+        (re)build the seasonal profile from the 5-minute aggregates, or from the
+        raw history of the PREDICT_HISTORY_DAYS days before `until` if given
+        """
+        if until is None:
+            agg = model.ParkinglotSpaceAgg
+            rows = (
+                db.query(
+                    agg.parkinglot_id,
+                    agg.updateDay,
+                    agg.bucket // BUCKET_MINUTES,
+                    agg.carAvailSum * 1.0 / agg.count,
+                    agg.motoAvailSum * 1.0 / agg.count,
+                )
+                .filter(agg.bucketMinutes == BUCKET_MINUTES)
+                .all()
+            )
+        else:
+            since = until - timedelta(days=PREDICT_HISTORY_DAYS)
+            bucket = (
+                minute_of_day(model.ParkinglotSpace.updateTime) // BUCKET_MINUTES
+            )
+            rows = (
+                db.query(
+                    model.ParkinglotSpace.parkinglot_id,
+                    model.ParkinglotSpace.updateDay,
+                    bucket,
+                    func.avg(model.ParkinglotSpace.carAvail),
+                    func.avg(model.ParkinglotSpace.motoAvail),
+                )
+                .filter(
+                    model.ParkinglotSpace.updateDate >= since,
+                    model.ParkinglotSpace.updateDate < until,
+                )
+                .group_by(
+                    model.ParkinglotSpace.parkinglot_id,
+                    model.ParkinglotSpace.updateDay,
+                    bucket,
+                )
+                .all()
+            )
+        lot_ids = [x for (x,) in db.query(model.ParkinglotInfo.id).all()]
+
+        self.build(lot_ids, rows)
+
+    def build(self, lot_ids: Iterable[int], rows: Iterable[Tuple]):
+        """
+        build the arrays from (lot id, weekday, bucket, car mean, moto mean) rows
+        """
+        lot_index = {lot_id: i for i, lot_id in enumerate(sorted(set(lot_ids)))}
+        profile = np.full(
+            (len(lot_index), 7, N_BUCKETS, 2), np.nan, dtype=np.float32
+        )
+        for lot_id, day, bucket, car_mean, moto_mean in rows:
+            i = lot_index.get(lot_id)
+            if i is not None:
+                profile[i, day, bucket] = (car_mean, moto_mean)
+
+        # buckets never seen on this weekday fall back to the other weekdays
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", category=RuntimeWarning)
+            all_days = np.nanmean(profile, axis=1, keepdims=True)
+        profile = np.where(np.isnan(profile), all_days, profile)
+
+        with self._lock:
+            old_index, _, old_trend = self._state
+            trend = np.zeros((len(lot_index), 2), dtype=np.float32)
+            for lot_id, i in lot_index.items():
+                if lot_id in old_index:
+                    trend[i] = old_trend[old_index[lot_id]]
+
+            self._state = (lot_index, profile, trend)
+            self.fitted_at = datetime.now()
+
+    def observe(self, spaces: Iterable):
+        """
+        record newly ingested spaces and refresh the recent trend of their lots
+        """
+        with self._lock:
+            lot_index, profile, trend = self._state
+            trend = trend.copy()
+            for s in spaces:
+                minutes = (
+                    datetime.combine(s.updateDate, s.updateTime).timestamp() / 60
+                )
+                recent = self._recent.setdefault(s.parkinglot_id, deque())
+                if recent and recent[-1][0] >= minutes:
+                    continue
+                recent.append((minutes, s.carAvail, s.motoAvail))
+                while minutes - recent[0][0] > TREND_WINDOW:
+                    recent.popleft()
+
+                i = lot_index.get(s.parkinglot_id)
+                if i is None or len(recent) < 3:
+                    continue
+                # least-squares slope over the window
+                points = np.array(recent, dtype=np.float64)
+                t = points[:, 0] - points[:, 0].mean()
+                trend[i] = t @ (points[:, 1:] - points[:, 1:].mean(axis=0)) / (t @ t)
+
+            self._state = (lot_index, profile, trend)
+
+    def predict(
+        self,
+        lot_ids: Sequence[int],
+        avail: np.ndarray,
+        total: np.ndarray,
+        day: np.ndarray,
+        minute_of_day: np.ndarray,
+        minutes,
+    ) -> np.ndarray:
+        """
+        vectorized forecast for many lots at once
+
+        avail / total: (n, 2) current car / moto availability and capacity
+        day / minute_of_day: (n,) weekday and minute of the observation
+        minutes: scalar or (n,) minutes ahead
+        return (n, 2) predicted car / moto availability
+        """
+        lot_index, profile, trend = self._state
+
+        avail = np.asarray(avail, dtype=np.float32).reshape(-1, 2)
+        total = np.asarray(total, dtype=np.float32).reshape(-1, 2)
+        minutes = np.broadcast_to(
+            np.asarray(minutes, dtype=np.int64), avail.shape[:1]
+        )
+        day = np.asarray(day, dtype=np.int64)
+        minute_of_day = np.asarray(minute_of_day, dtype=np.int64)
+
+        rows = np.array([lot_index.get(i, -1) for i in lot_ids], dtype=np.int64)
+        known = rows >= 0
+        rows = np.where(known, rows, 0)
+
+        target = minute_of_day + minutes
+        bucket_now = minute_of_day // BUCKET_MINUTES
+        bucket_target = (target % 1440) // BUCKET_MINUTES
+        day_target = (day + target // 1440) % 7
+        # same span as the trend window, single buckets are too noisy
+        span = TREND_WINDOW // BUCKET_MINUTES
+        bucket_prev = (bucket_now - span) % N_BUCKETS
+        day_prev = (day - (bucket_now < span)) % 7
+
+        pred = avail.copy()
+        if len(profile):
+            now = profile[rows, day, bucket_now]
+            seasonal = profile[rows, day_target, bucket_target] - now
+            # the part of the recent trend the seasonal profile doesn't explain
+            profile_slope = (now - profile[rows, day_prev, bucket_prev]) / (
+                span * BUCKET_MINUTES
+            )
+            residual = trend[rows] - np.nan_to_num(profile_slope)
+            damped = TREND_DECAY * (1 - np.exp(-minutes / TREND_DECAY))
+
+            change = np.nan_to_num(seasonal) + residual * damped[:, None]
+            pred = np.where(known[:, None], avail + change, avail)
+
+        return np.clip(np.rint(pred), 0, np.maximum(total, avail)).astype(np.int64)
+
+    def predict_spaces(
+        self,
+        spaces: List[schema.ParkinglotSpace],
+        minutes: Union[int, Sequence[int]],
+    ) -> List[schema.ParkinglotSpacePredict]:
+        """
+        predicted space of each given lot `minutes` (one for all or one per
+        lot) later, in one batch
+        """
+        if not spaces:
+            return []
+
+        pred = self.predict(
+            [s.parkinglot_id for s in spaces],
+            [(s.carAvail, s.motoAvail) for s in spaces],
+            [(s.carTotal, s.motoTotal) for s in spaces],
+            [s.updateDay for s in spaces],
+            [s.updateTime.hour * 60 + s.updateTime.minute for s in spaces],
+            minutes,
+        )
+
+        return [
+            schema.ParkinglotSpacePredict(
+                **s.model_dump(), carAvailPred=car_pred, motoAvailPred=moto_pred
+            )
+            for s, (car_pred, moto_pred) in zip(spaces, pred.tolist())
+        ]
+
+
+forecaster = SpaceForecaster()
+
+
+def fit_forecaster():
+    with read_session() as db:
+        forecaster.fit(db)
+
+    print(
+        "Fit forecaster at: ", datetime.now(), f"({len(forecaster.lot_index)} lots)"
+    )
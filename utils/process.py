@@ -5,8 +5,11 @@ if __name__ == "__main__":
     sys.path.append(os.path.join(os.path.dirname(__file__), os.path.pardir))
 
 import re
-from datetime import datetime
-from typing import Tuple, List
+from datetime import datetime, date, time
+from functools import lru_cache
+from typing import Tuple, List, NamedTuple
+
+import orjson
 
 from utils.fetch_parking import fetch_parking
 from db import schema
@@ -92,6 +95,7 @@ def transform_each_data(source: schema.In_parking_lot_official) -> schema.Out_pa
         updateDate=date,
         updateDay=day,
         updateTime=time,
+        updateDatetime=datetime.combine(date, time),
     )
 
     return out
@@ -108,6 +112,80 @@ def process_parking_data(
     return out_li
 
 
+class ParkingRow(NamedTuple):
+    """
+    compact counterpart of schema.Out_parking_lot produced by the fast path
+    """
+
+    name: str
+    address: str
+    startHour: int
+    endHour: int
+    carAvail: int
+    carTotal: int
+    motoAvail: int
+    motoTotal: int
+    carChargeFeeWeek: int
+    carChargeFeeHoli: int
+    motoChargeFeeWeek: int
+    motoChargeFeeHoli: int
+    latitude: float
+    longitude: float
+    updateDate: date
+    updateDay: int
+    updateTime: time
+    updateDatetime: datetime
+
+
+# the price and business hour texts barely change between cycles (the update
+# times do, every minute)
+cached_match_price = lru_cache(maxsize=4096)(match_price)
+cached_business_hours = lru_cache(maxsize=4096)(extract_business_hours)
+
+
+def parse_parking_rows(raw: bytes) -> List[ParkingRow]:
+    """
+    fast path of fetch_parking + process_parking_data: decode the raw feed once
+    and build the rows directly, skipping the per-record pydantic models
+    """
+    out_li = []
+    for d in orjson.loads(raw):
+        carTotal, motoTotal = d["TOTALQUANTITY"], d["TOTALQUANTITYMOT"]
+        carChargeFeeWeek, motoChargeFeeWeek = cached_match_price(
+            d["WEEKDAYS"], carTotal, motoTotal
+        )
+        carChargeFeeHoli, motoChargeFeeHoli = cached_match_price(
+            d["HOLIDAY"], carTotal, motoTotal
+        )
+        startHour, endHour = cached_business_hours(d["BUSINESSHOURS"])
+        update_date, update_day, update_time = extract_date_time_day(d["UPDATETIME"])
+
+        out_li.append(
+            ParkingRow(
+                d["PARKINGNAME"],
+                d["ADDRESS"],
+                startHour,
+                endHour,
+                d["FREEQUANTITY"],
+                carTotal,
+                d["FREEQUANTITYMOT"],
+                motoTotal,
+                int(carChargeFeeWeek),
+                int(carChargeFeeHoli),
+                int(motoChargeFeeWeek),
+                int(motoChargeFeeHoli),
+                float(d["LATITUDE"]),
+                float(d["LONGITUDE"]),
+                update_date,
+                update_day,
+                update_time,
+                datetime.combine(update_date, update_time),
+            )
+        )
+
+    return out_li
+
+
 if __name__ == "__main__":
     # test things out
     data = fetch_parking()
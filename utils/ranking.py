@@ -0,0 +1,220 @@
+import threading
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from db import model, schema
+from utils.nearby import EARTH_RADIUS
+from utils.prediction import forecaster
+from utils.snapshot import latest_space
+
+# predicted free spaces from which more of them do not make a lot better
+AVAIL_SATURATION = 20.0
+VEHICLES = {schema.Vehicle.car: 0, schema.Vehicle.moto: 1}
+# business hours and fee days are local to the lots (as the feed and the
+# scheduler), whatever the timezone of the host
+LOT_TIMEZONE = ZoneInfo("Asia/Taipei")
+
+
+def is_open(start_hour: np.ndarray, end_hour: np.ndarray, hour: int) -> np.ndarray:
+    """
+    open-at-`hour` mask of the business hours, overnight hours (22~6) wrap
+    and equal start and end hours mean open all day
+    """
+    same_day = (start_hour <= hour) & (hour < end_hour)
+    overnight = (start_hour > end_hour) & ((hour >= start_hour) | (hour < end_hour))
+
+    return same_day | overnight | (start_hour == end_hour)
+
+
+class LotRanker:
+    """
+    ranks the lots around a site by distance, predicted space and price,
+    dropping the lots closed at arrival. The lots are held as a feature matrix
+    (coordinates, fees, business hours) plus the latest space of each lot,
+    rebuilt from the snapshot once per ingest cycle, so a ranking is one NumPy
+    pass over every lot.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (ids (n,), names (n,), lat / lng in radians (n, 2), lat / lng in
+        #  degrees (n, 2), car / moto fees on weekdays / holidays (n, 2, 2),
+        #  start / end hour (n, 2)), replaced as a whole on load
+        self._info: Tuple[np.ndarray, ...] = (
+            np.zeros(0, dtype=np.int64),
+            np.zeros(0, dtype=object),
+            np.zeros((0, 2)),
+            np.zeros((0, 2)),
+            np.zeros((0, 2, 2)),
+            np.zeros((0, 2), dtype=np.int64),
+        )
+        # (snapshot version, the info it was built for, has a space (n,),
+        #  car / moto avail and total (n, 2), weekday (n,) and minute of day
+        #  (n,) of the space)
+        self._space: Tuple = (None, None)
+
+    def __len__(self) -> int:
+        return len(self._info[0])
+
+    def build(self, parkinglots) -> None:
+        """
+        rebuild the feature matrix from objects shaped like ParkinglotInfo
+        """
+        parkinglots = list(parkinglots)
+        coords = np.array(
+            [(p.latitude, p.longitude) for p in parkinglots], dtype=np.float64
+        ).reshape(-1, 2)
+        info = (
+            np.array([p.id for p in parkinglots], dtype=np.int64),
+            np.array([p.name for p in parkinglots], dtype=object),
+            np.radians(coords),
+            coords,
+            np.array(
+                [
+                    (
+                        (p.carChargeFeeWeek, p.carChargeFeeHoli),
+                        (p.motoChargeFeeWeek, p.motoChargeFeeHoli),
+                    )
+                    for p in parkinglots
+                ],
+                dtype=np.float64,
+            ).reshape(-1, 2, 2),
+            np.array(
+                [(p.startHour, p.endHour) for p in parkinglots], dtype=np.int64
+            ).reshape(-1, 2),
+        )
+
+        with self._lock:
+            self._info = info
+
+    def load(self, db: Session) -> None:
+        self.build(db.query(model.ParkinglotInfo).all())
+
+    def _spaces(self) -> Tuple:
+        """
+        the space columns matching the current snapshot version, rebuilt on the
+        first ranking after each ingest cycle
+        """
+        version, info = latest_space.version, self._info
+        state = self._space
+        if state[0] == version and state[1] is info:
+            return state
+
+        with self._lock:
+            ids = info[0]
+            spaces = latest_space.get_many(ids.tolist())
+            n = len(ids)
+            has_space = np.zeros(n, dtype=bool)
+            avail = np.zeros((n, 2), dtype=np.int64)
+            total = np.zeros((n, 2), dtype=np.int64)
+            day = np.zeros(n, dtype=np.int64)
+            minute = np.zeros(n, dtype=np.int64)
+            for row, i in enumerate(ids.tolist()):
+                s = spaces.get(i)
+                if s is None:
+                    continue
+                has_space[row] = True
+                avail[row] = (s.carAvail, s.motoAvail)
+                total[row] = (s.carTotal, s.motoTotal)
+                day[row] = s.updateDay
+                minute[row] = s.updateTime.hour * 60 + s.updateTime.minute
+
+            self._space = (version, info, has_space, avail, total, day, minute)
+
+            return self._space
+
+    def rank(
+        self,
+        lat: float,
+        lng: float,
+        minutes: int = 0,
+        radius: float = 1000,
+        k: int = 10,
+        vehicle: schema.Vehicle = schema.Vehicle.car,
+        w_distance: float = 1.0,
+        w_avail: float = 1.0,
+        w_price: float = 0.5,
+        now: Optional[datetime] = None,
+    ) -> List[schema.ParkinglotRank]:
+        """
+        the k best lots within `radius` metres open at arrival (`minutes`
+        later, `now` in the local time of the lots), best first. The score is
+        the weighted sum of the distance over the radius, the lack of predicted
+        space (saturating at AVAIL_SATURATION) and the fee over the highest one
+        of the candidates, lower is better
+        """
+        _, info, has_space, avail, total, day, minute = self._spaces()
+        ids, names, rad, coords, fees, hours = info
+        v = VEHICLES[vehicle]
+        arrival = (now or datetime.now(LOT_TIMEZONE)) + timedelta(minutes=minutes)
+
+        # haversine distance to every lot
+        phi, lam = np.radians(lat), np.radians(lng)
+        a = (
+            np.sin((rad[:, 0] - phi) / 2) ** 2
+            + np.cos(phi) * np.cos(rad[:, 0]) * np.sin((rad[:, 1] - lam) / 2) ** 2
+        )
+        dist = 2 * EARTH_RADIUS * np.arcsin(np.minimum(1.0, np.sqrt(a)))
+
+        candidates = np.flatnonzero(
+            (dist <= radius)
+            & has_space
+            & (total[:, v] > 0)
+            & is_open(hours[:, 0], hours[:, 1], arrival.hour)
+        )
+        if not len(candidates):
+            return []
+
+        pred = forecaster.predict(
+            ids[candidates].tolist(),
+            avail[candidates],
+            total[candidates],
+            day[candidates],
+            minute[candidates],
+            minutes,
+        )[:, v]
+        fee = fees[candidates, v, int(arrival.weekday() >= 5)]
+        max_fee = fee.max()
+
+        score = (
+            w_distance * dist[candidates] / radius
+            + w_avail * (1 - np.minimum(pred, AVAIL_SATURATION) / AVAIL_SATURATION)
+            + w_price * (fee / max_fee if max_fee > 0 else 0.0)
+        )
+        best = np.argsort(score, kind="stable")[:k]
+        top = candidates[best]
+
+        return [
+            schema.ParkinglotRank(
+                parkinglot_id=i,
+                name=name,
+                score=sc,
+                distance=d,
+                avail=av,
+                availPred=p,
+                total=t,
+                fee=f,
+                startHour=start,
+                endHour=end,
+                latitude=la,
+                longitude=ln,
+            )
+            for i, name, sc, d, av, p, t, f, (start, end), (la, ln) in zip(
+                ids[top].tolist(),
+                names[top].tolist(),
+                score[best].tolist(),
+                dist[top].tolist(),
+                avail[top, v].tolist(),
+                pred[best].tolist(),
+                total[top, v].tolist(),
+                fee[best].tolist(),
+                hours[top].tolist(),
+                coords[top].tolist(),
+            )
+        ]
+
+lot_ranker = LotRanker()
@@ -0,0 +1,173 @@
+import io
+import csv
+import time
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime
+from typing import List
+
+from sqlalchemy import column, delete, exists, select, table, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.engine import Connection, Engine
+
+from db import model
+from utils.aggregate import rebuild_space_aggregates, upsert_space_aggregates
+from utils.archive import archived_files, parse_archived
+from utils.maintenance import create_space_partitions
+
+# parkinglotSpace columns a replayed row fills, in the order of the tuples
+REPLAY_COLUMNS = [
+    "parkinglot_id",
+    "carAvail",
+    "carTotal",
+    "motoAvail",
+    "motoTotal",
+    "updateDate",
+    "updateDay",
+    "updateTime",
+    "updateDatetime",
+]
+SPACE_KEYS = ["parkinglot_id", "updateDate", "updateTime"]
+# what upsert_space_aggregates needs of the inserted rows
+RETURNED_COLUMNS = ["parkinglot_id", "updateDay", "updateTime", "carAvail", "motoAvail"]
+# archived payloads handed to a worker at a time
+PARSE_CHUNK = 16
+
+
+def load_space_rows(conn: Connection, rows: List[tuple]) -> List:
+    """
+    bulk load parkinglotSpace rows, skipping the ones already stored, return
+    the new ones (RETURNED_COLUMNS). On postgres the rows are COPYed into a
+    staging table and moved over with one INSERT .. SELECT
+    """
+    if not rows:
+        return []
+
+    space = model.ParkinglotSpace.__table__
+    returned = [space.c[c] for c in RETURNED_COLUMNS]
+    if conn.dialect.name != "postgresql":
+        stmt = (
+            insert(space)
+            .on_conflict_do_nothing(index_elements=SPACE_KEYS)
+            .returning(*returned)
+        )
+        return conn.execute(stmt, [dict(zip(REPLAY_COLUMNS, r)) for r in rows]).all()
+
+    columns = ", ".join(f'"{c}"' for c in REPLAY_COLUMNS)
+    conn.execute(
+        text(
+            f"CREATE TEMP TABLE replay_space ON COMMIT DROP AS "
+            f'SELECT {columns} FROM "parkinglotSpace" WITH NO DATA'
+        )
+    )
+
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(
+        tuple("" if v is None else v for v in r) for r in rows
+    )
+    buffer.seek(0)
+    cursor = conn.connection.cursor()
+    cursor.copy_expert(
+        f"COPY replay_space ({columns}) FROM STDIN WITH (FORMAT csv)", buffer
+    )
+
+    staging = table("replay_space", *(column(c) for c in REPLAY_COLUMNS))
+    stmt = (
+        insert(space)
+        .from_select(REPLAY_COLUMNS, select(staging))
+        .on_conflict_do_nothing(index_elements=SPACE_KEYS)
+        .returning(*returned)
+    )
+
+    return conn.execute(stmt).all()
+
+
+def replay_archive(
+    bind: Engine,
+    directory: str,
+    start: date,
+    end: date,
+    workers: int = None,
+    replace: bool = False,
+    aggregates: bool = True,
+):
+    """
+    write the archived payloads of `start` ~ `end` (inclusive) to
+    parkinglotSpace, one transaction per day. The payloads are parsed by a
+    process pool, the next day being parsed while the current one is loaded.
+
+    Without `replace` only the missing rows are added, and folded into the
+    aggregates in the same transaction, the days already compacted are left
+    alone. With it the raw and compacted rows of each day are deleted first
+    (e.g. after a parser fix) and the aggregates are rebuilt from the raw and
+    compacted history at the end. `aggregates` False leaves them as they are
+    """
+    space = model.ParkinglotSpace
+    compact = model.ParkinglotSpaceCompact
+    days = [
+        (day, [path for _, path in group])
+        for day, group in itertools.groupby(
+            archived_files(directory, start, end), key=lambda x: x[0]
+        )
+    ]
+    # the archives usually predate the partitions made ahead by the maintenance
+    create_space_partitions(bind, [day for day, _ in days])
+    with bind.connect() as conn:
+        id_map = dict(
+            conn.execute(
+                select(model.ParkinglotInfo.name, model.ParkinglotInfo.id)
+            ).all()
+        )
+
+    n_files = n_rows = n_inserted = 0
+    started = time.perf_counter()
+    with ProcessPoolExecutor(workers) as pool:
+        parsing = pool.map(parse_archived, days[0][1], chunksize=PARSE_CHUNK) if days else None
+        for i, (day, paths) in enumerate(days):
+            parsed = list(parsing)
+            if i + 1 < len(days):
+                parsing = pool.map(parse_archived, days[i + 1][1], chunksize=PARSE_CHUNK)
+
+            day_started = time.perf_counter()
+            rows = [
+                (id_map[name], *values)
+                for payload in parsed
+                for name, *values in payload
+                if name in id_map
+            ]
+            with bind.begin() as conn:
+                if replace:
+                    conn.execute(delete(space).where(space.updateDate == day))
+                    conn.execute(delete(compact).where(compact.updateDate == day))
+                elif conn.execute(
+                    select(exists().where(compact.updateDate == day))
+                ).scalar():
+                    print("Replay skipped compacted day: ", day)
+                    continue
+                inserted_rows = load_space_rows(conn, rows)
+                if aggregates and not replace:
+                    upsert_space_aggregates(conn, inserted_rows)
+                inserted = len(inserted_rows)
+
+            n_files += len(paths)
+            n_rows += len(rows)
+            n_inserted += inserted
+            elapsed = time.perf_counter() - started
+            print(
+                f"{day}: {len(paths)} payloads, {len(rows)} rows, {inserted} new "
+                f"(load {time.perf_counter() - day_started:.1f} s, "
+                f"{n_rows / elapsed:,.0f} rows/s overall)"
+            )
+
+    # the deleted days were counted in the aggregates, fold is not enough
+    if aggregates and replace and days:
+        with bind.begin() as conn:
+            rebuild_space_aggregates(None, conn)
+
+    elapsed = time.perf_counter() - started
+    print(
+        "Replay archive at: ",
+        datetime.now(),
+        f"(payloads: {n_files}, rows: {n_rows}, new: {n_inserted}, "
+        f"{elapsed:.1f} s, {n_files / max(elapsed, 1e-9):,.0f} payloads/s)",
+    )
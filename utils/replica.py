@@ -0,0 +1,119 @@
+import os
+import time
+import threading
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from sqlalchemy import func, select
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import SQLAlchemyError
+
+from db import model
+from utils.metrics import DB_REPLICA_LAG
+
+# reads go back to the primary once the replica is behind by more than this,
+# one ingest interval by default
+DB_READ_MAX_LAG = float(os.getenv("DB_READ_MAX_LAG", "60"))
+# how often every process checks the lag of the replica
+DB_READ_CHECK_SECONDS = int(os.getenv("DB_READ_CHECK_SECONDS", "15"))
+
+# (max id, max lastSeen) of parkinglotSpace, both only grow with the ingest
+Marker = Tuple[int, datetime]
+
+
+def read_marker(bind: Engine) -> Marker:
+    """
+    how far the ingest got in a database, cheap: both columns are indexed
+    """
+    space = model.ParkinglotSpace
+    with bind.connect() as conn:
+        max_id, last_seen = conn.execute(
+            select(func.max(space.id), func.max(space.lastSeen))
+        ).one()
+
+    return max_id or 0, last_seen or datetime.min
+
+
+def reached(marker: Marker, target: Marker) -> bool:
+    return marker[0] >= target[0] and marker[1] >= target[1]
+
+
+class ReplicaGuard:
+    """
+    tells whether the read replica is fresh enough to serve reads
+
+    the primary's marker is sampled at every check, the lag is the time since
+    the primary first got past what the replica has (0 if it has everything).
+    Without a replica (the read engine is the primary) it is always fresh
+    """
+
+    def __init__(
+        self, primary: Engine, replica: Engine, max_lag: float = DB_READ_MAX_LAG
+    ):
+        self.primary = primary
+        self.replica = replica
+        self.max_lag = max_lag
+        self._lock = threading.Lock()
+        # primary markers the replica has not reached yet, with when they were
+        # seen (None: when the primary got there is unknown)
+        self._pending: List[Tuple[Marker, Optional[float]]] = []
+        # whether the previous check sampled the primary
+        self._sampled = False
+        # (fresh, lag seconds, checked at), stale until the first check
+        self._state: Tuple[bool, Optional[float], Optional[float]] = (
+            not self.enabled,
+            None,
+            None,
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.replica is not self.primary
+
+    @property
+    def fresh(self) -> bool:
+        return self._state[0]
+
+    def info(self) -> dict:
+        fresh, lag, checked_at = self._state
+        return {
+            "enabled": self.enabled,
+            "fresh": fresh,
+            "lag": lag,
+            "checked_at": checked_at,
+        }
+
+    def check(self) -> bool:
+        if not self.enabled:
+            return True
+
+        now = time.time()
+        try:
+            primary_marker = read_marker(self.primary)
+            replica_marker = read_marker(self.replica)
+        except SQLAlchemyError as e:
+            print("Replica check failed: ", e)
+            self._sampled = False
+            self._state = (False, None, now)
+            return False
+
+        with self._lock:
+            # the primary may have got to a marker found at the first check (or
+            # after a failed one) long before, the replica lags behind it for
+            # an unknown time, until it reaches it
+            if not self._pending or self._pending[-1][0] != primary_marker:
+                self._pending.append((primary_marker, now if self._sampled else None))
+            self._sampled = True
+            self._pending = [
+                (marker, seen_at)
+                for marker, seen_at in self._pending
+                if not reached(replica_marker, marker)
+            ]
+            if any(seen_at is None for _, seen_at in self._pending):
+                self._state = (False, None, now)
+            else:
+                lag = now - self._pending[0][1] if self._pending else 0.0
+                self._state = (lag <= self.max_lag, lag, now)
+                DB_REPLICA_LAG.set(lag)
+
+        return self._state[0]
@@ -2,53 +2,322 @@ from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.interval import IntervalTrigger
 from starlette.types import ASGIApp, Receive, Scope, Send
 
-from utils.fetch_parking import fetch_parking
-from utils.process import process_parking_data
-from utils.db_connect import SessionLocal
-from db import model
+from sqlalchemy import bindparam, func, or_, update
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
 
-from datetime import datetime
+from utils.fetch_parking import fetch_raw_all, forget_feed
+from utils.process import ParkingRow, parse_parking_rows
+from utils.db_connect import SessionLocal, engine
+from utils.snapshot import latest_space, present_space
+from utils.prediction import forecaster
+from utils.aggregate import upsert_space_aggregates
+from utils.stream import space_hub
+from utils.metrics import INGEST_ROWS, INGEST_STAGE_DURATION
+from utils.compaction import SPACE_COMPACT_MINUTES
+from utils.maintenance import create_space_partitions
+from utils.spool import ingest_spool
+from utils.archive import feed_archive
+from db import model, schema
 
+import os
+from datetime import datetime, timedelta
+from typing import Dict, List, Tuple
 
-# background getting parking data
-def get_parking_data():
-    db = SessionLocal()
-    data = fetch_parking()
-    parkinglot_li = process_parking_data(data)
-    parkinglot_models = []
+# only store a record when the space of the lot changed, otherwise extend
+# lastSeen of its latest record (within one compaction bucket)
+INGEST_CHANGE_ONLY = os.getenv("INGEST_CHANGE_ONLY", "").lower() in ("1", "true")
+# how far back the followers look for extended records, covers the lots
+# reporting behind the others
+FOLLOW_OVERLAP = timedelta(minutes=10)
+# spooled feed bytes written per transaction when catching up (about a
+# thousand rows per MB of feed)
+INGEST_SPOOL_BATCH_BYTES = int(os.getenv("INGEST_SPOOL_BATCH_BYTES", str(2 << 20)))
+
+
+# parkinglot name -> id, loaded once and refreshed when an unknown name shows up
+parkinglot_id_map: Dict[str, int] = {}
+
+
+def load_parkinglot_id_map(db: Session) -> Dict[str, int]:
+    global parkinglot_id_map
+
+    parkinglot_id_map = dict(
+        db.query(model.ParkinglotInfo.name, model.ParkinglotInfo.id).all()
+    )
+
+    return parkinglot_id_map
+
+
+def build_space_rows(db: Session, parkinglot_li: List[ParkingRow]) -> List[dict]:
+    """
+    map the processed parking data to parkinglotSpace rows
+    """
+    id_map = parkinglot_id_map
+    if any(p.name not in id_map for p in parkinglot_li):
+        id_map = load_parkinglot_id_map(db)
+
+    space_columns = model.ParkinglotSpace.__table__.columns
+    rows = []
     for p in parkinglot_li:
-        # get parkinglot id
-        parking_id = (
-            db.query(model.ParkinglotInfo)
-            .filter(model.ParkinglotInfo.name == p.name)
-            .first()
-            .id
-        )
-        p_dict = p.dict()
+        parking_id = id_map.get(p.name)
+        if parking_id is None:
+            print("Unknown parkinglot, skipped: ", p.name)
+            continue
+
+        p_dict = p._asdict()
         p_dict["parkinglot_id"] = parking_id
+        rows.append(
+            {k: v for k, v in p_dict.items() if k in space_columns and k != "id"}
+        )
 
-        # check if no duplicate data exist (id, data, and time same)
-        if (
-            db.query(model.ParkinglotSpace)
-            .filter(
-                model.ParkinglotSpace.parkinglot_id == p_dict["parkinglot_id"],
-                model.ParkinglotSpace.updateDate == p_dict["updateDate"],
-                model.ParkinglotSpace.updateTime == p_dict["updateTime"]
+    return rows
+
+
+# background getting parking data
+def get_parking_data():
+    # feeds which didn't change since the last cycle are skipped entirely
+    with INGEST_STAGE_DURATION.labels("fetch").time():
+        raw_dict = {k: v for k, v in fetch_raw_all().items() if v is not None}
+    if not raw_dict:
+        print("No new parking data at: ", datetime.now())
+        return
+
+    if feed_archive is not None:
+        try:
+            feed_archive.save(raw_dict)
+        except OSError as e:
+            # the archive is a convenience, the ingest goes on without it
+            print("Failed to archive the raw feeds: ", e)
+
+    try:
+        if ingest_spool is not None:
+            # spooled first, drain_spool writes them to the database
+            with INGEST_STAGE_DURATION.labels("spool").time():
+                ingest_spool.append(raw_dict.values())
+        else:
+            store_parking_data(list(raw_dict.values()))
+    except Exception:
+        # process these payloads again next cycle
+        for target in raw_dict:
+            forget_feed(target)
+        raise
+
+
+def store_parking_data(raw_li: List[bytes]):
+    """
+    parse the raw feeds, write them in one transaction and publish the result
+    """
+    with INGEST_STAGE_DURATION.labels("parse").time():
+        parkinglot_li = []
+        for raw in raw_li:
+            parkinglot_li.extend(parse_parking_rows(raw))
+
+    with INGEST_STAGE_DURATION.labels("write").time():
+        inserted, extended, rows = save_parking_space(parkinglot_li)
+
+    # swap the latest snapshot only after the commit succeeded
+    with INGEST_STAGE_DURATION.labels("publish").time():
+        changed = latest_space.changed(inserted)
+        version = latest_space.swap(list(inserted) + extended)
+        forecaster.observe(list(inserted) + extended)
+        space_hub.publish(version, changed)
+
+    skipped = len(rows) - len(inserted) - len(extended)
+    INGEST_ROWS.labels("inserted").inc(len(inserted))
+    INGEST_ROWS.labels("extended").inc(len(extended))
+    INGEST_ROWS.labels("skipped").inc(skipped)
+    print(
+        "Fetch data and save at: ",
+        datetime.now(),
+        f"(inserted: {len(inserted)}, extended: {len(extended)}, skipped: {skipped})",
+    )
+
+
+def drain_spool(batch_bytes: int = INGEST_SPOOL_BATCH_BYTES):
+    """
+    write the spooled feeds to the database, oldest first, several of them per
+    transaction after an outage. Stops at the first database error, the next
+    run retries from the last committed batch (replays are skipped as
+    duplicates). A feed failing otherwise (e.g. malformed) fails the same way
+    every time: it is found by writing the batch one feed at a time and moved
+    to the dead letters, so it does not hold up the ones after it
+    """
+    if ingest_spool is None:
+        return
+
+    # the change-only ingest compares each feed to the snapshot of the one
+    # before, so its feeds are written one at a time
+    if INGEST_CHANGE_ONLY:
+        batch_bytes = 0
+
+    def write(batch) -> bool:
+        try:
+            store_parking_data([raw for _, raw in batch])
+        except SQLAlchemyError as e:
+            print("Drain ingest spool failed, retrying: ", repr(e))
+            return False
+        except Exception as e:
+            if len(batch) > 1:
+                return all(write([record]) for record in batch)
+            ingest_spool.dead_letter(*batch[0], e)
+        ingest_spool.ack(batch[-1][0])
+        return True
+
+    batch, size = [], 0
+    for position, raw in ingest_spool.pending():
+        batch.append((position, raw))
+        size += len(raw)
+        if size >= batch_bytes:
+            if not write(batch):
+                return
+            batch, size = [], 0
+
+    if batch:
+        write(batch)
+
+
+def refresh_latest_space():
+    """
+    follower side of the ingest: pick up the rows another process inserted or
+    extended since the last refresh
+    """
+    with SessionLocal() as db:
+        if not latest_space.ready:
+            latest_space.load(db)
+            return
+
+        spaces = latest_space.all()
+        last_id = max((s.id for s in spaces), default=0)
+        last_seen = max(
+            (s.updateDatetime for s in spaces if s.updateDatetime), default=None
+        )
+        condition = model.ParkinglotSpace.id > last_id
+        if last_seen is not None:
+            condition = or_(
+                condition, model.ParkinglotSpace.lastSeen > last_seen - FOLLOW_OVERLAP
             )
-            .first()
-            is None
+        rows = (
+            db.query(model.ParkinglotSpace)
+            .filter(condition)
+            .order_by(model.ParkinglotSpace.id)
+            .all()
+        )
+
+    if rows:
+        changed = latest_space.changed(rows)
+        version = latest_space.swap(rows)
+        forecaster.observe([present_space(x) for x in rows])
+        space_hub.publish(version, changed)
+
+
+def report_minute(t: datetime) -> int:
+    return t.hour * 60 + t.minute
+
+
+def compact_bucket(t: datetime) -> int:
+    return report_minute(t) // SPACE_COMPACT_MINUTES
+
+
+def split_unchanged(
+    rows: List[dict],
+) -> Tuple[List[dict], List[schema.ParkinglotSpace], int]:
+    """
+    change-only ingest: split the rows into those to insert and the latest
+    spaces to extend (same space as the latest record of the lot, the minute
+    after it in the same compaction bucket of the same day), drop the repeated
+    ones. An extended record thus stands for one report per minute up to
+    lastSeen, whatever reads it can tell when each report was made
+    """
+    to_insert, extended, repeated = [], [], 0
+    for row in rows:
+        curr = latest_space.get(row["parkinglot_id"])
+        if curr is None or any(
+            getattr(curr, k) != row[k]
+            for k in ("carAvail", "carTotal", "motoAvail", "motoTotal")
+        ):
+            to_insert.append(row)
+            continue
+
+        curr_time = curr.updateDatetime or datetime.combine(
+            curr.updateDate, curr.updateTime
+        )
+        row_time = row["updateDatetime"]
+        if row_time <= curr_time:
+            repeated += 1
+        elif (
+            row_time.date() == curr_time.date()
+            and compact_bucket(row_time) == compact_bucket(curr_time)
+            and report_minute(row_time) - report_minute(curr_time) == 1
         ):
-            parkinglot_models.append(
-                model.ParkinglotSpace(
-                    **{
-                        k: v
-                        for k, v in p_dict.items()
-                        if k in model.ParkinglotSpace.__table__.columns
-                    }
+            extended.append(
+                curr.model_copy(
+                    update=dict(
+                        updateDate=row["updateDate"],
+                        updateDay=row["updateDay"],
+                        updateTime=row["updateTime"],
+                        updateDatetime=row_time,
+                    )
+                )
+            )
+        else:
+            to_insert.append(row)
+
+    return to_insert, extended, repeated
+
+
+def save_parking_space(parkinglot_li: List[ParkingRow]):
+    """
+    write the processed parking data in one multi-row insert, return the
+    inserted rows, the extended spaces (change-only ingest) and all rows
+    """
+    with SessionLocal() as db:
+        rows = build_space_rows(db, parkinglot_li)
+
+        to_insert, extended = rows, []
+        if INGEST_CHANGE_ONLY:
+            to_insert, extended, _ = split_unchanged(rows)
+
+        # one multi-row insert, duplicates (same id, date and time) are skipped
+        inserted = []
+        if to_insert:
+            # feeds replayed from the spool or lots reporting a stale time may
+            # fall before the partitions made ahead by the maintenance job
+            create_space_partitions(engine, {r["updateDate"] for r in to_insert})
+            stmt = (
+                insert(model.ParkinglotSpace)
+                .values(to_insert)
+                .on_conflict_do_nothing(
+                    index_elements=[
+                        model.ParkinglotSpace.parkinglot_id,
+                        model.ParkinglotSpace.updateDate,
+                        model.ParkinglotSpace.updateTime,
+                    ]
                 )
+                .returning(*model.ParkinglotSpace.__table__.columns)
             )
+            inserted = db.execute(stmt).all()
+
+        # unchanged spaces only move lastSeen of the latest record forward
+        if extended:
+            table = model.ParkinglotSpace.__table__
+            db.execute(
+                update(table)
+                .where(table.c.id == bindparam("space_id"))
+                .values(
+                    lastSeen=bindparam("last_seen"),
+                    seenCount=func.coalesce(table.c.seenCount, 1) + 1,
+                ),
+                [
+                    {"space_id": x.id, "last_seen": x.updateDatetime}
+                    for x in extended
+                ],
+            )
+
+        # roll the new rows into the aggregates within the same transaction
+        upsert_space_aggregates(db, list(inserted) + extended)
 
-    db.add_all(parkinglot_models)
-    db.commit()
+        db.commit()
 
-    print("Fetch data and save at: ", datetime.now())
+    return inserted, extended, rows
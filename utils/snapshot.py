@@ -0,0 +1,170 @@
+import threading
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session, aliased
+
+from db import model, schema
+
+
+def query_latest_space(
+    db: Session, parkinglot_ids: Optional[List[int]] = None
+) -> List[model.ParkinglotSpace]:
+    """
+    get the latest ParkinglotSpace row for each parkinglot from the database
+    """
+    subquery = db.query(
+        model.ParkinglotSpace,
+        func.row_number()
+        .over(
+            partition_by=model.ParkinglotSpace.parkinglot_id,
+            order_by=(
+                model.ParkinglotSpace.updateDate.desc(),
+                model.ParkinglotSpace.updateTime.desc(),
+            ),
+        )
+        .label("row_number"),
+    ).subquery()
+
+    # Alias the subquery for easier referencing
+    aliased_parkinglot_space = aliased(model.ParkinglotSpace, subquery)
+
+    query = db.query(aliased_parkinglot_space).filter(subquery.c.row_number == 1)
+    if parkinglot_ids is not None:
+        query = query.filter(subquery.c.parkinglot_id.in_(parkinglot_ids))
+
+    return query.all()
+
+
+def present_space(row) -> schema.ParkinglotSpace:
+    """
+    the space of a record as of the last time it was reported (the change-only
+    ingest extends lastSeen of a record instead of inserting an unchanged one)
+    """
+    space = schema.ParkinglotSpace.model_validate(row, from_attributes=True)
+    last_seen = getattr(row, "lastSeen", None)
+    if last_seen is None:
+        return space
+
+    return space.model_copy(
+        update=dict(
+            updateDate=last_seen.date(),
+            updateDay=last_seen.weekday(),
+            updateTime=last_seen.time(),
+            updateDatetime=last_seen,
+        )
+    )
+
+
+class LatestSpaceSnapshot:
+    """
+    process-local cache holding the latest space of every parkinglot (keyed by
+    ParkinglotInfo.id). The ingest job swaps in a new state after each commit,
+    readers grab the current state without touching the database.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (version, updated_at, {parkinglot_id: space}), replaced as a whole
+        self._state: Tuple[int, Optional[datetime], Dict[int, schema.ParkinglotSpace]] = (
+            0,
+            None,
+            {},
+        )
+
+    @property
+    def version(self) -> int:
+        return self._state[0]
+
+    @property
+    def updated_at(self) -> Optional[datetime]:
+        return self._state[1]
+
+    @property
+    def ready(self) -> bool:
+        return self._state[1] is not None
+
+    def info(self) -> dict:
+        version, updated_at, spaces = self._state
+        age = (datetime.now() - updated_at).total_seconds() if updated_at else None
+        return {
+            "version": version,
+            "updated_at": updated_at,
+            "age_seconds": age,
+            "parkinglots": len(spaces),
+        }
+
+    def headers(self) -> Dict[str, str]:
+        """
+        response headers telling clients which ingest cycle they got
+        """
+        version, updated_at, _ = self._state
+        return {
+            "X-Data-Version": str(version),
+            "X-Data-Updated-At": updated_at.isoformat() if updated_at else "",
+        }
+
+    def get(self, parkinglot_id: int) -> Optional[schema.ParkinglotSpace]:
+        return self._state[2].get(parkinglot_id)
+
+    def get_many(self, parkinglot_ids: Iterable[int]) -> Dict[int, schema.ParkinglotSpace]:
+        spaces = self._state[2]
+        return {i: spaces[i] for i in parkinglot_ids if i in spaces}
+
+    def all(self) -> List[schema.ParkinglotSpace]:
+        return list(self._state[2].values())
+
+    def changed(self, rows: Iterable) -> List[schema.ParkinglotSpace]:
+        """
+        the rows of lots that are new or whose available space differs from
+        the current state
+        """
+        spaces = self._state[2]
+        changed = []
+        for row in rows:
+            curr = spaces.get(row.parkinglot_id)
+            if (
+                curr is None
+                or curr.carAvail != row.carAvail
+                or curr.motoAvail != row.motoAvail
+            ):
+                changed.append(present_space(row))
+
+        return changed
+
+    def swap(self, rows: Iterable) -> int:
+        """
+        merge the newly committed rows into a copy of the current state and
+        replace the state atomically, return the new version
+        """
+        with self._lock:
+            version, _, spaces = self._state
+            new_spaces = dict(spaces)
+            for row in rows:
+                space = present_space(row)
+                curr = new_spaces.get(space.parkinglot_id)
+                if curr is None or (curr.updateDate, curr.updateTime) <= (
+                    space.updateDate,
+                    space.updateTime,
+                ):
+                    new_spaces[space.parkinglot_id] = space
+
+            self._state = (version + 1, datetime.now(), new_spaces)
+
+            return version + 1
+
+    def load(self, db: Session) -> int:
+        """
+        (re)build the whole state from the database
+        """
+        rows = query_latest_space(db)
+        with self._lock:
+            version = self._state[0]
+            spaces = {x.parkinglot_id: present_space(x) for x in rows}
+            self._state = (version + 1, datetime.now(), spaces)
+
+            return version + 1
+
+
+latest_space = LatestSpaceSnapshot()
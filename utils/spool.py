@@ -0,0 +1,209 @@
+import os
+import zlib
+import fcntl
+import struct
+import threading
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from utils.metrics import INGEST_SPOOL_DEAD_LETTERS, INGEST_SPOOL_PENDING
+
+# local write-ahead spool of the fetched feeds, the ingest writes the database
+# from it (see drain_spool) when set
+INGEST_SPOOL_DIR = os.getenv("INGEST_SPOOL_DIR")
+# size from which the spool moves on to a new segment file
+INGEST_SPOOL_SEGMENT_BYTES = int(
+    os.getenv("INGEST_SPOOL_SEGMENT_BYTES", str(64 << 20))
+)
+
+# how often the spooled feeds are written to the database
+INGEST_SPOOL_DRAIN_SECONDS = int(os.getenv("INGEST_SPOOL_DRAIN_SECONDS", "5"))
+
+# record: payload length, crc32 of the payload, zlib compressed feed
+RECORD_HEADER = struct.Struct("<II")
+SEGMENT_PREFIX = "segment-"
+SEGMENT_SUFFIX = ".spool"
+CHECKPOINT = "checkpoint"
+LOCK = "lock"
+# payloads that could not be written (e.g. malformed), kept for a look
+DEAD_LETTER = "dead"
+
+# (segment number, offset after the record)
+Position = Tuple[int, int]
+
+
+class IngestSpool:
+    """
+    append-only spool of the raw feed payloads on local disk. The fetch appends
+    every new payload (one fsync per cycle) before anything touches the
+    database, the drainer reads them back in order and acknowledges a record
+    once it is committed, so a database outage delays the history instead of
+    losing it.
+
+    records live in numbered segment files, the position of the last
+    acknowledged record is kept in the checkpoint file. Every process start
+    opens a new segment, a record torn by a crash is only ever at the end of
+    an older segment and is skipped. One process at a time owns a spool
+    directory.
+    """
+
+    def __init__(
+        self, directory: str, segment_bytes: int = INGEST_SPOOL_SEGMENT_BYTES
+    ):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        # held as long as the process lives, raises BlockingIOError if taken
+        self._owner = open(os.path.join(directory, LOCK), "a")
+        fcntl.flock(self._owner, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+        segments = self.segments()
+        self._segment = segments[-1] + 1 if segments else 1
+        self._file = None
+        self._checkpoint = self._read_checkpoint()
+
+    def _path(self, segment: int) -> str:
+        return os.path.join(
+            self.directory, f"{SEGMENT_PREFIX}{segment:08d}{SEGMENT_SUFFIX}"
+        )
+
+    def segments(self) -> List[int]:
+        return sorted(
+            int(name[len(SEGMENT_PREFIX) : -len(SEGMENT_SUFFIX)])
+            for name in os.listdir(self.directory)
+            if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX)
+        )
+
+    def _read_checkpoint(self) -> Position:
+        try:
+            with open(os.path.join(self.directory, CHECKPOINT)) as f:
+                segment, offset = f.read().split()
+                return int(segment), int(offset)
+        except (OSError, ValueError):
+            return 0, 0
+
+    def append(self, payloads: Iterable[bytes]) -> int:
+        """
+        append the payloads and fsync them once, return the bytes written
+        """
+        data = b"".join(
+            RECORD_HEADER.pack(len(c), zlib.crc32(c)) + c
+            for c in (zlib.compress(p) for p in payloads)
+        )
+        if not data:
+            return 0
+
+        with self._lock:
+            if self._file is not None and self._file.tell() >= self.segment_bytes:
+                self._file.close()
+                self._file = None
+                self._segment += 1
+            if self._file is None:
+                self._file = open(self._path(self._segment), "ab")
+            self._file.write(data)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+        INGEST_SPOOL_PENDING.set(self.pending_bytes())
+
+        return len(data)
+
+    def pending(self) -> Iterator[Tuple[Position, bytes]]:
+        """
+        the records after the checkpoint, oldest first, with their position
+        """
+        checkpoint = self._checkpoint
+        for segment in self.segments():
+            if segment < checkpoint[0]:
+                continue
+            offset = checkpoint[1] if segment == checkpoint[0] else 0
+            with open(self._path(segment), "rb") as f:
+                f.seek(offset)
+                while True:
+                    header = f.read(RECORD_HEADER.size)
+                    if len(header) < RECORD_HEADER.size:
+                        break
+                    length, crc = RECORD_HEADER.unpack(header)
+                    payload = f.read(length)
+                    if len(payload) < length or zlib.crc32(payload) != crc:
+                        # torn by a crash (older segment) or still being written
+                        break
+                    offset += RECORD_HEADER.size + length
+                    yield (segment, offset), zlib.decompress(payload)
+
+    def ack(self, position: Position):
+        """
+        persist the position of the last committed record and delete the
+        segments left behind
+        """
+        tmp_path = os.path.join(self.directory, f".{CHECKPOINT}.tmp")
+        with open(tmp_path, "w") as f:
+            f.write(f"{position[0]} {position[1]}")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, os.path.join(self.directory, CHECKPOINT))
+        self._checkpoint = position
+
+        with self._lock:
+            current = self._segment
+        for segment in self.segments():
+            if segment < min(position[0], current):
+                os.remove(self._path(segment))
+
+        INGEST_SPOOL_PENDING.set(self.pending_bytes())
+
+    def dead_letter(self, position: Position, payload: bytes, error: Exception):
+        """
+        move a payload that can never be written aside, it is acknowledged
+        with the records after it
+        """
+        directory = os.path.join(self.directory, DEAD_LETTER)
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{position[0]:08d}-{position[1]}.feed")
+        with open(f"{path}.tmp", "wb") as f:
+            f.write(payload)
+        os.replace(f"{path}.tmp", path)
+        INGEST_SPOOL_DEAD_LETTERS.inc()
+        print("Ingest spool dead letter: ", path, repr(error))
+
+    def dead_letters(self) -> int:
+        directory = os.path.join(self.directory, DEAD_LETTER)
+        if not os.path.isdir(directory):
+            return 0
+
+        return sum(name.endswith(".feed") for name in os.listdir(directory))
+
+    def pending_bytes(self) -> int:
+        segment, offset = self._checkpoint
+        total = 0
+        for s in self.segments():
+            if s >= segment:
+                size = os.path.getsize(self._path(s))
+                total += size - offset if s == segment else size
+
+        return max(total, 0)
+
+    def info(self) -> dict:
+        return {
+            "segments": len(self.segments()),
+            "pending_bytes": self.pending_bytes(),
+            "checkpoint": self._checkpoint,
+            "dead_letters": self.dead_letters(),
+        }
+
+
+def open_spool(directory: Optional[str]) -> Optional[IngestSpool]:
+    """
+    the spool of `directory`, None if unset or owned by another process (that
+    process then writes the database directly)
+    """
+    if not directory:
+        return None
+    try:
+        return IngestSpool(directory)
+    except BlockingIOError:
+        print("Ingest spool owned by another process, not used: ", directory)
+        return None
+
+
+ingest_spool = open_spool(INGEST_SPOOL_DIR)
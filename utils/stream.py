@@ -0,0 +1,150 @@
+import asyncio
+from datetime import datetime
+from typing import (
+    AsyncIterator,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Set,
+    Tuple,
+)
+
+from db import schema
+from utils.payload import space_list_adapter
+
+# seconds between keep-alive comments on an idle stream
+STREAM_KEEPALIVE = 15
+# events a subscriber may fall behind before it is disconnected
+STREAM_QUEUE_SIZE = 16
+
+
+def sse_event(event: str, data: bytes, event_id: Optional[int] = None) -> bytes:
+    head = f"event: {event}\n"
+    if event_id is not None:
+        head += f"id: {event_id}\n"
+    return head.encode() + b"data: " + data + b"\n\n"
+
+
+class SubscriptionGroup:
+    """
+    subscribers interested in the same set of lots, who share every rendered
+    event
+    """
+
+    def __init__(self, lot_ids: Tuple[int, ...]):
+        self.lot_ids = lot_ids
+        self.queues: Set[asyncio.Queue] = set()
+
+
+class SpaceStreamHub:
+    """
+    fan-out of the space changes to the streaming clients. Clients subscribing
+    to the same lots join one group, each diff is serialized once per group and
+    the same bytes are queued to all of its subscribers. The ingest thread
+    publishes, everything else runs on the event loop.
+    """
+
+    def __init__(self):
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._groups: Dict[Tuple[int, ...], SubscriptionGroup] = {}
+        # lot id -> groups containing it
+        self._lot_groups: Dict[int, Set[SubscriptionGroup]] = {}
+        self.published = 0
+        self.dropped = 0
+
+    def bind(self, loop: asyncio.AbstractEventLoop):
+        self._loop = loop
+
+    def info(self) -> dict:
+        return {
+            "groups": len(self._groups),
+            "subscribers": sum(len(g.queues) for g in self._groups.values()),
+            "published": self.published,
+            "dropped": self.dropped,
+        }
+
+    def subscribe(self, lot_ids: Iterable[int]) -> Tuple[SubscriptionGroup, asyncio.Queue]:
+        key = tuple(sorted(set(lot_ids)))
+        group = self._groups.get(key)
+        if group is None:
+            group = self._groups[key] = SubscriptionGroup(key)
+            for lot_id in key:
+                self._lot_groups.setdefault(lot_id, set()).add(group)
+
+        queue = asyncio.Queue(maxsize=STREAM_QUEUE_SIZE)
+        group.queues.add(queue)
+
+        return group, queue
+
+    def unsubscribe(self, group: SubscriptionGroup, queue: asyncio.Queue):
+        group.queues.discard(queue)
+        if group.queues or self._groups.get(group.lot_ids) is not group:
+            return
+
+        del self._groups[group.lot_ids]
+        for lot_id in group.lot_ids:
+            groups = self._lot_groups.get(lot_id)
+            if groups is not None:
+                groups.discard(group)
+                if not groups:
+                    del self._lot_groups[lot_id]
+
+    def publish(self, version: int, changed: List[schema.ParkinglotSpace]):
+        """
+        hand the lots whose space changed to the event loop, safe to call from
+        any thread
+        """
+        if not changed or self._loop is None or self._loop.is_closed():
+            return
+        self._loop.call_soon_threadsafe(self._fan_out, version, changed)
+
+    def _fan_out(self, version: int, changed: List[schema.ParkinglotSpace]):
+        group_spaces: Dict[SubscriptionGroup, List[schema.ParkinglotSpace]] = {}
+        for space in changed:
+            for group in self._lot_groups.get(space.parkinglot_id, ()):
+                group_spaces.setdefault(group, []).append(space)
+
+        for group, spaces in group_spaces.items():
+            event = sse_event("diff", space_list_adapter.dump_json(spaces), version)
+            for queue in list(group.queues):
+                try:
+                    queue.put_nowait(event)
+                except asyncio.QueueFull:
+                    # too slow, make it reconnect and start over from a snapshot
+                    self.dropped += 1
+                    group.queues.discard(queue)
+                    queue.get_nowait()
+                    queue.put_nowait(None)
+
+        self.published += 1
+
+    async def stream(
+        self,
+        lot_ids: Iterable[int],
+        snapshot: Callable[[], Tuple[int, List[schema.ParkinglotSpace]]],
+    ) -> AsyncIterator[bytes]:
+        """
+        SSE stream of one client: the current space of its lots first, then
+        the diffs. `snapshot` (version, spaces) is only taken once subscribed,
+        so a diff published in between is queued instead of lost
+        """
+        group, queue = self.subscribe(lot_ids)
+        try:
+            version, spaces = snapshot()
+            yield sse_event("snapshot", space_list_adapter.dump_json(spaces), version)
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), STREAM_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    yield f": keep-alive {datetime.now().isoformat()}\n\n".encode()
+                    continue
+                if event is None:
+                    return
+                yield event
+        finally:
+            self.unsubscribe(group, queue)
+
+
+space_hub = SpaceStreamHub()
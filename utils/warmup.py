@@ -0,0 +1,68 @@
+import os
+import time
+import threading
+from datetime import datetime
+from typing import Callable, List, Optional, Tuple
+
+# pause before retrying a failed startup step (e.g. the database is not up yet)
+WARMUP_RETRY_SECONDS = float(os.getenv("WARMUP_RETRY_SECONDS", "5"))
+
+
+class Warmup:
+    """
+    runs the startup steps (schema, caches, scheduler) in a background thread,
+    so a worker accepts connections right away and reports through /health
+    when it is ready to serve. Each step is retried until it succeeds.
+    """
+
+    def __init__(self, retry_seconds: float = WARMUP_RETRY_SECONDS):
+        self.retry_seconds = retry_seconds
+        self.started_at = time.time()
+        # (current step or "ready", ready at, last error), replaced as a whole
+        self._state: Tuple[str, Optional[float], Optional[str]] = (
+            "starting",
+            None,
+            None,
+        )
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def ready(self) -> bool:
+        return self._state[1] is not None
+
+    def info(self) -> dict:
+        step, ready_at, error = self._state
+        return {
+            "status": "ready" if ready_at is not None else "starting",
+            "step": step,
+            "startup_seconds": (ready_at or time.time()) - self.started_at,
+            "error": error,
+        }
+
+    def run(self, steps: List[Tuple[str, Callable]]):
+        for name, step in steps:
+            error = None
+            while True:
+                self._state = (name, None, error)
+                try:
+                    step()
+                    break
+                except Exception as e:
+                    error = f"{name}: {e!r}"
+                    print("Warmup step failed, retrying: ", error)
+                    time.sleep(self.retry_seconds)
+
+        self._state = ("ready", time.time(), None)
+        print(
+            "Warmup done at: ",
+            datetime.now(),
+            f"({self._state[1] - self.started_at:.2f} s)",
+        )
+
+    def start(self, steps: List[Tuple[str, Callable]]) -> threading.Thread:
+        self._thread = threading.Thread(
+            target=self.run, args=(steps,), name="warmup", daemon=True
+        )
+        self._thread.start()
+
+        return self._thread